@@ -22,6 +22,8 @@ from service.utils.errors import classify_error
 from service.tasks.manager import init_task_manager, get_task_manager, cancel_task
 from service.web.routes_api import api_bp
 from service.web.routes_ui import ui_bp
+from service.web.compression import init_compression
+from service.web.server import serve_app
 
 try:
     from flask_cors import CORS
@@ -53,6 +55,7 @@ if CORS: CORS(app)
 # Register Blueprints
 app.register_blueprint(api_bp)
 app.register_blueprint(ui_bp)
+init_compression(app)
 
 # --- Task Manager Initialization ---
 @app.before_request
@@ -99,4 +102,4 @@ if __name__ == '__main__':
     Timer(1, open_browser).start()
 
     app.config['JSON_AS_ASCII'] = False
-    app.run(host='127.0.0.1', port=port, debug=False, use_reloader=False, threaded=True)
+    serve_app(app, host='127.0.0.1', port=port, on_startup=_ensure_tm)
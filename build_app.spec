@@ -123,6 +123,7 @@ _hidden = [
     'tasks',
     'errors',
     'flask_cors',  # 有时被遗漏
+    'waitress',  # service/web/server.py 中延迟导入
 ]
 
 # runtime_fix_path.py 可选：若不存在则移除
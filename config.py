@@ -229,6 +229,9 @@ DOWNLOAD_DIR = str(_DOWNLOAD_PATH)
 # 日志目录
 LOG_DIR = str(_DOWNLOAD_PATH / 'Universal Media Downloader日志')
 
+# 运行状态数据目录（站点策略记忆等，可用 UMD_DATA_DIR 覆盖）
+DATA_DIR = os.environ.get('UMD_DATA_DIR') or str(_DOWNLOAD_PATH / '.umd')
+
 # 检测潜在重复（仅记录，不自动迁移，以免误操作）
 _legacy = detect_legacy_duplicates(_DOWNLOAD_PATH)
 if _legacy:
@@ -301,5 +304,7 @@ except Exception as _e:
     sys.stderr.write(f"[WARN] 创建下载目录失败: {DOWNLOAD_DIR} -> 使用回退目录 {fallback} ({_e})\n")
     DOWNLOAD_DIR = str(fallback)
     LOG_DIR = str(fallback / 'logs')
+    if not os.environ.get('UMD_DATA_DIR'):
+        DATA_DIR = str(fallback / '.umd')
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
     os.makedirs(LOG_DIR, exist_ok=True)
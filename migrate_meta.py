@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+"""
+把已有的 meta.json 附属文件 (sidecar / _meta 目录) 迁移到媒体库 meta 表，供 META_MODE=index 使用
+用法: python migrate_meta.py <下载目录> [--meta-dir DIR] [--db PATH] [--delete]
+"""
+
+import sys
+
+from service.tasks.metastore import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,13 +4,14 @@ import time
 import webbrowser
 import threading
 import multiprocessing
-from app import app # 从我们的“引擎”文件 app.py 中导入 app 实例
+from app import app, _ensure_tm # 从我们的“引擎”文件 app.py 中导入 app 实例
+from service.web.server import serve_app
 
 if __name__ == '__main__':
     multiprocessing.freeze_support()
     
     def run_server():
-        app.run(host='127.0.0.1', port=5000, debug=False, use_reloader=False)
+        serve_app(app, host='127.0.0.1', port=5000, on_startup=_ensure_tm)
     
     server_thread = threading.Thread(target=run_server)
     server_thread.daemon = True
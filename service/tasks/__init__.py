@@ -2,6 +2,7 @@
 tasks 子包：任务管理相关模块
 """
 from .models import Task
+from .events import EventBus
 from .manager import (
     TaskManager,
     init_task_manager,
@@ -11,6 +12,7 @@ from .manager import (
 
 __all__ = [
     'Task',
+    'EventBus',
     'TaskManager',
     'init_task_manager',
     'get_task_manager',
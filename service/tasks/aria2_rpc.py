@@ -0,0 +1,181 @@
+"""
+常驻 aria2c (JSON-RPC) 下载后端
+开启 UMD_ARIA2_RPC=1 后，TaskManager 按需启动一个 aria2c 守护进程 (detect_aria2c 找到的可执行文件)，
+直链 (http/https 单文件) 格式不再为每个任务单独拉起 aria2c，而是通过 RPC 提交到该进程：
+全局连接数 / 并发下载数 / 总带宽统一受控，单任务限速与实时进度由 RPC 获取。
+
+环境变量:
+  UMD_ARIA2_RPC                 1 开启 (默认关闭)
+  UMD_ARIA2_MAX_DOWNLOADS       同时进行的下载数，默认 4
+  UMD_ARIA2_MAX_CONN_PER_SERVER 每服务器连接数上限，默认 16
+  UMD_ARIA2_SPLIT               单文件分段数，默认 16
+  UMD_ARIA2_MAX_OVERALL_SPEED   全局限速 (aria2 语法，如 10M)，默认 0 不限
+  UMD_ARIA2_TASK_MAX_SPEED      单任务限速，默认 0 不限
+"""
+import json
+import logging
+import os
+import secrets
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+from ..utils.dependencies import CREATE_NO_WINDOW
+
+logger = logging.getLogger(__name__)
+
+_TRUTHY = ('1', 'true', 'yes', 'on')
+
+
+def aria2_rpc_enabled() -> bool:
+    return (os.environ.get('UMD_ARIA2_RPC') or '').strip().lower() in _TRUTHY
+
+
+class Aria2RpcError(RuntimeError):
+    pass
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Aria2RpcDaemon:
+    """单个常驻 aria2c 进程及其 JSON-RPC 客户端"""
+
+    def __init__(self, aria2c_path: str, file_allocation: str = 'none'):
+        self.aria2c_path = aria2c_path
+        self.file_allocation = file_allocation
+        self.port = 0
+        self.secret = secrets.token_hex(16)
+        self.proc: Optional[subprocess.Popen] = None
+        self._id = 0
+        self._id_lock = threading.Lock()
+
+    # ---------------- 进程管理 ----------------
+    def start(self, timeout: float = 8.0):
+        self.port = _free_port()
+        cmd = [
+            self.aria2c_path, '--enable-rpc', f'--rpc-listen-port={self.port}', '--rpc-listen-all=false',
+            f'--rpc-secret={self.secret}', f'--stop-with-process={os.getpid()}',
+            f"--max-concurrent-downloads={os.environ.get('UMD_ARIA2_MAX_DOWNLOADS', '4')}",
+            f"--max-connection-per-server={os.environ.get('UMD_ARIA2_MAX_CONN_PER_SERVER', '16')}",
+            f"--split={os.environ.get('UMD_ARIA2_SPLIT', '16')}", '--min-split-size=1M',
+            f"--max-overall-download-limit={os.environ.get('UMD_ARIA2_MAX_OVERALL_SPEED', '0')}",
+            '--continue=true', f'--file-allocation={self.file_allocation}', '--auto-file-renaming=false', '--allow-overwrite=true',
+            '--check-certificate=false', '--retry-wait=2', '--max-tries=10',
+            '--console-log-level=warn', '--summary-interval=0',
+        ]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.DEVNULL, creationflags=CREATE_NO_WINDOW)
+        deadline = time.time() + timeout
+        last_err: Optional[Exception] = None
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                raise Aria2RpcError(f'aria2c 启动后立即退出 (exit={self.proc.returncode})')
+            try:
+                version = self.call('aria2.getVersion', timeout=1.0)
+                logger.info(f"[aria2-rpc] 守护进程已启动 pid={self.proc.pid} port={self.port} version={version.get('version')}")
+                return
+            except Exception as e:
+                last_err = e
+                time.sleep(0.2)
+        self.shutdown()
+        raise Aria2RpcError(f'aria2c RPC 未就绪: {last_err}')
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def shutdown(self):
+        if self.proc is None:
+            return
+        try:
+            if self.alive():
+                self.call('aria2.shutdown', timeout=2.0)
+                self.proc.wait(timeout=3)
+        except Exception:
+            pass
+        if self.alive():
+            try:
+                self.proc.kill()
+            except OSError:
+                pass
+        self.proc = None
+
+    # ---------------- RPC ----------------
+    def call(self, method: str, *params: Any, timeout: float = 5.0) -> Any:
+        with self._id_lock:
+            self._id += 1
+            req_id = self._id
+        body = json.dumps({'jsonrpc': '2.0', 'id': req_id, 'method': method,
+                           'params': [f'token:{self.secret}', *params]}).encode('utf-8')
+        req = urllib.request.Request(f'http://127.0.0.1:{self.port}/jsonrpc', data=body,
+                                     headers={'Content-Type': 'application/json'})
+        # 本机回环地址，绕过系统代理
+        opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+        try:
+            with opener.open(req, timeout=timeout) as resp:
+                data = json.loads(resp.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            try:
+                data = json.loads(e.read().decode('utf-8'))
+            except Exception:
+                raise Aria2RpcError(f'{method}: HTTP {e.code}') from e
+        if data.get('error'):
+            raise Aria2RpcError(f"{method}: {data['error'].get('message')}")
+        return data.get('result')
+
+    def add_uri(self, uri: str, options: Dict[str, Any]) -> str:
+        return self.call('aria2.addUri', [uri], options)
+
+    def tell_status(self, gid: str) -> Dict[str, Any]:
+        return self.call('aria2.tellStatus', gid, ['gid', 'status', 'totalLength', 'completedLength',
+                                                   'downloadSpeed', 'errorCode', 'errorMessage'])
+
+    def remove(self, gid: str):
+        for method in ('aria2.forceRemove', 'aria2.removeDownloadResult'):
+            try:
+                self.call(method, gid, timeout=2.0)
+            except Exception:
+                pass
+
+    def global_stat(self) -> Dict[str, Any]:
+        return self.call('aria2.getGlobalStat')
+
+
+class Aria2Download:
+    """登记到 TaskManager.procs 的句柄：与 Popen 一样提供 poll/kill，取消任务时移除 RPC 下载"""
+
+    def __init__(self, daemon: Aria2RpcDaemon, gids: List[str]):
+        self.daemon = daemon
+        self.gids = gids
+        self.returncode: Optional[int] = None
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def kill(self):
+        for gid in self.gids:
+            self.daemon.remove(gid)
+        self.returncode = -9
+
+
+def download_options(download_dir: str, out_name: str, headers: Optional[Dict[str, str]] = None,
+                     proxy: Optional[str] = None) -> Dict[str, Any]:
+    opts: Dict[str, Any] = {'dir': download_dir, 'out': out_name}
+    if headers:
+        opts['header'] = [f'{k}: {v}' for k, v in headers.items() if v]
+    if proxy:
+        opts['all-proxy'] = proxy
+    task_limit = os.environ.get('UMD_ARIA2_TASK_MAX_SPEED')
+    if task_limit:
+        opts['max-download-limit'] = task_limit
+    return opts
+
+
+__all__ = ['Aria2RpcDaemon', 'Aria2Download', 'Aria2RpcError', 'aria2_rpc_enabled', 'download_options']
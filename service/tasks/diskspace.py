@@ -0,0 +1,213 @@
+"""
+磁盘空间准入控制
+下载开始前按探测信息 (filesize / filesize_approx / tbr×时长) 估算所需空间并登记预留；
+剩余空间 (扣除其它任务尚未落盘的预留与最低保留) 不足时任务进入 waiting_disk 等待，
+其它任务完成/失败释放预留后再放行，避免 8K 任务在合并阶段写满磁盘、连带损坏其它在途任务。
+
+环境变量:
+  UMD_DISK_ADMISSION       0 关闭准入控制 (默认开启)
+  UMD_DISK_MIN_FREE_MB     始终保留的最低剩余空间 (MB)，默认 1024
+  UMD_DISK_MERGE_FACTOR    需要合并/转封装时的空间系数 (组件 + 合并输出同时存在)，默认 2.0
+  UMD_DISK_POLL_SEC        等待空间时的检查间隔 (秒)，默认 5
+"""
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, '') or default)
+    except ValueError:
+        return default
+
+
+DISK_ADMISSION = (os.environ.get('UMD_DISK_ADMISSION') or '1').strip().lower() not in ('0', 'false', 'no', 'off')
+DISK_MIN_FREE = int(_env_float('UMD_DISK_MIN_FREE_MB', 1024) * 1024 * 1024)
+DISK_MERGE_FACTOR = _env_float('UMD_DISK_MERGE_FACTOR', 2.0)
+DISK_POLL_SEC = _env_float('UMD_DISK_POLL_SEC', 5)
+SINGLE_FILE_FACTOR = 1.05  # .part / 元数据等余量
+
+_QUALITY_HEIGHT = {'best8k': 4320, 'best4k': 2160, 'best': 1080, 'auto': 1080, 'fast': 720, '640p': 640}
+
+
+class DiskSpaceError(RuntimeError):
+    pass
+
+
+def _format_bytes(f: Dict[str, Any], duration: Optional[float]) -> Optional[int]:
+    size = f.get('filesize') or f.get('filesize_approx')
+    if size:
+        return int(size)
+    tbr = f.get('tbr') or ((f.get('vbr') or 0) + (f.get('abr') or 0))
+    if tbr and duration:
+        return int(tbr * 1000 / 8 * duration)
+    return None
+
+
+def _height_cap(quality: Optional[str]) -> int:
+    m = re.search(r'height<=\??(\d+)', quality or '')
+    if m:
+        return int(m.group(1))
+    return _QUALITY_HEIGHT.get(quality or 'best', 1080)
+
+
+def _chosen_formats(info: Dict[str, Any], mode: str, quality: Optional[str],
+                    video_format: Optional[str], audio_format: Optional[str]) -> List[Dict[str, Any]]:
+    """推测 yt-dlp 将下载的格式 (探测已选定时直接采用 requested_formats)"""
+    formats: List[Dict[str, Any]] = [f for f in (info.get('formats') or []) if isinstance(f, dict)]
+    by_id = {str(f.get('format_id')): f for f in formats}
+
+    chosen: List[Dict[str, Any]] = []
+    if info.get('requested_formats'):
+        chosen = list(info['requested_formats'])
+    elif video_format or audio_format:
+        chosen = [by_id[i] for i in (video_format, audio_format) if i and i in by_id]
+    elif formats:
+        cap = _height_cap(quality)
+        videos = [f for f in formats if f.get('vcodec') not in (None, 'none') and (f.get('height') or 0) <= cap]
+        audios = [f for f in formats if f.get('acodec') not in (None, 'none') and f.get('vcodec') == 'none']
+        best_video = max(videos, key=lambda f: (f.get('height') or 0, f.get('tbr') or 0), default=None)
+        best_audio = max(audios, key=lambda f: f.get('abr') or f.get('tbr') or 0, default=None)
+        if mode == 'audio_only':
+            chosen = [best_audio] if best_audio else []
+        elif mode == 'video_only':
+            chosen = [best_video] if best_video else []
+        else:
+            chosen = [f for f in (best_video, best_audio) if f]
+            # 已含音轨的视频格式无需再下音频
+            if best_video and best_video.get('acodec') not in (None, 'none'):
+                chosen = [best_video]
+    return chosen
+
+
+def estimate_media_bytes(info: Optional[Dict[str, Any]], mode: str = 'merged', quality: Optional[str] = None,
+                         video_format: Optional[str] = None, audio_format: Optional[str] = None) -> Optional[int]:
+    """所选格式的下载总字节 (不含余量)；信息不足时返回 None"""
+    if not isinstance(info, dict):
+        return None
+    chosen = _chosen_formats(info, mode, quality, video_format, audio_format) or [info]
+    sizes = [_format_bytes(f, info.get('duration')) for f in chosen]
+    return sum(sizes) if sizes and all(sizes) else None
+
+
+def estimate_download_bytes(info: Optional[Dict[str, Any]], mode: str = 'merged', quality: Optional[str] = None,
+                            video_format: Optional[str] = None, audio_format: Optional[str] = None) -> Optional[int]:
+    """按探测信息估算下载所需的峰值磁盘空间；信息不足时返回 None"""
+    if not isinstance(info, dict):
+        return None
+    duration = info.get('duration')
+    chosen = _chosen_formats(info, mode, quality, video_format, audio_format)
+    if not chosen:
+        size = _format_bytes(info, duration)
+        return int(size * SINGLE_FILE_FACTOR) if size else None
+
+    sizes = [_format_bytes(f, duration) for f in chosen]
+    if any(s is None for s in sizes):
+        return None
+    total = sum(sizes)
+    # 分离的视频+音频合并、HLS (.ts) 转封装时，组件与输出文件会同时存在
+    needs_merge = len(chosen) > 1 or any(str(f.get('protocol') or '').startswith('m3u8') for f in chosen)
+    return int(total * (DISK_MERGE_FACTOR if needs_merge and mode != 'audio_only' else SINGLE_FILE_FACTOR))
+
+
+def supports_fast_prealloc(path: str) -> bool:
+    """下载目录所在文件系统是否支持快速预分配 (aria2c --file-allocation=falloc)"""
+    if sys.platform == 'win32':
+        try:
+            import ctypes
+            root = os.path.splitdrive(os.path.abspath(path))[0] + '\\'
+            fs_name = ctypes.create_unicode_buffer(64)
+            ok = ctypes.windll.kernel32.GetVolumeInformationW(ctypes.c_wchar_p(root), None, 0, None, None, None,
+                                                              fs_name, len(fs_name))
+            return bool(ok) and fs_name.value.upper() == 'NTFS'
+        except Exception:
+            return False
+    if not hasattr(os, 'posix_fallocate'):
+        return False
+    probe = os.path.join(path, f'.umd-falloc-{os.getpid()}')
+    try:
+        os.makedirs(path, exist_ok=True)
+        fd = os.open(probe, os.O_CREAT | os.O_WRONLY, 0o600)
+        try:
+            os.posix_fallocate(fd, 0, 1024 * 1024)
+            return True
+        finally:
+            os.close(fd)
+            os.remove(probe)
+    except OSError:
+        return False
+
+
+class DiskReservations:
+    """按任务登记的磁盘空间预留"""
+
+    def __init__(self, path: str, min_free: int = DISK_MIN_FREE, poll: float = DISK_POLL_SEC):
+        self.path = path
+        self.min_free = min_free
+        self.poll = poll
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}  # task_id -> {task, need, since}
+
+    def _free(self) -> int:
+        os.makedirs(self.path, exist_ok=True)
+        return shutil.disk_usage(self.path).free
+
+    @staticmethod
+    def _outstanding(entry: Dict[str, Any]) -> int:
+        # 已落盘的部分已体现在剩余空间里，只计尚未写入的部分
+        return max(entry['need'] - (entry['task'].downloaded_bytes or 0), 0)
+
+    def admit(self, task: Any, need: Optional[int], is_canceled: Callable[[], bool],
+              on_wait: Optional[Callable[[str], None]] = None):
+        """登记预留；被其它任务的预留挤占时阻塞等待其释放，剩余空间本身不足时抛出 DiskSpaceError"""
+        need = int(need or 0)
+        waited = False
+        while True:
+            with self._lock:
+                free = self._free()
+                others = sum(self._outstanding(e) for tid, e in self._entries.items() if tid != task.id)
+                available = free - others - self.min_free
+                if need <= available:
+                    self._entries[task.id] = {'task': task, 'need': need, 'since': time.time()}
+                    return
+                msg = (f"磁盘空间不足: 需要 {need / 1024 ** 3:.2f} GB，剩余 {free / 1024 ** 3:.2f} GB "
+                       f"(其它任务预留 {others / 1024 ** 3:.2f} GB，最低保留 {self.min_free / 1024 ** 3:.2f} GB)")
+            # 不计其它预留也放不下时，等待无济于事 (其它任务完成后只会占用更多空间)
+            if not others or need > free - self.min_free:
+                raise DiskSpaceError(msg)
+            if is_canceled():
+                raise RuntimeError('任务已取消')
+            if not waited and on_wait:
+                on_wait(msg + '，等待其它任务释放空间…')
+            waited = True
+            time.sleep(self.poll)
+
+    def release(self, task_id: str):
+        with self._lock:
+            self._entries.pop(task_id, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            try:
+                usage = shutil.disk_usage(self.path)
+                free, total = usage.free, usage.total
+            except OSError:
+                free = total = None
+            entries = [{'task_id': tid, 'title': e['task'].title, 'need_bytes': e['need'],
+                        'outstanding_bytes': self._outstanding(e), 'since': e['since']}
+                       for tid, e in self._entries.items()]
+        return {'enabled': DISK_ADMISSION, 'path': self.path, 'free_bytes': free, 'total_bytes': total,
+                'min_free_bytes': self.min_free,
+                'reserved_bytes': sum(e['outstanding_bytes'] for e in entries), 'reservations': entries}
+
+
+__all__ = ['DiskReservations', 'DiskSpaceError', 'estimate_download_bytes', 'estimate_media_bytes',
+           'supports_fast_prealloc', 'DISK_ADMISSION']
@@ -2,17 +2,32 @@ import os
 import re
 import json
 import sys
+import errno
+import functools
+import shutil
+import sqlite3
 import time
 import logging
 import subprocess
 import traceback
-from typing import Dict, List, Any, Optional
+from contextlib import ExitStack
+from typing import Callable, Dict, List, Any, Optional
 from urllib.parse import urlparse, urlunparse
 
 from .models import Task
+from ..utils.common import validate_url
 from ..utils.errors import classify_error
-from ..utils.subtitles import normalize_srt_inplace
+from ..utils.subtitles import normalize_subtitle_file
 from ..utils.dependencies import CREATE_NO_WINDOW
+from ..utils.mediaprobe import classify_probe, format_fields, media_fields, probe_media
+from ..utils.thumbcache import get_thumbnail_cache
+from ..utils.tools import get_tool_registry, tool_in_dir
+from .library import DEDUPE_ENABLED, hardlink_duplicate, video_identity
+from .procio import get_process_mux
+from .watchdog import ThroughputWatchdog, STALL_MAX_RESTARTS, stall_event
+from .strategy import DownloadState, FallbackContext, FallbackLadder, FallbackRule, get_strategy_memory, host_key
+from .tuning import get_concurrency_tuner, classify_run_errors
+from .diskspace import estimate_media_bytes
 import site_configs
 
 logger = logging.getLogger(__name__)
@@ -22,7 +37,16 @@ PROBE_TIMEOUT_DEFAULT = 40
 PROBE_TIMEOUT_TWITTER = 55
 PROBE_TIMEOUT_MISSAV = 180
 
-_YTDLP_PLUGIN_DIR_CACHE = None
+# 下载阶段无任何输出超过该秒数视为卡死，直接终止子进程 (合并等阶段不计)
+PROCESS_STALL_TIMEOUT = int(os.environ.get('UMD_STALL_TIMEOUT', '300') or 0)
+
+
+class TaskCanceled(RuntimeError):
+    """下载过程中检测到任务已取消 (与后端自身的 RuntimeError 区分，不应被当作失败回退)"""
+
+    def __init__(self):
+        super().__init__('任务已取消')
+
 
 def _is_impersonate_unavailable_text(text: str) -> bool:
     t = (text or '').lower()
@@ -71,6 +95,74 @@ def _replace_option_value(args: list[str], option: str, value: str) -> list[str]
         replaced.extend([option, value])
     return replaced
 
+_ARIA2C_DOWNLOADER_ARGS = ['--downloader', 'http:aria2c', '--downloader', 'https:aria2c',
+                           '--downloader-args', 'aria2c:-x16 -s16 -k1M -m16 --retry-wait=2 --summary-interval=1']
+
+def _uses_aria2c(args: list[str]) -> bool:
+    return any(a.endswith(':aria2c') for a in args)
+
+# 边下边合并：http(s) 视频+音频交给 yt-dlp 的 FFmpegFD，由单个 ffmpeg 同时拉取两路并直接封装到最终文件，
+# 省去 "下载 .fNNN 组件 -> 再完整读写一遍合并" 的第二遍磁盘 I/O
+_STREAM_MERGE_DOWNLOADER_ARGS = ['--downloader', 'http:ffmpeg']
+STREAM_MERGE_MODE = (os.environ.get('UMD_STREAM_MERGE') or 'auto').strip().lower()
+
+_FFMPEG_TIME_RE = re.compile(r'\btime=\s*(\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+
+def _stream_merge_percent(line: str, done_bytes: int, duration: Optional[float],
+                          expected_bytes: Optional[int]) -> Optional[float]:
+    """ffmpeg 边下边合并的进度行没有百分比：按 time= / 时长估算，无时长时按已下字节 / 所选格式大小"""
+    m = _FFMPEG_TIME_RE.search(line)
+    if m and duration:
+        pos = int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3))
+        return min(pos * 100.0 / duration, 99.9)
+    if expected_bytes:
+        return min(done_bytes * 100.0 / expected_bytes, 99.9)
+    return None
+
+def _uses_stream_merge(args: list[str]) -> bool:
+    return any(a.endswith(':ffmpeg') for a in args)
+
+def _strip_downloader_args(args: list[str]) -> list[str]:
+    return _strip_option_with_value(_strip_option_with_value(args, '--downloader'), '--downloader-args')
+
+def _chunk_size_bytes(chunk: Optional[str]) -> int:
+    m = re.match(r'^(\d+(?:\.\d+)?)([KMG]?)', (chunk or '').upper())
+    if not m:
+        return 0
+    return int(float(m.group(1)) * {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[m.group(2)])
+
+def _stall_strategies(args: list[str], aria2c_available: bool, aria2c_allowed: bool = True) -> list[tuple]:
+    """吞吐崩塌后的候选重启策略 [(描述, 参数变换)]，按顺序逐个尝试"""
+    strategies: list[tuple] = []
+    if _uses_stream_merge(args):
+        # ffmpeg 单连接拉流被限速时，回到分片并发下载 + 事后合并
+        strategies.append(('关闭边下边合并', _strip_downloader_args))
+    if _uses_aria2c(args):
+        strategies.append(('切换内置下载器', _strip_downloader_args))
+    elif aria2c_available and aria2c_allowed:
+        strategies.append(('切换 aria2c', lambda a: _strip_downloader_args(a) + _ARIA2C_DOWNLOADER_ARGS))
+
+    conc = int(_get_option_value(args, '--concurrent-fragments') or 1)
+    chunk = _get_option_value(args, '--http-chunk-size')
+    new_conc = 8 if conc < 8 else 2
+    # 限速源多按请求计速：大块改小块可重新获得突发速度；小块改大块则减少请求开销
+    new_chunk = '1M' if not chunk or _chunk_size_bytes(chunk) >= 4 * 1024 ** 2 else '10M'
+    strategies.append((f'调整并发 {conc}->{new_conc}, 块 {chunk or "默认"}->{new_chunk}',
+                       lambda a: _replace_option_value(_replace_option_value(a, '--concurrent-fragments', str(new_conc)),
+                                                       '--http-chunk-size', new_chunk)))
+
+    if '--proxy' in args:
+        strategies.append(('停用代理直连', lambda a: _strip_option_with_value(a, '--proxy')))
+    return strategies
+
+def _with_resume(args: list[str], previous: list[str]) -> list[str]:
+    """重启时改为 --continue 续传；从 aria2c 切回内置下载器时不续传 (aria2c 分段写入的 .part 不是连续前缀)"""
+    resume = not (_uses_aria2c(previous) and not _uses_aria2c(args))
+    flag, other = ('--continue', '--no-continue') if resume else ('--no-continue', '--continue')
+    if other in args:
+        return [flag if a == other else a for a in args]
+    return args if flag in args else args + [flag]
+
 def _browser_cookie_candidates(preferred: Optional[str] = None) -> list[str]:
     env_browser = (os.environ.get('LUMINA_COOKIE_BROWSER') or os.environ.get('UMD_COOKIE_BROWSER') or '').strip().lower()
     candidates: list[str] = []
@@ -265,33 +357,7 @@ def _has_usable_cookiefile(url: str, cookie_file: str) -> bool:
     return True
 
 def _find_ytdlp_plugin_dir() -> Optional[str]:
-    global _YTDLP_PLUGIN_DIR_CACHE
-    if _YTDLP_PLUGIN_DIR_CACHE is not None:
-        return _YTDLP_PLUGIN_DIR_CACHE or None
-
-    repo_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    candidates = [
-        os.path.join(repo_root, 'yt-dlp-plugins'),
-        os.path.join(repo_root, 'yt-dlp-plugins', 'yt-dlp-plugin-yellow-master'),
-    ]
-    for cand in candidates:
-        if not os.path.isdir(cand):
-            continue
-        plugin_ns = os.path.join(cand, 'yt_dlp_plugins')
-        if os.path.isdir(plugin_ns):
-            _YTDLP_PLUGIN_DIR_CACHE = cand
-            return cand
-        try:
-            for entry in os.listdir(cand):
-                sub_plugin_ns = os.path.join(cand, entry, 'yt_dlp_plugins')
-                if os.path.isdir(sub_plugin_ns):
-                    _YTDLP_PLUGIN_DIR_CACHE = cand
-                    return cand
-        except Exception:
-            continue
-
-    _YTDLP_PLUGIN_DIR_CACHE = ''
-    return None
+    return get_tool_registry().path('plugin_dir')
 
 def _with_plugin_dir_args(args: List[str]) -> List[str]:
     plugin_dir = _find_ytdlp_plugin_dir()
@@ -299,6 +365,43 @@ def _with_plugin_dir_args(args: List[str]) -> List[str]:
         return args
     return [args[0], '--plugin-dirs', plugin_dir, *args[1:]]
 
+def _stream_process(manager: Any, task: Task, args: List[str], on_line, env: Optional[Dict[str, str]] = None,
+                    watchdog: Optional[ThroughputWatchdog] = None) -> Optional[int]:
+    """经 ProcessMux 运行子进程并逐行回调 on_line(line)。
+
+    返回退出码；任务被取消时返回 None (已标记 canceled)。
+    输出由共享的多路复用线程读取，这里每 0.5 秒醒来一次检查取消与卡死；
+    传入 watchdog 时还会在下载阶段检查吞吐，崩塌则终止进程 (原因见 watchdog.tripped)。
+    """
+    proc = get_process_mux().spawn(args, env=env, creationflags=CREATE_NO_WINDOW)
+    manager.procs[task.id] = proc
+    try:
+        for raw in proc.iter_lines(tick=0.5):
+            if task.canceled:
+                proc.kill()
+                manager._update_task(task, status='canceled', stage=None)
+                return None
+            if raw is None:
+                idle = time.time() - proc.last_output_ts
+                if PROCESS_STALL_TIMEOUT and task.stage == 'downloading' and idle > PROCESS_STALL_TIMEOUT:
+                    task.log.append(f'[stall] {int(idle)} 秒无任何输出，终止子进程')
+                    logger.warning(f"Task {task.id} 子进程 {int(idle)}s 无输出，判定卡死")
+                    proc.kill()
+            else:
+                line = raw.rstrip()
+                if line:
+                    on_line(line)
+            if watchdog is not None and not watchdog.tripped and task.stage == 'downloading' and watchdog.check():
+                logger.warning(f"Task {task.id} 吞吐崩塌: {watchdog.tripped}")
+                proc.kill()
+    finally:
+        proc.wait()
+        manager.procs.pop(task.id, None)
+    if task.canceled:
+        # cancel_task 直接终止了进程，输出提前结束
+        return None
+    return proc.returncode
+
 def execute_download(manager: Any, task: Task):
     """Core download logic extracted from tasks.py with full parity"""
     task.attempts += 1
@@ -310,6 +413,7 @@ def execute_download(manager: Any, task: Task):
         manager._update_task(task, status='downloading', stage='fast_start', title=title)
         task.log.append('[fast-path] skip_probe=1，使用前端缓存信息')
         info = {'title': title}
+        probe = task.info_cache
     else:
         manager._update_task(task, status='downloading', stage='fetch_info')
         try:
@@ -318,26 +422,77 @@ def execute_download(manager: Any, task: Task):
             code, msg = classify_error(str(e))
             manager._update_task(task, status='error', error_code=code, error_message=msg)
             raise e
+        probe = info
 
     title = (info.get('title') if isinstance(info, dict) else None) or 'video'
     safe_title = _safe_filename(title)
     base_template = task.filename_template.replace('%(title)s', safe_title)
     manager._update_task(task, title=title)
 
-    # Subtitles only
-    if getattr(task, 'subtitles_only', False):
-        _execute_subtitle_download(manager, task, base_template)
-        return
+    manager.prepare_work_dir(task)
+    with ExitStack() as resources:
+        resources.callback(manager.cleanup_work_dir, task)
+        # Subtitles only
+        if getattr(task, 'subtitles_only', False):
+            _execute_subtitle_download(manager, task, base_template)
+            return
 
-    # Thumbnail only
-    if getattr(task, 'mode', '') == 'thumbnail_only':
-        _execute_thumbnail_download(manager, task, base_template)
-        return
+        # Thumbnail only
+        if getattr(task, 'mode', '') == 'thumbnail_only':
+            _execute_thumbnail_download(manager, task, base_template, probe)
+            return
+
+        # 媒体库中已有同一视频/模式/格式的成品时直接复用
+        if _reuse_library_copy(manager, task, probe):
+            return
 
-    # Media download
-    _execute_media_download(manager, task, base_template)
+        # Media download：网络部分在下载线程内完成，收尾 (合并/探测/重命名/meta) 交给后处理池，
+        # 工作目录与磁盘预留随收尾一起释放
+        resources.enter_context(manager.disk_reservation(task, probe))
+        finalize = _execute_media_download(manager, task, base_template, probe)
+        if finalize is not None and not manager.submit_postprocess(task, finalize, resources):
+            finalize()
 
 def _probe_info(manager: Any, task: Task) -> Dict[str, Any]:
+    """同步执行探测 (下载线程 / Flask 路由使用)"""
+    steps = _probe_info_steps(manager, task)
+    try:
+        cmd, timeout = next(steps)
+        while True:
+            r = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore',
+                               timeout=timeout, creationflags=CREATE_NO_WINDOW)
+            cmd, timeout = steps.send(r)
+    except StopIteration as done:
+        return done.value
+
+async def _probe_info_async(manager: Any, task: Task) -> Dict[str, Any]:
+    """异步执行探测 (ASGI 模式)：与 _probe_info 共享回退逻辑，子进程由 asyncio 等待，不占线程"""
+    steps = _probe_info_steps(manager, task)
+    try:
+        cmd, timeout = next(steps)
+        while True:
+            r = await _run_subprocess_async(cmd, timeout)
+            cmd, timeout = steps.send(r)
+    except StopIteration as done:
+        return done.value
+
+async def _run_subprocess_async(cmd: List[str], timeout: float) -> subprocess.CompletedProcess:
+    import asyncio
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                creationflags=CREATE_NO_WINDOW)
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        try: proc.kill()
+        except ProcessLookupError: pass
+        await proc.wait()
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    decode = lambda b: (b or b'').decode('utf-8', errors='ignore').replace('\r\n', '\n')
+    return subprocess.CompletedProcess(cmd, proc.returncode, decode(out), decode(err))
+
+def _probe_info_steps(manager: Any, task: Task):
+    """探测流程 (sans-IO)：yield (命令, 超时) 交给调用方执行，send 回 CompletedProcess，
+    StopIteration.value 即解析后的 info；同步与异步执行器共用这一套回退逻辑。"""
     resolved_url = _normalize_missav_url_by_cookie(task.url, _select_cookie_file(task.url, manager.cookies_file))
     if resolved_url != task.url:
         logger.info(f"[PROBE] MissAV URL 按 cookie 域名切换为: {resolved_url}")
@@ -419,11 +574,10 @@ def _probe_info(manager: Any, task: Task) -> Dict[str, Any]:
 
     timeout_probe = PROBE_TIMEOUT_TWITTER if is_twitter else (PROBE_TIMEOUT_MISSAV if is_missav else PROBE_TIMEOUT_DEFAULT)
 
-    def _run_probe(current_cmd: List[str]) -> subprocess.CompletedProcess:
+    def _run_probe(current_cmd: List[str]):
         final_cmd = current_cmd + [resolved_url]
         logger.info(f"[PROBE] Final probe cmd: {final_cmd}")
-        return subprocess.run(final_cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore',
-                              timeout=timeout_probe, creationflags=CREATE_NO_WINDOW)
+        return (final_cmd, timeout_probe)
 
     def _parse_probe(proc: subprocess.CompletedProcess) -> Dict[str, Any]:
         out = (proc.stdout or '').strip()
@@ -434,10 +588,14 @@ def _probe_info(manager: Any, task: Task) -> Dict[str, Any]:
             raise RuntimeError("yt-dlp 返回 null")
         if not isinstance(result, dict):
             raise RuntimeError(f"yt-dlp 返回了非对象 JSON: {type(result).__name__}")
+        # 探测结果中的封面地址允许经 /api/thumbnail 代取
+        thumb = _known_thumbnail(result)
+        if thumb:
+            get_thumbnail_cache().remember(thumb['url'])
         return result
 
     probe_cmd = cmd
-    r = _run_probe(probe_cmd)
+    r = yield _run_probe(probe_cmd)
     if r.returncode == 0:
         browser_used = _get_option_value(probe_cmd, '--cookies-from-browser')
         if browser_used:
@@ -448,7 +606,7 @@ def _probe_info(manager: Any, task: Task) -> Dict[str, Any]:
     if '--impersonate' in probe_cmd and _is_impersonate_unavailable_text(err_text):
         logger.warning('[PROBE] 当前 yt-dlp 不支持 impersonate，移除后重试一次')
         probe_cmd = _strip_impersonate_args(probe_cmd)
-        r = _run_probe(probe_cmd)
+        r = yield _run_probe(probe_cmd)
         if r.returncode == 0:
             return _parse_probe(r)
         err_text = (r.stderr or r.stdout or err_text)
@@ -460,7 +618,7 @@ def _probe_info(manager: Any, task: Task) -> Dict[str, Any]:
                     continue
                 logger.warning(f'[PROBE] 浏览器 cookie 复制失败，改试 {browser}')
                 alt_cmd = _replace_option_value(probe_cmd, '--cookies-from-browser', browser)
-                r = _run_probe(alt_cmd)
+                r = yield _run_probe(alt_cmd)
                 alt_err = (r.stderr or r.stdout or err_text)
                 if r.returncode == 0:
                     setattr(task, 'cookie_browser', browser)
@@ -474,7 +632,7 @@ def _probe_info(manager: Any, task: Task) -> Dict[str, Any]:
                     raise RuntimeError('无法读取 MissAV 浏览器 cookies。请关闭 Chrome/Edge/Brave/Firefox 后重试，或设置 UMD_COOKIE_BROWSER=edge（或你的实际浏览器），或先在浏览器中打开 MissAV 通过 Cloudflare 后导出该站点 cookies 到 cookies_missav.txt')
                 logger.warning('[PROBE] 浏览器 cookie 复制失败，回退为无 cookies 再试一次')
                 probe_cmd = _strip_option_with_value(probe_cmd, '--cookies-from-browser')
-                r = _run_probe(probe_cmd)
+                r = yield _run_probe(probe_cmd)
                 if r.returncode == 0:
                     return _parse_probe(r)
                 err_text = (r.stderr or r.stdout or err_text)
@@ -485,19 +643,24 @@ def _probe_info(manager: Any, task: Task) -> Dict[str, Any]:
     if proxy_url and _is_proxy_error_text(err_text):
         logger.warning('[PROBE] 代理连接失败，回退直连重试一次')
         probe_cmd = _strip_option_with_value(probe_cmd, '--proxy')
-        r = _run_probe(probe_cmd)
+        r = yield _run_probe(probe_cmd)
         if r.returncode == 0:
             return _parse_probe(r)
         err_text = (r.stderr or r.stdout or err_text)
 
     raise RuntimeError(err_text)
 
-def _execute_subtitle_download(manager: Any, task: Task, base_template: str):
-    resolved_url = _normalize_missav_url_by_cookie(task.url, _select_cookie_file(task.url, manager.cookies_file))
-    selected_cookie_file = _select_cookie_file(resolved_url, manager.cookies_file)
-    out_base = os.path.join(manager.download_dir, f"{base_template}")
+# 字幕批量模式：每次 yt-dlp 调用处理的 URL 数
+try:
+    SUBTITLE_BATCH_SIZE = max(1, int(os.environ.get('UMD_SUBTITLE_BATCH_SIZE', '') or 50))
+except ValueError:
+    SUBTITLE_BATCH_SIZE = 50
+
+def _subtitle_args(manager: Any, task: Task, urls: List[str], out_tmpl: str, work_dir: str) -> List[str]:
+    """一次 yt-dlp 调用 (可含多个 URL，cookies 按第一个 URL 选择；批量时已按 cookies 分组)"""
+    selected_cookie_file = _select_cookie_file(urls[0], manager.cookies_file)
     args = [manager.ytdlp_path, '--no-warnings', '--no-check-certificate', '--newline', '--ignore-errors',
-            '--skip-download', '--convert-subs', 'srt', '-o', out_base]
+            '--skip-download', '--convert-subs', 'srt', '-o', out_tmpl] + _output_report_args(work_dir)
     args = _with_plugin_dir_args(args)
 
     try:
@@ -515,7 +678,7 @@ def _execute_subtitle_download(manager: Any, task: Task, base_template: str):
     if task.geo_bypass:
         args.append('--geo-bypass')
 
-    if not selected_cookie_file and _should_try_browser_cookies(resolved_url, manager.cookies_file):
+    if not selected_cookie_file and _should_try_browser_cookies(urls[0], manager.cookies_file):
         args += ['--cookies-from-browser', _choose_browser_cookie_source(task)]
     elif selected_cookie_file:
         args += ['--cookies', selected_cookie_file]
@@ -523,49 +686,126 @@ def _execute_subtitle_download(manager: Any, task: Task, base_template: str):
     ffmpeg_path = manager.ffmpeg_locator()
     if ffmpeg_path:
         args += ['--ffmpeg-location', ffmpeg_path]
-    args.append(resolved_url)
-
-    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='ignore', creationflags=CREATE_NO_WINDOW)
-    manager.procs[task.id] = proc
-
-    if proc.stdout:
-        for line in iter(proc.stdout.readline, ''):
-            if task.canceled:
-                try: proc.kill()
-                except Exception: pass
-                manager._update_task(task, status='canceled', stage=None)
-                break
-            line = line.rstrip('\n')
-            if line: task.log.append(line)
+    return args + urls
+
+def _subtitle_batches(manager: Any, urls: List[str]) -> List[List[str]]:
+    """按 cookies 来源分组 (同一次调用只能带一套 cookies)，组内按 SUBTITLE_BATCH_SIZE 切分"""
+    groups: Dict[tuple, List[str]] = {}
+    for url in urls:
+        cookie_file = _select_cookie_file(url, manager.cookies_file)
+        browser = not cookie_file and _should_try_browser_cookies(url, manager.cookies_file)
+        groups.setdefault((cookie_file, browser), []).append(url)
+    return [g[i:i + SUBTITLE_BATCH_SIZE] for g in groups.values() for i in range(0, len(g), SUBTITLE_BATCH_SIZE)]
+
+def _normalize_subtitles(manager: Any, task: Task, subs: List[str]):
+    """规范化全部字幕；多个文件时分发到后处理线程池并行执行"""
+    def one(path: str):
+        try:
+            report = normalize_subtitle_file(path)
+            return f'[subtitle] 规范化 {os.path.basename(path)}: {report.summary()}'
+        except Exception as ne:
+            return f'[subtitle] 合并单行失败 {os.path.basename(path)}: {ne}'
+
+    pool = getattr(manager, 'postprocess_pool', None)
+    if pool is not None and len(subs) > 1:
+        lines = [f.result() for f in [pool.submit(one, p) for p in subs]]
+    else:
+        lines = [one(p) for p in subs]
+    task.log.extend(lines)
 
-    proc.wait()
-    manager.procs.pop(task.id, None)
+def _execute_subtitle_download(manager: Any, task: Task, base_template: str):
+    work_dir = _work_dir(manager, task)
+    batch = bool(task.batch_urls)
+    if batch:
+        # 批量模式：标题与 id 由 yt-dlp 逐个视频填充，id 避免同名视频互相覆盖
+        out_tmpl = os.path.join(work_dir, task.filename_template + ' [%(id)s]')
+        urls = [_normalize_missav_url_by_cookie(u, _select_cookie_file(u, manager.cookies_file)) for u in task.batch_urls]
+        batches = _subtitle_batches(manager, urls)
+        task.log.append(f'[subtitle] 批量模式: {len(urls)} 个 URL，{len(batches)} 次 yt-dlp 调用')
+    else:
+        out_tmpl = os.path.join(work_dir, f"{base_template}")
+        batches = [[_normalize_missav_url_by_cookie(task.url, _select_cookie_file(task.url, manager.cookies_file))]]
+
+    failed = 0
+    for n, urls in enumerate(batches, 1):
+        if batch:
+            manager._update_task(task, stage='subtitles', progress=round((n - 1) * 80.0 / len(batches), 1))
+        rc = _stream_process(manager, task, _subtitle_args(manager, task, urls, out_tmpl, work_dir), task.log.append)
+        if rc is None:
+            return
+        if rc != 0:
+            if not batch:
+                raise RuntimeError(f"字幕下载失败 (exit={rc})")
+            failed += 1
+            task.log.append(f'[subtitle] 第 {n}/{len(batches)} 批部分失败 (exit={rc})，继续下一批')
+
+    reported = _reported_outputs(work_dir)
+    subs = [p for p in (reported['subtitles'] if reported else []) if p.endswith('.srt')]
+    subs = sorted(subs or _scan_outputs(work_dir, '' if batch else os.path.basename(base_template), ('.srt',)))
+    if not subs:
+        raise RuntimeError('找不到生成的字幕文件')
 
-    if proc.returncode != 0:
-        raise RuntimeError(f"字幕下载失败 (exit={proc.returncode})")
+    manager._update_task(task, stage='merging', progress=85.0)
+    _normalize_subtitles(manager, task, subs)
+    published = [_publish_file(manager, task, p) for p in subs]
+    fields: Dict[str, Any] = {'file_path': published[0], 'output_files': published}
+    if failed:
+        fields.update(partial_success=True,
+                      warning_message=f'{failed}/{len(batches)} 批字幕下载部分失败，已保存 {len(published)} 个字幕文件')
+    task.log.append(f'[subtitle] 共 {len(published)} 个字幕文件')
+    manager._update_task(task, status='finished', progress=100.0, stage=None, **fields)
+
+def _known_thumbnail(info: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """探测结果中可直接下载的封面 ({'url', 'http_headers'})；thumbnails 按 yt-dlp 约定越靠后越优先"""
+    if not isinstance(info, dict):
+        return None
+    for t in reversed(info.get('thumbnails') or []):
+        if isinstance(t, dict) and str(t.get('url') or '').startswith(('http://', 'https://')):
+            return {'url': t['url'], 'http_headers': t.get('http_headers') or info.get('http_headers')}
+    thumb = info.get('thumbnail')
+    if isinstance(thumb, str) and thumb.startswith(('http://', 'https://')):
+        return {'url': thumb, 'http_headers': info.get('http_headers')}
+    return None
 
-    chosen = None
-    for fname in os.listdir(manager.download_dir):
-        if fname.startswith(os.path.basename(base_template)) and fname.endswith('.srt'):
-            chosen = os.path.join(manager.download_dir, fname)
-            break
-    if not chosen:
-        raise RuntimeError('找不到生成的字幕文件')
+def _thumbnail_fast_path(manager: Any, task: Task, base_template: str, info: Optional[Dict[str, Any]]) -> bool:
+    """封面 URL 已知时直接下载 (连接池 + 内容寻址缓存)，不启动 yt-dlp；失败返回 False 交回 yt-dlp"""
+    thumb = _known_thumbnail(info)
+    # info_cache 来自前端，与用户提交的 URL 同样需要拦截本地/内网地址
+    if thumb is None or not validate_url(thumb['url']):
+        return False
+    try:
+        import config
+        proxy_url = os.environ.get('LUMINA_PROXY') or os.environ.get('UMD_PROXY') or getattr(config, 'PROXY_URL', '')
+    except ImportError:
+        proxy_url = os.environ.get('LUMINA_PROXY') or os.environ.get('UMD_PROXY', '')
+    headers = {k: v for k, v in (thumb['http_headers'] or {}).items() if k.lower() in ('user-agent', 'referer', 'cookie')}
+    headers.setdefault('Referer', task.url)
 
-    task.file_path = chosen
+    manager._update_task(task, status='downloading', stage='thumbnail')
     try:
-        manager._update_task(task, stage='merging', progress=85.0)
-        normalize_srt_inplace(chosen)
-    except Exception as ne:
-        task.log.append(f'[subtitle] 合并单行失败: {ne}')
+        cached, hit = get_thumbnail_cache().get(thumb['url'], headers=headers, proxy=proxy_url or None,
+                                                want_jpg=True, ffmpeg_bin=_ffmpeg_binary(manager))
+    except Exception as e:
+        task.log.append(f'[thumbnail] 直接下载失败，改用 yt-dlp: {e}')
+        return False
+    task.log.append(f"[thumbnail] {'命中封面缓存' if hit else '已直接下载封面'} ({os.path.basename(cached)})")
+
+    dest = os.path.join(_work_dir(manager, task), f"{base_template}{os.path.splitext(cached)[1]}")
+    shutil.copyfile(cached, dest)  # 不用硬链接：用户修改成品不应影响缓存
+    task.file_path = _publish_file(manager, task, dest)
     manager._update_task(task, status='finished', progress=100.0, stage=None)
+    return True
 
-def _execute_thumbnail_download(manager: Any, task: Task, base_template: str):
+def _execute_thumbnail_download(manager: Any, task: Task, base_template: str,
+                                info: Optional[Dict[str, Any]] = None):
+    if _thumbnail_fast_path(manager, task, base_template, info):
+        return
     resolved_url = _normalize_missav_url_by_cookie(task.url, _select_cookie_file(task.url, manager.cookies_file))
     selected_cookie_file = _select_cookie_file(resolved_url, manager.cookies_file)
-    out_base = os.path.join(manager.download_dir, f"{base_template}.%(ext)s")
+    work_dir = _work_dir(manager, task)
+    out_base = os.path.join(work_dir, f"{base_template}.%(ext)s")
     args = [manager.ytdlp_path, '--no-warnings', '--no-check-certificate', '--newline', '--ignore-errors',
-            '--skip-download', '--write-thumbnail', '--convert-thumbnails', 'jpg', '-o', out_base]
+            '--skip-download', '--write-thumbnail', '--convert-thumbnails', 'jpg', '-o', out_base] + _output_report_args(work_dir)
     args = _with_plugin_dir_args(args)
 
     try:
@@ -589,34 +829,75 @@ def _execute_thumbnail_download(manager: Any, task: Task, base_template: str):
     args.append(resolved_url)
 
     manager._update_task(task, status='downloading', stage='thumbnail')
-    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='ignore', creationflags=CREATE_NO_WINDOW)
-    manager.procs[task.id] = proc
-
-    if proc.stdout:
-        for line in iter(proc.stdout.readline, ''):
-            if task.canceled:
-                try: proc.kill()
-                except Exception: pass
-                manager._update_task(task, status='canceled', stage=None)
-                break
-            line = line.rstrip('\n')
-            if line: task.log.append(line)
+    rc = _stream_process(manager, task, args, task.log.append)
+    if rc is None:
+        return
+    if rc != 0:
+        raise RuntimeError(f"封面下载失败 (exit={rc})")
 
-    proc.wait()
-    manager.procs.pop(task.id, None)
+    reported = _reported_outputs(work_dir)
+    thumbs = (reported['thumbnails'] if reported else []) or \
+        _scan_outputs(work_dir, os.path.basename(base_template), ('.jpg', '.jpeg', '.png', '.webp'))
+    chosen = thumbs[0] if thumbs else None
+    task.file_path = _publish_file(manager, task, chosen) if chosen else None
+    manager._update_task(task, status='finished', progress=100.0, stage=None)
 
-    if proc.returncode != 0:
-        raise RuntimeError(f"封面下载失败 (exit={proc.returncode})")
+def _direct_format_selector(task: Task) -> Optional[str]:
+    """前端明确指定的格式 ID (如 '137+140')；未指定时返回 None，按画质档位选择"""
+    mode = getattr(task, 'mode', 'merged')
+    if task.video_format and task.audio_format and mode == 'merged':
+        return f"{task.video_format}+{task.audio_format}"
+    if task.video_format and mode == 'video_only':
+        return task.video_format
+    if task.audio_format and mode == 'audio_only':
+        return task.audio_format
+    return None
 
-    chosen = None
-    for fname in os.listdir(manager.download_dir):
-        if fname.startswith(os.path.basename(base_template)) and fname.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
-            chosen = os.path.join(manager.download_dir, fname)
-            break
-    task.file_path = chosen
-    manager._update_task(task, status='finished', progress=100.0, stage=None)
+def _reuse_library_copy(manager: Any, task: Task, info: Optional[Dict[str, Any]]) -> bool:
+    """同一视频 (提取器 + ID)、同一模式与格式/画质已下载过且文件未变时直接完成任务"""
+    library = getattr(manager, 'library', None)
+    ident = video_identity(info)
+    if library is None or not DEDUPE_ENABLED or task.force_download or ident is None:
+        return False
+    try:
+        row = library.find_download(ident[0], ident[1], task.mode, format_id=_direct_format_selector(task),
+                                    quality=task.quality)
+    except sqlite3.Error as e:
+        task.log.append(f'[library] 查询失败: {e}')
+        return False
+    if not row:
+        return False
+    task.log.append(f"[library] 该视频已下载过 ({ident[0]}:{ident[1]})，复用已有文件: {row['path']}")
+    manager._update_task(task, status='finished', progress=100.0, stage=None, file_path=row['path'],
+                         filesize=row['filesize'], width=row['width'], height=row['height'],
+                         vcodec=row['vcodec'], acodec=row['acodec'])
+    return True
 
-def _execute_media_download(manager: Any, task: Task, base_template: str):
+def _record_in_library(manager: Any, task: Task, fmt: Optional[Dict[str, Any]], media: Dict[str, Any]):
+    """登记成品；内容与库中已有文件相同时替换为硬链接"""
+    library = getattr(manager, 'library', None)
+    if library is None or not task.file_path or not os.path.exists(task.file_path):
+        return
+    ident = video_identity(fmt) or video_identity(task.info_cache) or (None, None)
+    fields = dict(extractor=ident[0], video_id=ident[1], format_id=(fmt or {}).get('format_id'),
+                  mode=task.mode, quality=task.quality, title=task.title, uploader=task.uploader,
+                  source_url=task.url, width=task.width, height=task.height, vcodec=task.vcodec,
+                  acodec=task.acodec, duration=media.get('duration'), bitrate=media.get('bitrate'),
+                  container=media.get('container'), task_id=task.id, completed_at=time.time())
+    try:
+        row = library.record(task.file_path, **fields)
+        if not DEDUPE_ENABLED:
+            return
+        dup = library.find_duplicate(task.file_path, row['content_hash'], row['filesize'])
+        if dup and hardlink_duplicate(dup, task.file_path):
+            task.log.append(f'[library] 与已有文件内容相同，已改为硬链接: {dup}')
+            library.record(task.file_path, content_hash=row['content_hash'], **fields)
+    except (OSError, sqlite3.Error) as e:
+        task.log.append(f'[library] 登记失败: {e}')
+
+def _execute_media_download(manager: Any, task: Task, base_template: str,
+                            probe: Optional[Dict[str, Any]] = None) -> Optional[Callable[[], None]]:
+    """执行下载；返回待执行的收尾 (finalize)，已在下载线程内完成收尾 (partial-ok) 时返回 None"""
     selected_cookie_file = _select_cookie_file(task.url, manager.cookies_file)
     effective_url = _normalize_missav_url_by_cookie(task.url, selected_cookie_file)
     q = getattr(task, 'quality', 'auto')
@@ -627,16 +908,11 @@ def _execute_media_download(manager: Any, task: Task, base_template: str):
     else:
         forced_container = None
 
-    out_path_template = os.path.join(manager.download_dir, f"{base_template}.%(ext)s")
+    work_dir = _work_dir(manager, task)
+    out_path_template = os.path.join(work_dir, f"{base_template}.%(ext)s")
     task.file_path = out_path_template
 
-    direct_selector = None
-    if task.video_format and task.audio_format and mode == 'merged':
-        direct_selector = f"{task.video_format}+{task.audio_format}"
-    elif task.video_format and mode == 'video_only':
-        direct_selector = task.video_format
-    elif task.audio_format and mode == 'audio_only':
-        direct_selector = task.audio_format
+    direct_selector = _direct_format_selector(task)
 
     def build_adaptive_selector() -> str:
         q_loc = getattr(task, 'quality', 'best')
@@ -684,15 +960,17 @@ def _execute_media_download(manager: Any, task: Task, base_template: str):
                    youtube_auth_with_cookies: bool=False,
                    force_browser_cookies: bool=False,
                    youtube_tv_client: bool=False,
-                   timeout: int=15, retries: int=20, fragment_retries: int=50, retry_sleep: int=2) -> List[str]:
-        fs_str = str(format_selector) if format_selector else 'best'
+                   timeout: int=15, retries: int=20, fragment_retries: int=50, retry_sleep: int=2,
+                   fmt: Optional[str]=None, stream_merge: bool=False) -> List[str]:
+        fs = fmt or format_selector
+        fs_str = str(fs) if fs else 'best'
         a = [str(manager.ytdlp_path), '-f', fs_str,
              '--no-warnings', '--no-check-certificate', '--newline', '--ignore-errors',
              '--socket-timeout', str(timeout), '--retries', str(retries),
              '--fragment-retries', str(fragment_retries), '--retry-sleep', str(retry_sleep),
              '--force-ipv4', '--concurrent-fragments', str(conc), '--http-chunk-size', chunk,
              '--hls-prefer-native', '--no-continue',  # 禁用续传，避免因过期URL导致403
-             '-o', out_path_template]
+             '-o', out_path_template] + _output_report_args(work_dir)
         a = _with_plugin_dir_args(a)
 
         try:
@@ -780,8 +1058,9 @@ def _execute_media_download(manager: Any, task: Task, base_template: str):
             a += ['--write-thumbnail', '--convert-thumbnails', 'jpg']
 
         if use_aria:
-            a += ['--downloader', 'http:aria2c', '--downloader', 'https:aria2c',
-                  '--downloader-args', 'aria2c:-x16 -s16 -k1M -m16 --retry-wait=2 --summary-interval=1']
+            a += _ARIA2C_DOWNLOADER_ARGS
+        elif stream_merge and mode == 'merged' and ffmpeg_path:
+            a += _STREAM_MERGE_DOWNLOADER_ARGS
         a.append(effective_url)
         return a
 
@@ -793,7 +1072,7 @@ def _execute_media_download(manager: Any, task: Task, base_template: str):
             '--socket-timeout', str(to_timeout), '--retries', str(to_retries),
             '-o', out_path_template,
             '--extractor-args', 'youtube:player_client=tv,web'
-        ]
+        ] + _output_report_args(work_dir)
         a = _with_plugin_dir_args(a)
         if explicit_format:
             a += ['-f', explicit_format]
@@ -821,6 +1100,12 @@ def _execute_media_download(manager: Any, task: Task, base_template: str):
         a.append(effective_url)
         return a
 
+    # 边下边合并时 ffmpeg 进度行不含百分比，按探测的时长/所选格式大小换算
+    stream_duration = probe.get('duration') if isinstance(probe, dict) else None
+    stream_expected = estimate_media_bytes(probe, mode=mode, quality=q, video_format=task.video_format,
+                                           audio_format=task.audio_format)
+    run_stats: Dict[str, int] = {'bytes': 0}  # 最近一次 run_once 的下载字节数 (用于站点速度记忆)
+
     def run_once(args: List[str], label: str) -> tuple[int, list[str]]:
         env = None
         if manager.aria2c_path:
@@ -829,40 +1114,77 @@ def _execute_media_download(manager: Any, task: Task, base_template: str):
             if aria_dir and aria_dir not in env.get('PATH', ''):
                 env['PATH'] = aria_dir + os.pathsep + env['PATH']
 
-        logger.info(f"Task {task.id} 媒体下载[{label}]: {' '.join(args)}")
-        proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                                text=True, encoding='utf-8', errors='ignore', env=env,
-                                creationflags=CREATE_NO_WINDOW)
-        manager.procs[task.id] = proc
-        task.log.append(label)
-        recent: list[str] = []
-        try:
-            if proc.stdout:
-                for raw in iter(proc.stdout.readline, ''):
-                    if task.canceled:
-                        try: proc.kill()
-                        except Exception: pass
-                        manager._update_task(task, status='canceled', stage=None)
-                        return 130, recent
-                    line = (raw or '').rstrip('\n')
-                    if not line: continue
-                    task.log.append(line)
-                    recent.append(line)
-                    if len(recent) > 400: recent = recent[-400:]
-
-                    line_str = str(line)
-                    m = re.search(r"\[download\]\s+(\d+(?:\.\d+)?)%", line_str) or re.search(r"\((\d{1,3})%\)", line_str)
-                    if m:
-                        pct = float(m.group(1))
+        strategies = None
+        restarts = 0
+        run_stats['bytes'] = 0
+        while True:
+            logger.info(f"Task {task.id} 媒体下载[{label}]: {' '.join(args)}")
+            task.log.append(label)
+            recent: list[str] = []
+            watchdog = ThroughputWatchdog()
+
+            def on_line(line: str):
+                task.log.append(line)
+                recent.append(line)
+                if len(recent) > 400:
+                    del recent[:-400]
+
+                m = re.search(r"\[download\]\s+(\d+(?:\.\d+)?)%", line) or re.search(r"\((\d{1,3})%\)", line)
+                if m:
+                    pct = float(m.group(1))
+                    if task.first_progress_ts is None:
+                        task.first_progress_ts = time.time()
+                    sample = watchdog.feed(line)
+                    if sample:
+                        done, total, speed = sample
+                        manager._update_task(task, progress=pct, stage='downloading',
+                                             downloaded_bytes=done, total_bytes=total, speed=speed)
+                    else:
+                        manager._update_task(task, progress=pct, stage='downloading')
+                elif line.startswith('size=') or line.startswith('frame='):
+                    # 边下边合并时 ffmpeg 的进度行 (无百分比)
+                    sample = watchdog.feed(line)
+                    if sample:
                         if task.first_progress_ts is None:
                             task.first_progress_ts = time.time()
-                        manager._update_task(task, progress=pct, stage='downloading')
-                    elif 'Merging formats' in line_str or 'Merger' in line_str:
-                        manager._update_task(task, stage='merging')
-        finally:
-            proc.wait()
-            manager.procs.pop(task.id, None)
-        return proc.returncode, recent
+                        fields = {'downloaded_bytes': watchdog.bytes_total, 'speed': watchdog.throughput()}
+                        pct = _stream_merge_percent(line, watchdog.bytes_total, stream_duration, stream_expected)
+                        if pct is not None:
+                            fields['progress'] = round(pct, 1)
+                        manager._update_task(task, stage='downloading', **fields)
+                elif 'Merging formats' in line or 'Merger' in line:
+                    manager._update_task(task, stage='merging')
+
+            rc = _stream_process(manager, task, args, on_line, env=env, watchdog=watchdog)
+            run_stats['bytes'] += watchdog.bytes_total
+            run_conc = _get_option_value(args, '--concurrent-fragments')
+            if rc is not None and run_conc and not _uses_stream_merge(args):
+                get_concurrency_tuner().observe(host_key(effective_url), int(run_conc),
+                                                _get_option_value(args, '--http-chunk-size') or init_chunk,
+                                                watchdog.bytes_total, watchdog.active_seconds,
+                                                classify_run_errors(recent, rc))
+            if rc is None:
+                return 130, recent
+            if not watchdog.tripped:
+                return rc, recent
+
+            # 吞吐崩塌：换一种策略续传，而不是等整条回退链从头再来
+            if strategies is None:
+                strategies = _stall_strategies(args, manager.aria2c_path is not None,
+                                               aria2c_allowed=sc_args.get('use_aria2c') is not False)
+            if restarts >= STALL_MAX_RESTARTS or not strategies:
+                task.log.append(f'[stall] {watchdog.tripped}，重启策略已用尽，交由回退流程处理')
+                return rc, recent
+            desc, transform = strategies.pop(0)
+            restarts += 1
+            bps = watchdog.throughput()
+            task.stall_history.append(stall_event(watchdog.tripped, desc, bps, restarts))
+            task.log.append(f'[stall] {watchdog.tripped}，第 {restarts} 次重启: {desc}')
+            logger.warning(f"Task {task.id} 吞吐崩塌重启 #{restarts}: {desc} ({bps / 1024:.1f} KB/s)")
+            manager._update_task(task, stall_restarts=task.stall_restarts + 1)
+            previous = args
+            args = _with_resume(transform(args), previous)
+            label = f'[stall] 重启 #{restarts}: {desc}' + ('' if '--continue' in args else ' (重新下载)')
 
     fast_start = (os.environ.get('LUMINA_FAST_START') or os.environ.get('UMD_FAST_START','')).lower() in ('1','true','yes')
     site_conf = site_configs.get_site_config(effective_url)
@@ -880,6 +1202,11 @@ def _execute_media_download(manager: Any, task: Task, base_template: str):
         init_conc = 8
         init_chunk = '8M'
 
+    # 按站点历史吞吐调优后的并发/分块 (无历史时沿用上面的静态默认值)
+    init_conc, init_chunk, tune_note = get_concurrency_tuner().suggest(host_key(effective_url), init_conc, init_chunk)
+    if tune_note:
+        task.log.append(tune_note)
+
     use_aria_initial = sc_args.get('use_aria2c')
     if use_aria_initial is None:
         use_aria_initial = _should_use_aria2c(manager, effective_url)
@@ -892,29 +1219,43 @@ def _execute_media_download(manager: Any, task: Task, base_template: str):
     to_retries = sc_args.get('retries', 20)
     to_frag_retries = sc_args.get('fragment_retries', 50)
 
-    downloader_desc = "aria2c" if use_aria_initial else "内置下载器"
-    proxy_failed = False
-    youtube_auth_with_cookies = False
-    force_browser_cookies = False
-    youtube_tv_client = False
-    rc, recent = run_once(build_args(init_conc, init_chunk, use_aria=use_aria_initial, extra_args=extra_download_args,
-                                     force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                     timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries),
-                          f"[speed] 使用{downloader_desc} (并发={init_conc}, 块={init_chunk}, IPv4)")
-
-    stripped_impersonate_args = _strip_impersonate_args(extra_download_args)
-    if rc != 0 and len(stripped_impersonate_args) != len(extra_download_args) and _has_impersonate_unavailable(recent):
-        task.log.append('[fallback] 当前 yt-dlp 不支持 --impersonate，移除后重试…')
-        logger.warning(f"Task {task.id} 当前 yt-dlp 不支持 impersonate，移除参数后重试")
-        extra_download_args = stripped_impersonate_args
-        rc, recent = run_once(build_args(init_conc, init_chunk, use_aria=use_aria_initial, extra_args=extra_download_args,
-                                         force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                         timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries),
-                              '[fallback] 移除 impersonate 后重试')
-
-    # 调试：记录首次下载结果
-    logger.info(f"Task {task.id} 首次下载结果: rc={rc}, output_lines={len(recent)}")
-    if rc != 0:
+    # UMD_STREAM_MERGE: auto (默认，合并模式且有 ffmpeg 时开启；YouTube 对不分块的单连接限速，排除) / 1 / 0
+    stream_merge_initial = (
+        mode == 'merged' and not use_aria_initial and bool(manager.ffmpeg_locator())
+        and (STREAM_MERGE_MODE in ('1', 'true', 'yes', 'on') or (STREAM_MERGE_MODE == 'auto' and not is_youtube)))
+
+    downloader_desc = "aria2c" if use_aria_initial else ("内置下载器+边下边合并" if stream_merge_initial else "内置下载器")
+    initial_state = DownloadState(
+        format_selector=format_selector, conc=init_conc, chunk=init_chunk, use_aria=bool(use_aria_initial),
+        stream_merge=stream_merge_initial,
+        extra_args=extra_download_args, timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries)
+
+    def reprobe() -> str:
+        _probe_info(manager, task)
+        return build_adaptive_selector()
+
+    ctx = FallbackContext(
+        host=host_key(effective_url), is_youtube=is_youtube, mode=mode, skip_probe=bool(task.skip_probe),
+        aria2c_available=manager.aria2c_path is not None, direct_selector=direct_selector,
+        adaptive_selector=adaptive_selector, initial=initial_state, hooks={'reprobe': reprobe},
+        tuned_fields=('conc', 'chunk'))
+
+    def execute_state(state: DownloadState, label: str) -> tuple[int, list[str]]:
+        if state.minimal:
+            args = build_youtube_minimal_args(force_no_proxy=state.force_no_proxy,
+                                              use_browser_cookie=state.minimal_browser_cookie,
+                                              explicit_format=state.explicit_format)
+        else:
+            args = build_args(state.conc, state.chunk, use_aria=state.use_aria, extra_args=state.extra_args,
+                              force_no_proxy=state.force_no_proxy, youtube_auth_with_cookies=state.youtube_auth_with_cookies,
+                              force_browser_cookies=state.force_browser_cookies, youtube_tv_client=state.youtube_tv_client,
+                              timeout=state.timeout, retries=state.retries, fragment_retries=state.fragment_retries,
+                              fmt=state.format_selector, stream_merge=state.stream_merge)
+        return run_once(args, label)
+
+    def log_first_failure(rc: int, recent: list[str]):
+        # 调试：记录首次下载结果
+        logger.info(f"Task {task.id} 首次下载结果: rc={rc}, output_lines={len(recent)}")
         task.log.append(f"[debug] 首次下载失败 (exit={rc}), skip_probe={task.skip_probe}")
         if recent:
             task.log.append("[debug] 首次下载最后20行输出:")
@@ -922,136 +1263,39 @@ def _execute_media_download(manager: Any, task: Task, base_template: str):
                 task.log.append(f"  > {line}")
                 logger.error(f"Task {task.id} yt-dlp output: {line}")
 
-    if rc != 0 and _has_proxy_error(recent):
-        task.log.append('[net] 检测到代理连接错误，回退直连重试…')
-        proxy_failed = True
-        rc, recent = run_once(build_args(init_conc, init_chunk, use_aria=False, extra_args=extra_download_args,
-                                         force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                         timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries),
-                              '[fallback] 代理失败后直连重试')
-
-    if rc != 0 and is_youtube and _is_youtube_signin_error(recent):
-        youtube_auth_with_cookies = True
-        task.log.append('[fallback] YouTube 要求登录验证，切换 cookies 鉴权重试…')
-        rc, recent = run_once(build_args(init_conc, init_chunk, use_aria=False, extra_args=extra_download_args,
-                                         force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                         timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries),
-                              '[fallback] YouTube cookies 鉴权重试')
-
-    if rc != 0 and task.skip_probe:
-        joined_tail = '\n'.join(recent[-40:]).lower()
-        if any(k in joined_tail for k in ['requested format not available','no such format','unable to download video data','404']):
-            info = _probe_info(manager, task)
-            format_selector = build_adaptive_selector()
-            rc, recent = run_once(build_args(init_conc, init_chunk, use_aria=False, extra_args=extra_download_args,
-                                             force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                             timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries),
-                                  '[fallback] 补 probe 后重试')
-
-    if rc != 0 and direct_selector is not None and adaptive_selector:
-        format_selector = adaptive_selector
-        rc, recent = run_once(build_args(init_conc, init_chunk, use_aria=False, extra_args=extra_download_args,
-                                         force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                         timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries),
-                              '[fallback] 自适应格式首次尝试')
-
-    # Format not available fallback - 直接使用 best
-    if rc != 0:
-        joined_tail = '\n'.join(recent[-40:]).lower()
-        if 'requested format is not available' in joined_tail or 'no such format' in joined_tail:
-            task.log.append('[fallback] 请求的格式不可用，回退到 best 格式')
-            logger.warning(f"Task {task.id} 格式不可用，使用 best 回退")
-            format_selector = 'best'
-            rc, recent = run_once(build_args(init_conc, init_chunk, use_aria=False, extra_args=extra_download_args,
-                                             force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                             timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries),
-                                  '[fallback] 使用 best 格式重试')
-
-    if rc != 0 and is_youtube and youtube_auth_with_cookies and not force_browser_cookies and _is_format_unavailable(recent):
-        force_browser_cookies = True
-        task.log.append('[fallback] YouTube 格式不可用，尝试浏览器 cookies 重试…')
-        rc, recent = run_once(build_args(init_conc, init_chunk, use_aria=False, extra_args=extra_download_args,
-                                         force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                         timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries),
-                              '[fallback] 浏览器 cookies 重试')
-
-    if rc != 0 and is_youtube and force_browser_cookies and _is_browser_cookie_copy_error(recent):
-        force_browser_cookies = False
-        youtube_tv_client = True
-        task.log.append('[fallback] 浏览器 cookies 读取失败，回退 cookies.txt + tv client 重试…')
-        rc, recent = run_once(build_args(init_conc, init_chunk, use_aria=False, extra_args=extra_download_args,
-                                         force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                         timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries),
-                              '[fallback] cookies.txt + tv client 重试')
-
-    if rc != 0 and is_youtube and youtube_auth_with_cookies and _is_format_unavailable(recent) and not youtube_tv_client:
-        youtube_tv_client = True
-        task.log.append('[fallback] YouTube 格式仍不可用，尝试 tv client 重试…')
-        rc, recent = run_once(build_args(init_conc, init_chunk, use_aria=False, extra_args=extra_download_args,
-                                         force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                         timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries),
-                              '[fallback] tv client 重试')
-
-    # Merge corruption fallback
-    if rc != 0 and mode == 'merged' and _is_merge_corruption(recent):
-        try:
-            height_cap_match = re.search(r"height<=\??(\d+)", str(format_selector))
-            cap = height_cap_match.group(1) if height_cap_match else None
-            if cap:
-                fallback_selector = f"bv[ext=mp4][height<=?{cap}]+ba[ext=m4a]/best[height<=?{cap}]/b"
-            else:
-                fallback_selector = "bv[ext=mp4]+ba[ext=m4a]/best/b"
-            task.log.append(f"[retry] 合并失败疑似损坏，使用保守格式回退: {fallback_selector}")
-            logger.warning(f"Task {task.id} 首次合并失败，回退格式选择器重试")
-            format_selector = fallback_selector
-            rc, recent = run_once(build_args(4, '4M', use_aria=False, extra_args=extra_download_args,
-                                             force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                             timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries),
-                                  '[retry] 回退格式重试 (mp4/m4a 优先)')
-        except Exception as _fb_e:
-            task.log.append(f"[retry] 回退格式构建异常: {_fb_e}")
-
-    # SSL EOF fallback
-    if rc != 0 and _has_ssl_eof(recent):
-        task.log.append('[net] 检测到 SSLEOF/连接被对端提前关闭，降低并发与增大分块后重试…')
-        rc, recent = run_once(build_args(2, '8M', use_aria=False, extra_args=extra_download_args,
-                                         force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                         timeout=to_timeout), '[speed] 内置下载器降级重试 (并发=2, 块=8M, IPv4)')
-
-    if rc != 0 and _has_ssl_eof(recent):
-        if manager.aria2c_path:
-            task.log.append('[net] 仍失败，切换 aria2c 兜底重试…')
-            rc, recent = run_once(build_args(2, '8M', use_aria=True, extra_args=extra_download_args,
-                                             force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                             timeout=to_timeout), '[speed] 使用 aria2c 兜底 (-x16 -s16 -k1M)')
-
-    if rc != 0 and is_youtube and youtube_auth_with_cookies and _is_format_unavailable(recent) and not youtube_tv_client:
-        youtube_tv_client = True
-        task.log.append('[fallback] 后期重试后仍格式不可用，切换 tv client 再试一次…')
-        rc, recent = run_once(build_args(init_conc, init_chunk, use_aria=False, extra_args=extra_download_args,
-                                         force_no_proxy=proxy_failed, youtube_auth_with_cookies=youtube_auth_with_cookies, force_browser_cookies=force_browser_cookies, youtube_tv_client=youtube_tv_client,
-                                         timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries),
-                              '[fallback] tv client 终极重试')
-
-    if rc != 0 and is_youtube and _is_format_unavailable(recent):
-        task.log.append('[fallback] YouTube 仍提示格式不可用，尝试最小参数模式重试…')
-        rc, recent = run_once(build_youtube_minimal_args(force_no_proxy=proxy_failed, use_browser_cookie=False),
-                              '[fallback] YouTube 最小参数重试')
-
-    if rc != 0 and is_youtube and _is_format_unavailable(recent) and not _is_browser_cookie_copy_error(recent):
-        task.log.append('[fallback] 最小参数仍失败，尝试最小参数 + 浏览器 cookies…')
-        rc, recent = run_once(build_youtube_minimal_args(force_no_proxy=proxy_failed, use_browser_cookie=True),
-                              '[fallback] YouTube 最小参数 + 浏览器 cookies')
-
-    if rc != 0 and is_youtube and _is_format_unavailable(recent):
-        task.log.append('[fallback] 尝试兼容格式 18/best（360p）…')
-        rc, recent = run_once(build_youtube_minimal_args(force_no_proxy=proxy_failed, use_browser_cookie=False, explicit_format='18/best'),
-                              '[fallback] YouTube 兼容格式 18/best')
+    # 直连后端：常驻 aria2c (UMD_ARIA2_RPC=1) 处理 http 直链，原生 HLS 引擎处理 m3u8；
+    # 都需要先用 yt-dlp -J 解析所选格式，不适用或失败时回到下面的 yt-dlp 回退链
+    rpc = manager.get_aria2_rpc() if use_aria_initial else None
+    want_hls = _native_hls_wanted(effective_url)
+    if rpc is not None or want_hls:
+        resolve_args = build_args(init_conc, init_chunk, use_aria=False, extra_args=extra_download_args,
+                                  timeout=to_timeout, retries=to_retries, fragment_retries=to_frag_retries,
+                                  fmt=format_selector)
+        info = _resolve_selected_formats(manager, task, resolve_args)
+        if info is not None:
+            proxy = _get_option_value(resolve_args, '--proxy')
+            protocols = {f.get('protocol') for f in (info.get('requested_formats') or [info])}
+            handled = False
+            if want_hls and protocols <= {'m3u8', 'm3u8_native'}:
+                handled = _native_hls_download(manager, task, info, base_template, workers=init_conc,
+                                               proxy=proxy, impersonate=sc_args.get('impersonate'))
+            elif rpc is not None:
+                handled = _aria2_rpc_download(manager, task, rpc, info, base_template, proxy)
+            if handled:
+                return functools.partial(_finalize_download, manager, task, base_template, mode)
+        task.log.append('[direct] 回退到常规 yt-dlp 下载流程')
+
+    ladder = FallbackLadder(_MEDIA_FALLBACK_RULES, get_strategy_memory(), task.log.append)
+    rc, recent, final_state = ladder.run(ctx, execute_state,
+                                         f"[speed] 使用{downloader_desc} (并发={init_conc}, 块={init_chunk}, IPv4)",
+                                         on_first_failure=log_first_failure,
+                                         measure=lambda: run_stats['bytes'])
+    format_selector = final_state.format_selector
 
     if rc != 0:
         _check_partial_success(manager, task, base_template)
-        # If rc became 0, skip re-raise
-        if task.status == 'finished': rc = 0
+        # partial-ok 已在下载线程内完成收尾
+        if task.status == 'finished': return None
 
     if rc != 0:
         # 记录 yt-dlp 输出的最后几行，帮助诊断问题
@@ -1093,7 +1337,7 @@ def _execute_media_download(manager: Any, task: Task, base_template: str):
             task.log.append('[retry] 回退后仍发生合并/输入解析失败，建议降低质量或更新 yt-dlp')
         raise RuntimeError(f"媒体下载失败 (exit={rc})")
 
-    _finalize_download(manager, task, base_template, mode)
+    return functools.partial(_finalize_download, manager, task, base_template, mode)
 
 def _has_ssl_eof(lines: list[str]) -> bool:
     text = '\n'.join(lines).lower()
@@ -1159,13 +1403,425 @@ def _should_use_aria2c(manager: Any, url: str) -> bool:
     except Exception:
         return True
 
+def _tail_has(lines: list[str], *markers: str, n: int = 40) -> bool:
+    t = '\n'.join(lines[-n:]).lower()
+    return any(m in t for m in markers)
+
+def _merge_fallback_selector(selector: str) -> str:
+    height_cap_match = re.search(r"height<=\??(\d+)", str(selector))
+    cap = height_cap_match.group(1) if height_cap_match else None
+    if cap:
+        return f"bv[ext=mp4][height<=?{cap}]+ba[ext=m4a]/best[height<=?{cap}]/b"
+    return "bv[ext=mp4]+ba[ext=m4a]/best/b"
+
+# 媒体下载回退规则表 (按顺序匹配；由 strategy.FallbackLadder 执行)
+# applies 只看上下文与当前参数，symptom 只看 yt-dlp 输出；症状在重试后消失即视为该规则有效
+# 改变格式选择 (降画质) 的规则只对当前视频有意义，不作为站点首选路径记忆 (learnable=False)
+_MEDIA_FALLBACK_RULES: List[FallbackRule] = [
+    FallbackRule(
+        'impersonate_unavailable', '[fallback] 移除 impersonate 后重试',
+        applies=lambda c, s: '--impersonate' in s.extra_args,
+        symptom=_has_impersonate_unavailable,
+        transform=lambda c, s: s.evolve(extra_args=_strip_impersonate_args(s.extra_args)),
+        message='[fallback] 当前 yt-dlp 不支持 --impersonate，移除后重试…'),
+    FallbackRule(
+        'no_stream_merge', '[fallback] 关闭边下边合并重试',
+        applies=lambda c, s: s.stream_merge and not s.use_aria,
+        symptom=lambda lines: _tail_has(lines, 'ffmpeg exited', 'ffmpeg could not be found',
+                                        'error opening input', 'conversion failed'),
+        transform=lambda c, s: s.evolve(stream_merge=False),
+        message='[fallback] ffmpeg 边下边合并失败，改为分别下载后合并…'),
+    FallbackRule(
+        'direct_after_proxy_error', '[fallback] 代理失败后直连重试',
+        applies=lambda c, s: not s.force_no_proxy,
+        symptom=_has_proxy_error,
+        transform=lambda c, s: s.evolve(force_no_proxy=True, use_aria=False),
+        message='[net] 检测到代理连接错误，回退直连重试…'),
+    FallbackRule(
+        'youtube_cookies_auth', '[fallback] YouTube cookies 鉴权重试',
+        applies=lambda c, s: c.is_youtube and not s.youtube_auth_with_cookies,
+        symptom=_is_youtube_signin_error,
+        transform=lambda c, s: s.evolve(youtube_auth_with_cookies=True, use_aria=False),
+        message='[fallback] YouTube 要求登录验证，切换 cookies 鉴权重试…'),
+    FallbackRule(
+        'reprobe_after_skip_probe', '[fallback] 补 probe 后重试',
+        applies=lambda c, s: c.skip_probe,
+        symptom=lambda lines: _tail_has(lines, 'requested format not available', 'no such format',
+                                        'unable to download video data', '404'),
+        transform=lambda c, s: s.evolve(format_selector=c.hooks['reprobe'](), use_aria=False),
+        cost=1.2, learnable=False),
+    FallbackRule(
+        'adaptive_format', '[fallback] 自适应格式首次尝试',
+        applies=lambda c, s: bool(c.direct_selector and c.adaptive_selector) and s.format_selector != c.adaptive_selector,
+        symptom=lambda lines: True,
+        transform=lambda c, s: s.evolve(format_selector=c.adaptive_selector, use_aria=False),
+        learnable=False),
+    FallbackRule(
+        'best_format', '[fallback] 使用 best 格式重试',
+        applies=lambda c, s: s.format_selector != 'best',
+        symptom=lambda lines: _tail_has(lines, 'requested format is not available', 'no such format'),
+        transform=lambda c, s: s.evolve(format_selector='best', use_aria=False),
+        message='[fallback] 请求的格式不可用，回退到 best 格式', learnable=False),
+    FallbackRule(
+        'youtube_browser_cookies', '[fallback] 浏览器 cookies 重试',
+        applies=lambda c, s: c.is_youtube and s.youtube_auth_with_cookies and not s.force_browser_cookies,
+        symptom=_is_format_unavailable,
+        transform=lambda c, s: s.evolve(force_browser_cookies=True, use_aria=False),
+        message='[fallback] YouTube 格式不可用，尝试浏览器 cookies 重试…'),
+    FallbackRule(
+        'cookiefile_tv_client', '[fallback] cookies.txt + tv client 重试',
+        applies=lambda c, s: c.is_youtube and s.force_browser_cookies,
+        symptom=_is_browser_cookie_copy_error,
+        transform=lambda c, s: s.evolve(force_browser_cookies=False, youtube_tv_client=True, use_aria=False),
+        message='[fallback] 浏览器 cookies 读取失败，回退 cookies.txt + tv client 重试…'),
+    FallbackRule(
+        'youtube_tv_client', '[fallback] tv client 重试',
+        applies=lambda c, s: c.is_youtube and s.youtube_auth_with_cookies and not s.youtube_tv_client,
+        symptom=_is_format_unavailable,
+        transform=lambda c, s: s.evolve(youtube_tv_client=True, use_aria=False),
+        message='[fallback] YouTube 格式仍不可用，尝试 tv client 重试…'),
+    FallbackRule(
+        'merge_safe_format', '[retry] 回退格式重试 (mp4/m4a 优先)',
+        applies=lambda c, s: c.mode == 'merged',
+        symptom=lambda lines: _is_merge_corruption(lines),
+        transform=lambda c, s: s.evolve(format_selector=_merge_fallback_selector(s.format_selector),
+                                        conc=4, chunk='4M', use_aria=False, stream_merge=False),
+        message='[retry] 合并失败疑似损坏，使用保守格式 (mp4/m4a) 回退', learnable=False),
+    FallbackRule(
+        'ssl_eof_builtin', '[speed] 内置下载器降级重试 (并发=2, 块=8M, IPv4)',
+        applies=lambda c, s: True,
+        symptom=lambda lines: _has_ssl_eof(lines),
+        transform=lambda c, s: s.evolve(conc=2, chunk='8M', use_aria=False, retries=20, fragment_retries=50),
+        message='[net] 检测到 SSLEOF/连接被对端提前关闭，降低并发与增大分块后重试…'),
+    FallbackRule(
+        'ssl_eof_aria2c', '[speed] 使用 aria2c 兜底 (-x16 -s16 -k1M)',
+        applies=lambda c, s: c.aria2c_available and not s.use_aria,
+        symptom=lambda lines: _has_ssl_eof(lines),
+        transform=lambda c, s: s.evolve(conc=2, chunk='8M', use_aria=True, retries=20, fragment_retries=50),
+        message='[net] 仍失败，切换 aria2c 兜底重试…'),
+    FallbackRule(
+        'youtube_tv_client_late', '[fallback] tv client 终极重试',
+        applies=lambda c, s: c.is_youtube and s.youtube_auth_with_cookies and not s.youtube_tv_client,
+        symptom=_is_format_unavailable,
+        transform=lambda c, s: s.evolve(youtube_tv_client=True, use_aria=False, conc=c.initial.conc, chunk=c.initial.chunk,
+                                        retries=c.initial.retries, fragment_retries=c.initial.fragment_retries),
+        message='[fallback] 后期重试后仍格式不可用，切换 tv client 再试一次…'),
+    FallbackRule(
+        'youtube_minimal', '[fallback] YouTube 最小参数重试',
+        applies=lambda c, s: c.is_youtube and not s.minimal,
+        symptom=_is_format_unavailable,
+        transform=lambda c, s: s.evolve(minimal=True, minimal_browser_cookie=False, explicit_format=None),
+        message='[fallback] YouTube 仍提示格式不可用，尝试最小参数模式重试…', learnable=False),
+    FallbackRule(
+        'youtube_minimal_browser_cookies', '[fallback] YouTube 最小参数 + 浏览器 cookies',
+        applies=lambda c, s: c.is_youtube and s.minimal and not s.minimal_browser_cookie and s.explicit_format is None,
+        symptom=lambda lines: _is_format_unavailable(lines) and not _is_browser_cookie_copy_error(lines),
+        transform=lambda c, s: s.evolve(minimal_browser_cookie=True),
+        message='[fallback] 最小参数仍失败，尝试最小参数 + 浏览器 cookies…', learnable=False),
+    FallbackRule(
+        'youtube_format_18', '[fallback] YouTube 兼容格式 18/best',
+        applies=lambda c, s: c.is_youtube and s.minimal and s.explicit_format is None,
+        symptom=_is_format_unavailable,
+        transform=lambda c, s: s.evolve(minimal_browser_cookie=False, explicit_format='18/best'),
+        message='[fallback] 尝试兼容格式 18/best（360p）…', learnable=False),
+]
+
+NATIVE_HLS_MODE = (os.environ.get('UMD_NATIVE_HLS') or 'auto').strip().lower()
+_NATIVE_HLS_AUTO_HOSTS = ('missav', 'jable.tv')
+
+def _native_hls_wanted(url: str) -> bool:
+    """UMD_NATIVE_HLS: auto (默认，仅 MissAV/Jable) / 1 (所有 HLS) / 0 (关闭)"""
+    if NATIVE_HLS_MODE in ('0', 'false', 'no', 'off'):
+        return False
+    if NATIVE_HLS_MODE in ('1', 'true', 'yes', 'on'):
+        return True
+    u = (url or '').lower()
+    return any(h in u for h in _NATIVE_HLS_AUTO_HOSTS)
+
+def _resolve_selected_formats(manager: Any, task: Task, resolve_args: List[str]) -> Optional[Dict[str, Any]]:
+    """用 yt-dlp -J 解析所选格式 (含直链/协议/请求头)；失败返回 None"""
+    lines: List[str] = []
+    manager._update_task(task, stage='resolving')
+    rc = _stream_process(manager, task, resolve_args + ['-J', '--no-playlist'], lines.append)
+    if rc is None:
+        raise TaskCanceled()
+    payload = next((l for l in reversed(lines) if l.startswith('{')), None)
+    if rc != 0 or not payload:
+        task.log.append(f'[direct] 解析所选格式失败 (exit={rc})')
+        return None
+    try:
+        return json.loads(payload)
+    except ValueError:
+        task.log.append('[direct] 解析输出不是有效 JSON')
+        return None
+
+def _native_hls_download(manager: Any, task: Task, info: Dict[str, Any], base_template: str,
+                         workers: int, proxy: Optional[str], impersonate: Optional[str] = None) -> bool:
+    """用原生 HLS 引擎下载所选 m3u8 格式；失败返回 False 交回 yt-dlp。
+    .part 与续传状态写在按视频标识/格式分配的续传目录 (manager.resume_dir)，不随任务工作目录删除，
+    重试同一视频的新任务从已写入的分片继续；完成后移入工作目录。"""
+    from .hls import HlsDownloader, HlsError, cffi_requests, parse_ytdlp_cookies
+
+    if cffi_requests is None:
+        impersonate = None
+    formats = info.get('requested_formats') or [info]
+    base_name = os.path.basename(base_template)
+    work_dir = _work_dir(manager, task)
+    ident = video_identity(info)
+    stream_key = ':'.join(ident) if ident else re.sub(r'[?#].*$', '', task.url)
+    task.log.append(f"[hls] 原生 HLS 引擎: {len(formats)} 个格式, 并行 {workers}"
+                    + (f", 伪装 {impersonate}" if impersonate else ''))
+    if task.first_progress_ts is None:
+        task.first_progress_ts = time.time()
+    # 选中的 cookies 文件/浏览器 cookies 已在 -J 解析时载入，yt-dlp 把作用于该格式的 cookies 放在 cookies 字段
+    # (旧版放在 http_headers['Cookie'])；需要 cookies 却两处都没有时交给 yt-dlp，避免白跑一次 403
+    needs_cookies = bool(_select_cookie_file(task.url, manager.cookies_file)
+                         or _should_try_browser_cookies(task.url, manager.cookies_file))
+    for f in formats:
+        headers = f.get('http_headers') or info.get('http_headers') or {}
+        cookies = parse_ytdlp_cookies(f.get('cookies') or info.get('cookies'), f['url'])
+        if needs_cookies and not cookies and not any(k.lower() == 'cookie' for k in headers):
+            task.log.append(f"[hls] 格式 {f.get('format_id')} 需要 cookies 但解析结果未携带，交给 yt-dlp")
+            return False
+        engine = HlsDownloader(headers=headers, proxy=proxy, workers=workers, impersonate=impersonate,
+                               cookies=cookies)
+        try:
+            pl = engine.load_playlist(f['url'])
+            # fMP4 (EXT-X-MAP) 直接得到 mp4；MPEG-TS 先写 .ts 再无损转封装
+            ext = 'mp4' if pl.init_uri else 'ts'
+            stem = f"{base_name}.f{f.get('format_id')}" if len(formats) > 1 else base_name
+            out_path = os.path.join(work_dir, f"{stem}.{ext}")
+            resume_dir = manager.resume_dir(f"hls|{stream_key}|{f.get('format_id')}|{ext}")
+            resume_path = os.path.join(resume_dir, f"stream.{ext}")
+            if os.path.exists(resume_path + '.hls.json'):
+                task.log.append(f"[hls] 发现格式 {f.get('format_id')} 的续传状态，从已写入的分片继续")
+
+            def on_progress(done: int, total: int, nbytes: int, speed: float):
+                manager._update_task(task, stage='downloading', progress=round(done * 100.0 / total, 1),
+                                     downloaded_bytes=nbytes, speed=speed)
+
+            engine.download(f['url'], resume_path, on_progress=on_progress, is_canceled=lambda: task.canceled, playlist=pl)
+            os.replace(resume_path, out_path)
+            shutil.rmtree(resume_dir, ignore_errors=True)
+        except HlsError as e:
+            engine.close()
+            if task.canceled:
+                raise TaskCanceled()
+            task.log.append(f'[hls] 原生引擎失败: {e}')
+            return False
+        except Exception as e:
+            engine.close()
+            task.log.append(f'[hls] 原生引擎异常: {e}')
+            return False
+        if ext == 'ts':
+            out_path = _remux_ts_to_mp4(manager, task, out_path)
+        _record_outputs(work_dir, [out_path], info=info)
+    return True
+
+def _remux_ts_to_mp4(manager: Any, task: Task, ts_path: str) -> str:
+    """ffmpeg -c copy 转封装为 mp4；无 ffmpeg 或失败时保留 .ts"""
+    ffmpeg_bin = _ffmpeg_binary(manager)
+    if not ffmpeg_bin:
+        task.log.append('[hls] 未找到 ffmpeg，保留 .ts 文件')
+        return ts_path
+    mp4_path = os.path.splitext(ts_path)[0] + '.mp4'
+    manager._update_task(task, stage='merging')
+    pm = subprocess.run([ffmpeg_bin, '-y', '-loglevel', 'error', '-i', ts_path, '-map', '0', '-c', 'copy',
+                         '-bsf:a', 'aac_adtstoasc', '-movflags', '+faststart', mp4_path],
+                        capture_output=True, text=True, encoding='utf-8', errors='ignore', creationflags=CREATE_NO_WINDOW)
+    if pm.returncode == 0 and os.path.exists(mp4_path):
+        os.remove(ts_path)
+        task.log.append('[hls] 已转封装为 mp4')
+        return mp4_path
+    task.log.append(f'[hls] 转封装失败 (exit={pm.returncode})，保留 .ts: {pm.stderr[-160:]}')
+    try:
+        os.remove(mp4_path)
+    except OSError:
+        pass
+    return ts_path
+
+def _aria2_rpc_download(manager: Any, task: Task, rpc: Any, info: Dict[str, Any], base_template: str,
+                        proxy: Optional[str]) -> bool:
+    """把所选格式的直链提交给常驻 aria2c 下载。
+
+    仅处理 http/https 直链 (分片/HLS/DASH 或需要 cookies 的格式不适用)；
+    不适用或下载失败返回 False，由常规 yt-dlp 流程接手。多个格式 (视频+音频) 按
+    <base>.f<id>.<ext> 命名，交给 _finalize_download 的组件合并。
+    """
+    from .aria2_rpc import Aria2Download, download_options
+
+    formats = info.get('requested_formats') or [info]
+    for f in formats:
+        if f.get('protocol') not in ('http', 'https') or not f.get('url'):
+            task.log.append(f"[aria2-rpc] 格式 {f.get('format_id')} 协议为 {f.get('protocol')}，非直链，交给 yt-dlp")
+            return False
+        if f.get('cookies'):
+            task.log.append(f"[aria2-rpc] 格式 {f.get('format_id')} 需要 cookies，交给 yt-dlp")
+            return False
+
+    base_name = os.path.basename(base_template)
+    work_dir = _work_dir(manager, task)
+    gids: List[str] = []
+    out_paths: List[str] = []
+    for f in formats:
+        ext = f.get('ext') or 'mp4'
+        out_name = f"{base_name}.f{f.get('format_id')}.{ext}" if len(formats) > 1 else f"{base_name}.{ext}"
+        out_paths.append(os.path.join(work_dir, out_name))
+        try:
+            gids.append(rpc.add_uri(f['url'], download_options(work_dir, out_name,
+                                                                f.get('http_headers') or info.get('http_headers'), proxy)))
+        except Exception as e:
+            task.log.append(f'[aria2-rpc] 提交下载失败: {e}')
+            for gid in gids:
+                rpc.remove(gid)
+            return False
+    task.log.append(f"[aria2-rpc] 已提交 {len(gids)} 个直链到常驻 aria2c (格式 {'+'.join(str(f.get('format_id')) for f in formats)})")
+
+    handle = Aria2Download(rpc, gids)
+    manager.procs[task.id] = handle
+    try:
+        if task.first_progress_ts is None:
+            task.first_progress_ts = time.time()
+        while True:
+            if task.canceled:
+                handle.kill()
+                raise TaskCanceled()
+            statuses = [rpc.tell_status(gid) for gid in gids]
+            total = sum(int(st.get('totalLength') or 0) for st in statuses)
+            done = sum(int(st.get('completedLength') or 0) for st in statuses)
+            speed = float(sum(int(st.get('downloadSpeed') or 0) for st in statuses))
+            failed = [st for st in statuses if st.get('status') in ('error', 'removed')]
+            if failed:
+                msg = failed[0].get('errorMessage') or failed[0].get('status')
+                task.log.append(f"[aria2-rpc] 下载失败 (code={failed[0].get('errorCode')}): {msg}")
+                handle.kill()
+                return False
+            pct = done * 100.0 / total if total else 0.0
+            manager._update_task(task, stage='downloading', progress=round(pct, 1),
+                                 downloaded_bytes=done, total_bytes=total or None, speed=speed)
+            if all(st.get('status') == 'complete' for st in statuses):
+                task.log.append(f'[aria2-rpc] 下载完成 ({done / 1024 / 1024:.1f} MiB)')
+                _record_outputs(work_dir, out_paths, info=info)
+                return True
+            time.sleep(0.5)
+    except TaskCanceled:
+        raise
+    except Exception as e:
+        task.log.append(f'[aria2-rpc] RPC 异常: {e}')
+        handle.kill()
+        return False
+    finally:
+        manager.procs.pop(task.id, None)
+        for gid in gids:
+            rpc.remove(gid)
+
+_SIDECAR_EXTS = ('.srt', '.vtt', '.ass', '.lrc', '.jpg', '.jpeg', '.png', '.webp', '.description', '.info.json')
+_PARTIAL_EXTS = ('.part', '.ytdl', '.hls.json', '.tmp', '.umd-move')
+
+# 产物报告：yt-dlp 在 after_video 阶段 (合并/转换/移动之后) 把最终文件路径追加到工作目录的 JSON Lines 文件，
+# 结果发现直接读报告，不再按文件名前缀扫描目录
+_OUTPUT_REPORT = '.outputs.jsonl'
+# 选中格式的字段随产物一并报告，收尾时据此填充媒体信息而不必再跑 ffprobe
+# extractor_key/id 为视频标识，供媒体库去重
+_REPORT_FORMAT_KEYS = ('format_id', 'width', 'height', 'vcodec', 'acodec', 'tbr', 'duration', 'ext', 'extractor_key', 'id')
+_OUTPUT_REPORT_TEMPLATE = ('after_video:{"media": %(requested_downloads.:.filepath)j, '
+                           '"subtitles": %(requested_subtitles.:.filepath)j, "thumbnails": %(thumbnails.:.filepath)j, '
+                           '"format": %(.{' + ','.join(_REPORT_FORMAT_KEYS) + '})j}')
+# 1 = 收尾时始终用 ffprobe 校验实际文件 (默认仅在格式信息不完整时探测)
+VERIFY_MEDIA = (os.environ.get('UMD_VERIFY_MEDIA') or '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+def _output_report_args(work_dir: str, report: str = _OUTPUT_REPORT) -> List[str]:
+    # FILE 参数同样按输出模板解析，路径中的 % 需要转义
+    return ['--print-to-file', _OUTPUT_REPORT_TEMPLATE, os.path.join(work_dir, report).replace('%', '%%')]
+
+def _record_outputs(work_dir: str, media: List[str], report: str = _OUTPUT_REPORT,
+                    info: Optional[Dict[str, Any]] = None):
+    """直连后端 (原生 HLS / aria2c RPC) 自行登记产物，格式与 yt-dlp 的报告一致"""
+    fmt = {k: info.get(k) for k in _REPORT_FORMAT_KEYS if info.get(k) is not None} if info else {}
+    with open(os.path.join(work_dir, report), 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'media': media, 'subtitles': [], 'thumbnails': [], 'format': fmt},
+                           ensure_ascii=False) + '\n')
+
+def _reported_outputs(work_dir: str, report: str = _OUTPUT_REPORT) -> Optional[Dict[str, Any]]:
+    """读取产物报告 (后写入的记录优先，只保留仍存在的文件)；没有可用记录时返回 None
+    返回 {'media': [...], 'subtitles': [...], 'thumbnails': [...], 'format': 最新记录的选中格式字段}"""
+    try:
+        with open(os.path.join(work_dir, report), 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    out: Dict[str, List[str]] = {'media': [], 'subtitles': [], 'thumbnails': []}
+    fmt: Dict[str, Any] = {}
+    for line in reversed(lines):
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        if not fmt and isinstance(rec.get('format'), dict):
+            fmt = rec['format']
+        for key, paths in out.items():
+            for path in rec.get(key) or []:
+                if isinstance(path, str) and path not in paths and os.path.isfile(path):
+                    paths.append(path)
+    return {**out, 'format': fmt} if any(out.values()) else None
+
+def _scan_outputs(work_dir: str, base_name: str, exts: Optional[tuple] = None) -> List[str]:
+    """没有产物报告时的兜底：只扫描任务自己的工作目录 (base_name 为空时不按文件名过滤)"""
+    found = []
+    for fname in sorted(os.listdir(work_dir)):
+        if (base_name and not fname.startswith(base_name + '.')) or '%(ext)s' in fname or fname.endswith(_PARTIAL_EXTS):
+            continue
+        if (exts is None and fname.lower().endswith(_SIDECAR_EXTS)) or (exts and not fname.lower().endswith(exts)):
+            continue
+        found.append(os.path.join(work_dir, fname))
+    return found
+
+def _work_dir(manager: Any, task: Task) -> str:
+    """任务的临时工作目录 (分片/.part/合并都在这里进行)；未分配时退回下载目录"""
+    return task.temp_dir or manager.download_dir
+
+def _unique_path(path: str) -> str:
+    if not os.path.exists(path):
+        return path
+    root, ext = os.path.splitext(path)
+    n = 2
+    while os.path.exists(f"{root} ({n}){ext}"):
+        n += 1
+    return f"{root} ({n}){ext}"
+
+def _move_atomic(src: str, dest: str):
+    """同卷直接 rename；跨卷先复制为目标目录内的临时文件再 rename，下载目录里不会出现半截文件"""
+    try:
+        os.replace(src, dest)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    tmp = dest + '.umd-move'
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+    os.remove(src)
+
+def _publish_file(manager: Any, task: Task, path: str, sidecars: Optional[List[str]] = None) -> str:
+    """把工作目录中的成品 (及字幕/封面等附属文件) 移入下载目录，返回最终路径"""
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(manager.download_dir):
+        return path
+    dest = _unique_path(os.path.join(manager.download_dir, os.path.basename(path)))
+    _move_atomic(path, dest)
+    task.log.append(f"[publish] 已移入下载目录 -> {os.path.basename(dest)}")
+    for side in sidecars or []:
+        try:
+            _move_atomic(side, _unique_path(os.path.join(manager.download_dir, os.path.basename(side))))
+        except OSError as e:
+            task.log.append(f"[publish] 附属文件移动失败 {os.path.basename(side)}: {e}")
+    return dest
+
 def _check_partial_success(manager: Any, task: Task, base_template: str):
     base_name_tmp = os.path.basename(base_template)
-    for fname in os.listdir(manager.download_dir):
-        if not fname.startswith(base_name_tmp + '.'): continue
-        if re.search(r"\.f\d+\.", fname): continue
-        if '%(ext)s' in fname: continue
-        fullp = os.path.join(manager.download_dir, fname)
+    work_dir = _work_dir(manager, task)
+    reported = _reported_outputs(work_dir)
+    for fullp in (reported['media'] if reported else _scan_outputs(work_dir, base_name_tmp)):
+        if re.search(r"\.f\d+\.", os.path.basename(fullp)): continue
         if os.path.isfile(fullp) and os.path.getsize(fullp) > 100 * 1024:
             task.log.append('[partial-ok] 发现已生成合并文件且大小正常')
             task.file_path = fullp
@@ -1176,21 +1832,29 @@ def _finalize_download(manager: Any, task: Task, base_template: str, mode: str):
     """Complete download finalization with file resolution, renaming, and meta generation"""
     # Resolve actual file path
     base_name = os.path.basename(base_template)
+    work_dir = _work_dir(manager, task)
     merged_candidate: Optional[str] = None
     component_files: List[str] = []
     comp_re = re.compile(rf"^{re.escape(base_name)}\.f(\d+)\.")
-    for fname in os.listdir(manager.download_dir):
-        if not fname.startswith(base_name + '.') or '%(ext)s' in fname:
-            continue
-        fullp = os.path.join(manager.download_dir, fname)
-        if comp_re.search(fname):
+    reported = _reported_outputs(work_dir)
+    if reported:
+        candidates = reported['media']
+        sidecars = reported['subtitles'] + reported['thumbnails']
+    else:
+        task.log.append('[detect] 未收到产物报告，扫描任务工作目录')
+        candidates = _scan_outputs(work_dir, base_name)
+        sidecars = _scan_outputs(work_dir, base_name, _SIDECAR_EXTS)
+    for fullp in candidates:
+        if comp_re.search(os.path.basename(fullp)):
             component_files.append(fullp)
-        else:
+        elif merged_candidate is None:
             merged_candidate = fullp
 
+    derived = None
     if merged_candidate and os.path.exists(merged_candidate):
         task.file_path = merged_candidate
         task.log.append(f"[detect] 发现已合并文件: {os.path.basename(merged_candidate)}")
+        derived = _derived_media_fields(task, reported['format'] if reported else None)
     elif component_files:
         # Try component merge first
         if _component_merge(manager, task, base_template, component_files):
@@ -1206,18 +1870,25 @@ def _finalize_download(manager: Any, task: Task, base_template: str, mode: str):
             task.log.append(f"[detect] 未发现合并文件，组件文件数: {len(component_files)}，暂用: {os.path.basename(selected_component)}")
             task.log.append("[component-scan] 组件文件: " + ', '.join(os.path.basename(p) for p in component_files))
 
-    _fill_media_metadata(manager, task)
+    media = _fill_media_metadata(manager, task, derived)
 
     # Audio fallback if no audio codec detected in merged mode
     component_merged = False
     if mode == 'merged' and not task.canceled:
         no_audio = not getattr(task, 'acodec', None)
+        # acodec 可能只是所选格式的声明：仅在要求校验或 yt-dlp 输出表明合并失败/被跳过时才探测实际文件
+        if not no_audio and (VERIFY_MEDIA or _merge_unconfirmed(task.log)) \
+                and _file_has_audio(manager, task.file_path) is False:
+            task.log.append('[detect] 所选格式含音频，但成品中没有音轨')
+            manager._update_task(task, acodec=None)
+            no_audio = True
         if no_audio:
             if _audio_fallback(manager, task, base_template):
                 component_merged = True
 
-    # Final metadata fill
-    _fill_media_metadata(manager, task)
+    # Final metadata fill (文件被补救合并替换后以实际文件为准)
+    if component_merged:
+        media = _fill_media_metadata(manager, task)
 
     suffix_applied = False
     # Rename file with resolution suffix
@@ -1229,7 +1900,7 @@ def _finalize_download(manager: Any, task: Task, base_template: str, mode: str):
             if not re.search(r"_(\d{3,4})p$", root_name):
                 new_root = f"{root_name}_{height_val}p"
                 new_name = new_root + ext
-                new_path = os.path.join(manager.download_dir, new_name)
+                new_path = os.path.join(work_dir, new_name)
                 try:
                     if not os.path.exists(new_path):
                         os.rename(original_path, new_path)
@@ -1239,47 +1910,54 @@ def _finalize_download(manager: Any, task: Task, base_template: str, mode: str):
                 except Exception as re_err:
                     task.log.append(f"[rename] 添加高度后缀失败: {re_err}")
 
+    # 从任务工作目录移入下载目录 (连同同名字幕/封面)
+    if task.file_path and os.path.exists(task.file_path):
+        task.file_path = _publish_file(manager, task, task.file_path, sidecars)
+
     # Write meta file
     if task.file_path and os.path.exists(task.file_path):
-        _write_meta_file(manager, task, task.file_path, suffix_applied)
+        _write_meta_file(manager, task, task.file_path, suffix_applied, media)
+        _record_in_library(manager, task, reported['format'] if reported else None, media)
 
     manager._update_task(task, status='finished', progress=100.0, stage=None)
 
-def _fill_media_metadata(manager: Any, task: Task):
+def _derived_media_fields(task: Task, fmt: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """由产物报告中的选中格式推导媒体字段；报告缺字段时按 format_id 回查探测信息 (info_cache)"""
+    if not fmt:
+        return None
+    fields = format_fields(fmt)
+    if fmt.get('format_id') and isinstance(task.info_cache, dict):
+        for k, v in format_fields(task.info_cache, fmt['format_id']).items():
+            fields.setdefault(k, v)
+    if fmt.get('format_id'):
+        fields['format_id'] = str(fmt['format_id'])
+    return fields or None
+
+def _media_fields_complete(fields: Dict[str, Any], mode: str) -> bool:
+    need = ['acodec'] if mode == 'audio_only' else ['vcodec', 'height'] + ([] if mode == 'video_only' else ['acodec'])
+    return all(fields.get(k) for k in need)
+
+def _fill_media_metadata(manager: Any, task: Task, derived: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """填充 width/height/codec/filesize，返回媒体字段 (写 meta 复用)
+    derived 为选中格式推导的字段：完整且未开启 UMD_VERIFY_MEDIA 时直接采用，不跑 ffprobe"""
     fp = task.file_path
-    if not fp or not os.path.exists(fp): return
+    if not fp or not os.path.exists(fp): return {}
 
-    ffmpeg_path = manager.ffmpeg_locator()
-    probe_bin = 'ffprobe'
-    if ffmpeg_path:
-        if os.path.isdir(ffmpeg_path):
-            cand = os.path.join(ffmpeg_path, 'ffprobe.exe')
-            if os.path.exists(cand): probe_bin = cand
-        else:
-            cand = os.path.join(os.path.dirname(ffmpeg_path), 'ffprobe.exe')
-            if os.path.exists(cand): probe_bin = cand
-
-    fields = {}
+    if derived and not VERIFY_MEDIA and _media_fields_complete(derived, task.mode):
+        media = dict(derived)
+        media.setdefault('container', os.path.splitext(fp)[1].lstrip('.').lower() or None)
+        task.log.append(f"[meta] 媒体信息取自所选格式 (format_id={derived.get('format_id')})，跳过 ffprobe")
+    else:
+        # 单次 ffprobe JSON (按文件身份缓存，重复调用/分类/写 meta 不再重复探测)
+        media = media_fields(probe_media(fp, manager.ffmpeg_locator()))
+    fields = {k: v for k, v in media.items() if k in ('width', 'height', 'vcodec', 'acodec')}
     try:
-        # Width/Height/Vcodec
-        vc_cmd = [probe_bin, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=width,height,codec_name', '-of', 'default=noprint_wrappers=1:nokey=1', fp]
-        p = subprocess.run(vc_cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=10, creationflags=CREATE_NO_WINDOW)
-        vals = [v.strip() for v in (p.stdout or '').strip().split('\n') if v.strip()]
-        if len(vals) >= 3:
-            if vals[0].isdigit(): fields['width'] = int(vals[0])
-            if vals[1].isdigit(): fields['height'] = int(vals[1])
-            fields['vcodec'] = vals[2]
-
-        # Acodec
-        ac_cmd = [probe_bin, '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=codec_name', '-of', 'default=noprint_wrappers=1:nokey=1', fp]
-        pa = subprocess.run(ac_cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=6, creationflags=CREATE_NO_WINDOW)
-        if pa.returncode == 0 and pa.stdout.strip():
-            fields['acodec'] = pa.stdout.strip().split('\n')[0]
-
         fields['filesize'] = os.path.getsize(fp)
-    except Exception: pass
+    except OSError:
+        pass
 
     if fields: manager._update_task(task, **fields)
+    return media
 
 def _safe_filename(name: str) -> str:
     name = re.sub(r'[\\/:*?"<>|]', '_', name)
@@ -1289,34 +1967,35 @@ def _safe_filename(name: str) -> str:
     return name or 'video'
 
 
-def _classify_media_file(manager: Any, fp: str) -> str:
-    """Simple file classification: video | audio | unknown"""
-    try:
-        ffmpeg_path = manager.ffmpeg_locator()
-        probe_bin = 'ffprobe'
-        if ffmpeg_path:
-            if os.path.isdir(ffmpeg_path):
-                cand = os.path.join(ffmpeg_path, 'ffprobe.exe')
-                if os.path.exists(cand):
-                    probe_bin = cand
-            else:
-                cand = os.path.join(os.path.dirname(ffmpeg_path), 'ffprobe.exe')
-                if os.path.exists(cand):
-                    probe_bin = cand
+def _ffmpeg_binary(manager: Any) -> Optional[str]:
+    """ffmpeg 可执行文件 (ffmpeg_locator 也可能返回 ffmpeg 所在目录)"""
+    loc = manager.ffmpeg_locator()
+    if loc and os.path.isdir(loc):
+        return tool_in_dir(loc, 'ffmpeg')
+    return loc or None
 
-        cmd_v = [probe_bin, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', fp]
-        pv = subprocess.run(cmd_v, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=6, creationflags=CREATE_NO_WINDOW)
-        if pv.returncode == 0 and pv.stdout.strip():
-            return 'video'
 
-        cmd_a = [probe_bin, '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', fp]
-        pa = subprocess.run(cmd_a, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=6, creationflags=CREATE_NO_WINDOW)
-        if pa.returncode == 0 and pa.stdout.strip():
-            return 'audio'
+_MERGE_SKIPPED_MARKERS = ("won't be merged", 'ffmpeg is not installed', 'ffmpeg not found',
+                          'error: postprocessing', 'conversion failed')
 
-        return 'unknown'
-    except Exception:
-        return 'unknown'
+def _merge_unconfirmed(lines: List[str]) -> bool:
+    """yt-dlp 输出中是否有合并被跳过或失败的迹象 (此时所选格式声明的音轨不可信)"""
+    return any(m in line.lower() for line in lines for m in _MERGE_SKIPPED_MARKERS)
+
+
+def _file_has_audio(manager: Any, fp: Optional[str]) -> Optional[bool]:
+    """成品是否含音轨；无法探测 (无 ffprobe/文件不存在) 时返回 None"""
+    if not fp or not os.path.exists(fp):
+        return None
+    probe = probe_media(fp, manager.ffmpeg_locator())
+    if probe is None:
+        return None
+    return any(st.get('codec_type') == 'audio' for st in probe.get('streams') or [])
+
+
+def _classify_media_file(manager: Any, fp: str) -> str:
+    """Simple file classification: video | audio | unknown"""
+    return classify_probe(probe_media(fp, manager.ffmpeg_locator()))
 
 
 def _is_merge_corruption(lines: List[str]) -> bool:
@@ -1353,20 +2032,7 @@ def _component_merge(manager: Any, task: Task, base_template: str, components: L
         vfile = video_parts[0]
         afile = audio_parts[0]
 
-        # Find ffmpeg
-        ffmpeg_loc = manager.ffmpeg_locator()
-        ffmpeg_bin = None
-        if ffmpeg_loc:
-            if os.path.isdir(ffmpeg_loc):
-                cand = os.path.join(ffmpeg_loc, 'ffmpeg.exe')
-                if os.path.exists(cand):
-                    ffmpeg_bin = cand
-                else:
-                    cand2 = os.path.join(ffmpeg_loc, 'ffmpeg')
-                    if os.path.exists(cand2):
-                        ffmpeg_bin = cand2
-            else:
-                ffmpeg_bin = ffmpeg_loc
+        ffmpeg_bin = _ffmpeg_binary(manager)
 
         if not ffmpeg_bin:
             task.log.append('[component-merge] 未找到 ffmpeg，无法组件合并')
@@ -1374,7 +2040,7 @@ def _component_merge(manager: Any, task: Task, base_template: str, components: L
 
         # Build merge command
         base_name = os.path.basename(base_template)
-        merged_out = os.path.join(manager.download_dir, f"{base_name}.mkv")
+        merged_out = os.path.join(_work_dir(manager, task), f"{base_name}.mkv")
         merge_cmd = [
             ffmpeg_bin, '-y',
             '-i', vfile,
@@ -1418,20 +2084,7 @@ def _audio_fallback(manager: Any, task: Task, base_template: str) -> bool:
 
         task.log.append('[audio-fallback] 未检测到音频轨，尝试下载音频并合并...')
 
-        # Find ffmpeg
-        ffmpeg_loc = manager.ffmpeg_locator()
-        ffmpeg_bin = None
-        if ffmpeg_loc:
-            if os.path.isdir(ffmpeg_loc):
-                cand = os.path.join(ffmpeg_loc, 'ffmpeg.exe')
-                if os.path.exists(cand):
-                    ffmpeg_bin = cand
-                else:
-                    cand2 = os.path.join(ffmpeg_loc, 'ffmpeg')
-                    if os.path.exists(cand2):
-                        ffmpeg_bin = cand2
-            else:
-                ffmpeg_bin = ffmpeg_loc
+        ffmpeg_bin = _ffmpeg_binary(manager)
 
         if not ffmpeg_bin:
             task.log.append('[audio-fallback] 找不到 ffmpeg，放弃补救')
@@ -1439,12 +2092,13 @@ def _audio_fallback(manager: Any, task: Task, base_template: str) -> bool:
 
         # Build audio download args
         base_name = os.path.basename(base_template)
-        audio_template = os.path.join(manager.download_dir, f"{base_name}.audio.%(ext)s")
+        work_dir = _work_dir(manager, task)
+        audio_template = os.path.join(work_dir, f"{base_name}.audio.%(ext)s")
         audio_args = [
             manager.ytdlp_path, '-f', 'bestaudio/best',
             '--no-warnings', '--no-check-certificate', '--newline', '--ignore-errors',
             '-o', audio_template
-        ]
+        ] + _output_report_args(work_dir, '.audio-outputs.jsonl')
         audio_args = _with_plugin_dir_args(audio_args)
 
         if not selected_cookie_file and _should_try_browser_cookies(effective_url, manager.cookies_file):
@@ -1477,28 +2131,15 @@ def _audio_fallback(manager: Any, task: Task, base_template: str) -> bool:
 
         def _run_audio_once(cur_args: List[str]) -> tuple[int, List[str]]:
             recent_audio: List[str] = []
-            manager.procs[task.id] = proc_a = subprocess.Popen(cur_args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                                                               text=True, encoding='utf-8', errors='ignore', creationflags=CREATE_NO_WINDOW)
-            if proc_a.stdout:
-                for l in iter(proc_a.stdout.readline, ''):
-                    if task.canceled:
-                        try: proc_a.kill()
-                        except Exception: pass
-                        manager._update_task(task, status='canceled', stage=None)
-                        break
-                    if not l:
-                        continue
-                    line = l.rstrip()
-                    recent_audio.append(line)
-                    if len(recent_audio) > 200:
-                        recent_audio = recent_audio[-200:]
-                    task.log.append('[A] ' + line)
-            proc_a.wait()
-            try:
-                manager.procs.pop(task.id, None)
-            except Exception:
-                pass
-            return proc_a.returncode, recent_audio
+
+            def on_line(line: str):
+                recent_audio.append(line)
+                if len(recent_audio) > 200:
+                    del recent_audio[:-200]
+                task.log.append('[A] ' + line)
+
+            rc_a = _stream_process(manager, task, cur_args, on_line)
+            return (130 if rc_a is None else rc_a), recent_audio
 
         audio_rc, audio_recent = _run_audio_once(audio_args)
         stripped_audio_args = _strip_impersonate_args(audio_args)
@@ -1513,18 +2154,17 @@ def _audio_fallback(manager: Any, task: Task, base_template: str) -> bool:
             return False
 
         # Find audio file
-        audio_file = None
-        for fname in os.listdir(manager.download_dir):
-            if fname.startswith(base_name + '.audio.'):
-                audio_file = os.path.join(manager.download_dir, fname)
-                break
+        reported = _reported_outputs(work_dir, '.audio-outputs.jsonl')
+        audio_files = (reported['media'] if reported else []) or \
+            [p for p in _scan_outputs(work_dir, base_name) if os.path.basename(p).startswith(base_name + '.audio.')]
+        audio_file = audio_files[0] if audio_files else None
 
         if not audio_file:
             task.log.append('[audio-fallback] 未找到音频文件，放弃补救')
             return False
 
         # Merge with ffmpeg
-        merged_out = os.path.join(manager.download_dir, f"{base_name}.mkv")
+        merged_out = os.path.join(work_dir, f"{base_name}.mkv")
         if os.path.abspath(merged_out) == os.path.abspath(source_video):
             merged_out = source_video + '.mkv'
 
@@ -1558,7 +2198,8 @@ def _audio_fallback(manager: Any, task: Task, base_template: str) -> bool:
         return False
 
 
-def _write_meta_file(manager: Any, task: Task, file_path: str, suffix_applied: bool):
+def _write_meta_file(manager: Any, task: Task, file_path: str, suffix_applied: bool,
+                     media: Optional[Dict[str, Any]] = None):
     """Write meta.json file with complete metadata"""
     try:
         # Determine meta mode: task override > env > default
@@ -1574,7 +2215,10 @@ def _write_meta_file(manager: Any, task: Task, file_path: str, suffix_applied: b
             else:
                 raw_mode = 'sidecar'
 
-        if raw_mode not in ('off', 'sidecar', 'folder'):
+        if raw_mode not in ('off', 'sidecar', 'folder', 'index'):
+            raw_mode = 'sidecar'
+        if raw_mode == 'index' and getattr(manager, 'meta_writer', None) is None:
+            task.log.append('[meta] 媒体库不可用，index 模式回退为 sidecar')
             raw_mode = 'sidecar'
 
         if raw_mode == 'off':
@@ -1585,6 +2229,7 @@ def _write_meta_file(manager: Any, task: Task, file_path: str, suffix_applied: b
             'task_id': task.id,
             'source_url': task.url,
             'title': task.title,
+            'uploader': task.uploader,
             'requested_quality': getattr(task, 'quality', None),
             'mode': getattr(task, 'mode', None),
             'height': task.height,
@@ -1593,12 +2238,20 @@ def _write_meta_file(manager: Any, task: Task, file_path: str, suffix_applied: b
             'acodec': task.acodec,
             'filesize': task.filesize,
             'final_file': task.file_path,
+            **{k: v for k, v in (media if media is not None
+                                 else media_fields(probe_media(file_path, manager.ffmpeg_locator()))).items()
+               if k in ('duration', 'bitrate', 'container')},
             'renamed_with_height': suffix_applied,
             'created_at': task.created_at,
             'completed_at': time.time(),
             'meta_mode': raw_mode,
         }
 
+        if raw_mode == 'index':
+            # 交给后台线程攒批写入媒体库 meta 表
+            manager.meta_writer.submit(file_path, meta)
+            task.log.append(f"[meta] 元数据已加入索引写入队列 -> {os.path.basename(file_path)}")
+            return
         if raw_mode == 'sidecar':
             meta_path = file_path + '.meta.json'
         else:  # folder mode
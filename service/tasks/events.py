@@ -0,0 +1,116 @@
+"""
+EventBus: 任务状态发布/订阅总线
+由 TaskManager._update_task 发布增量事件，SSE 端点订阅并按 Last-Event-ID 续传，
+避免每个任务一个轮询线程。
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+
+class EventBus:
+    """带环形缓冲的进程内事件总线
+
+    - 每个事件分配单调递增的 id，可直接作为 SSE 的 `id:` 字段
+    - 缓冲区保留最近 `max_events` 条，供断线重连按 Last-Event-ID 补发
+    - 订阅方调用 wait_for() 阻塞等待新事件，不再轮询任务表
+    - ASGI 模式下用 wait_for_async() 在事件循环内等待，不占用线程
+    """
+
+    def __init__(self, max_events: int = 2000):
+        self._events: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=max_events)
+        self._cond = threading.Condition()
+        self._last_id = 0
+        self._async_waiters: set = set()  # {(loop, asyncio.Event)}
+
+    @property
+    def last_id(self) -> int:
+        with self._cond:
+            return self._last_id
+
+    def publish(self, task_id: str, payload: Dict[str, Any]) -> int:
+        """发布一条任务事件，返回事件 id"""
+        with self._cond:
+            self._last_id += 1
+            event = dict(payload)
+            event['task_id'] = task_id
+            event['event_id'] = self._last_id
+            event.setdefault('ts', time.time())
+            self._events.append((self._last_id, event))
+            self._cond.notify_all()
+            event_id = self._last_id
+            waiters = list(self._async_waiters)
+        for loop, ev in waiters:
+            try:
+                loop.call_soon_threadsafe(ev.set)
+            except RuntimeError:
+                # 事件循环已关闭，订阅方随之失效
+                pass
+        return event_id
+
+    def since(self, last_id: int, task_ids: Optional[Iterable[str]] = None) -> Tuple[List[Dict[str, Any]], bool, int]:
+        """返回 (id > last_id 的匹配事件, 缓冲区是否已丢失部分事件, 新游标)
+
+        丢失事件时调用方应先发送任务快照再继续增量推送。
+        """
+        wanted = set(task_ids) if task_ids else None
+        with self._cond:
+            return self._since_locked(last_id, wanted)
+
+    def _since_locked(self, last_id: int, wanted: Optional[set]) -> Tuple[List[Dict[str, Any]], bool, int]:
+        if last_id > self._last_id:
+            # 客户端游标来自上一次进程生命周期（服务已重启），只能整体重放
+            return [], True, self._last_id
+        truncated = bool(self._events) and 0 < last_id < self._events[0][0] - 1
+        out = [ev for eid, ev in self._events
+               if eid > last_id and (wanted is None or ev.get('task_id') in wanted)]
+        # 游标推进到已扫描的最大 id（包括不匹配的事件），订阅子集时不会误判为丢失
+        return out, truncated, self._last_id
+
+    def wait_for(self, last_id: int, task_ids: Optional[Iterable[str]] = None,
+                 timeout: float = 15.0) -> Tuple[List[Dict[str, Any]], bool, int]:
+        """阻塞直到有匹配事件或超时；超时返回空列表，调用方据此发送心跳"""
+        wanted = set(task_ids) if task_ids else None
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                events, truncated, cursor = self._since_locked(last_id, wanted)
+                if events or truncated:
+                    return events, truncated, cursor
+                last_id = cursor
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return [], False, cursor
+                self._cond.wait(remaining)
+
+    async def wait_for_async(self, last_id: int, task_ids: Optional[Iterable[str]] = None,
+                             timeout: float = 15.0) -> Tuple[List[Dict[str, Any]], bool, int]:
+        """wait_for 的协程版本：由 publish 通过 call_soon_threadsafe 唤醒"""
+        wanted = set(task_ids) if task_ids else None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            waiter = (loop, asyncio.Event())
+            with self._cond:
+                events, truncated, cursor = self._since_locked(last_id, wanted)
+                if events or truncated:
+                    return events, truncated, cursor
+                last_id = cursor
+                # 在锁内登记，保证扫描与登记之间发布的事件不会丢失唤醒
+                self._async_waiters.add(waiter)
+            try:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return [], False, cursor
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                with self._cond:
+                    self._async_waiters.discard(waiter)
+
+
+__all__ = ['EventBus']
@@ -0,0 +1,340 @@
+"""
+原生并行 HLS 下载引擎
+替代 yt-dlp 原生 HLS 的 "每个分片先写盘再拼接"：
+  - 每个工作线程一个 keep-alive 会话 (有 curl_cffi 且需要伪装时用 curl_cffi，否则 requests)
+  - 分片并行下载，按序直接追加写入最终的 .part 文件 (滑动窗口限制内存占用)
+  - AES-128 在内存中解密后写入，不落地密文
+  - 每写入若干分片记录一次续传状态 (<输出>.hls.json)，中断后从已写入的分片继续
+仅支持 METHOD=NONE / AES-128；SAMPLE-AES 等交回 yt-dlp 处理。
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from curl_cffi import requests as cffi_requests  # type: ignore
+except ImportError:
+    cffi_requests = None
+
+from yt_dlp.aes import aes_cbc_decrypt_bytes, unpad_pkcs7
+
+logger = logging.getLogger(__name__)
+
+STATE_SAVE_EVERY = 10  # 每写入多少个分片保存一次续传状态
+
+
+class HlsError(RuntimeError):
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status  # HTTP 状态码 (非 HTTP 错误为 None)
+
+
+@dataclass
+class HlsKey:
+    method: str
+    uri: Optional[str] = None
+    iv: Optional[bytes] = None
+
+
+@dataclass
+class HlsSegment:
+    index: int
+    uri: str
+    seq: int
+    key: Optional[HlsKey] = None
+    byterange: Optional[Tuple[int, int]] = None  # (length, offset)
+
+
+@dataclass
+class HlsPlaylist:
+    segments: List[HlsSegment]
+    init_uri: Optional[str] = None
+    init_byterange: Optional[Tuple[int, int]] = None
+    variants: Optional[List[Tuple[int, str]]] = None  # master playlist: [(bandwidth, uri)]
+
+
+_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def _attrs(line: str) -> Dict[str, str]:
+    return {k: v.strip('"') for k, v in _ATTR_RE.findall(line.split(':', 1)[1] if ':' in line else '')}
+
+
+def _byterange(spec: str, prev_end: int) -> Tuple[int, int]:
+    length, _, offset = spec.partition('@')
+    return int(length), int(offset) if offset else prev_end
+
+
+def parse_playlist(text: str, base_url: str) -> HlsPlaylist:
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    if not lines or not lines[0].startswith('#EXTM3U'):
+        raise HlsError('不是有效的 m3u8 播放列表')
+
+    if any(l.startswith('#EXT-X-STREAM-INF') for l in lines):
+        variants = []
+        for i, line in enumerate(lines):
+            if line.startswith('#EXT-X-STREAM-INF') and i + 1 < len(lines):
+                bw = int(_attrs(line).get('BANDWIDTH') or 0)
+                variants.append((bw, urljoin(base_url, lines[i + 1])))
+        return HlsPlaylist(segments=[], variants=variants)
+
+    segments: List[HlsSegment] = []
+    seq = 0
+    key: Optional[HlsKey] = None
+    pending_range: Optional[str] = None
+    prev_end = 0
+    pl = HlsPlaylist(segments=segments)
+    for line in lines:
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE'):
+            seq = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-KEY'):
+            a = _attrs(line)
+            method = (a.get('METHOD') or 'NONE').upper()
+            iv = bytes.fromhex(a['IV'][2:].zfill(32)) if a.get('IV', '').lower().startswith('0x') else None
+            key = None if method == 'NONE' else HlsKey(method, urljoin(base_url, a.get('URI', '')), iv)
+        elif line.startswith('#EXT-X-MAP'):
+            a = _attrs(line)
+            pl.init_uri = urljoin(base_url, a.get('URI', ''))
+            if a.get('BYTERANGE'):
+                pl.init_byterange = _byterange(a['BYTERANGE'], 0)
+        elif line.startswith('#EXT-X-BYTERANGE'):
+            pending_range = line.split(':', 1)[1]
+        elif not line.startswith('#'):
+            br = None
+            if pending_range:
+                br = _byterange(pending_range, prev_end)
+                prev_end = br[1] + br[0]
+                pending_range = None
+            segments.append(HlsSegment(len(segments), urljoin(base_url, line), seq, key, br))
+            seq += 1
+    return pl
+
+
+_COOKIE_ATTRS = {'domain', 'path', 'secure', 'expires', 'version', 'max-age', 'httponly', 'samesite'}
+
+
+def parse_ytdlp_cookies(value: Optional[str], url: str) -> List[Tuple[str, str, str, str]]:
+    """解析 yt-dlp 格式信息中的 cookies 字段 ('a=1; Domain=.x.com; Path=/; Secure; b=2; ...')
+    为 (name, value, domain, path)；未带 Domain 的按 url 的主机限定作用域，不会发往其它站点"""
+    cookies: List[Tuple[str, str, str, str]] = []
+    host = urlparse(url).hostname or ''
+    for part in (value or '').split(';'):
+        name, sep, val = part.strip().partition('=')
+        if not name:
+            continue
+        attr = name.lower()
+        if attr in _COOKIE_ATTRS:
+            if cookies and attr in ('domain', 'path') and val:
+                n, v, d, p = cookies[-1]
+                cookies[-1] = (n, v, val if attr == 'domain' else d, val if attr == 'path' else p)
+            continue
+        if sep:
+            cookies.append((name, val, host, '/'))
+    return cookies
+
+
+class HlsDownloader:
+    """按序并行下载 HLS 媒体播放列表到单个文件"""
+
+    def __init__(self, headers: Optional[Dict[str, str]] = None, proxy: Optional[str] = None,
+                 workers: int = 8, impersonate: Optional[str] = None, retries: int = 4, timeout: float = 30,
+                 cookies: Optional[List[Tuple[str, str, str, str]]] = None):
+        self.headers = dict(headers or {})
+        self.cookies = list(cookies or [])  # (name, value, domain, path)，由会话的 cookie jar 按域名发送
+        self.proxies = {'http': proxy, 'https': proxy} if proxy else None
+        self.workers = max(1, workers)
+        self.impersonate = impersonate if cffi_requests is not None else None
+        self.retries = retries
+        self.timeout = timeout
+        self._local = threading.local()
+        self._sessions: List[object] = []
+        self._keys: Dict[str, bytes] = {}
+        self._key_lock = threading.Lock()
+        # 取消/出错时置位：进行中的 _get 不再重试，退避等待立即结束
+        self._abort = threading.Event()
+        self._is_canceled: Optional[Callable[[], bool]] = None
+
+    # ---------------- HTTP ----------------
+    def _session(self):
+        s = getattr(self._local, 'session', None)
+        if s is None:
+            if self.impersonate:
+                s = cffi_requests.Session(impersonate=self.impersonate)
+            else:
+                s = requests.Session()
+                s.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+                s.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+            s.headers.update(self.headers)
+            for name, value, domain, path in self.cookies:
+                s.cookies.set(name, value, domain=domain, path=path)
+            self._local.session = s
+            self._sessions.append(s)
+        return s
+
+    def _get(self, url: str, byterange: Optional[Tuple[int, int]] = None) -> bytes:
+        headers = {}
+        if byterange:
+            length, offset = byterange
+            headers['Range'] = f'bytes={offset}-{offset + length - 1}'
+        last: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            if attempt and self._aborted():
+                break
+            try:
+                resp = self._session().get(url, headers=headers, proxies=self.proxies, timeout=self.timeout)
+                if resp.status_code >= 400:
+                    raise HlsError(f'HTTP {resp.status_code}: {urlparse(url).path[-60:]}', status=resp.status_code)
+                return resp.content
+            except Exception as e:
+                last = e
+                status = getattr(e, 'status', None)
+                if status and 400 <= status < 500 and status not in (408, 429):
+                    break  # 链接过期/鉴权失败/资源不存在，重试无意义
+                self._abort.wait(min(2 ** attempt * 0.5, 8))
+        raise HlsError(f'分片下载失败: {last}', status=getattr(last, 'status', None))
+
+    def _aborted(self) -> bool:
+        return self._abort.is_set() or bool(self._is_canceled and self._is_canceled())
+
+    def _key_bytes(self, uri: str) -> bytes:
+        with self._key_lock:
+            if uri not in self._keys:
+                data = self._get(uri)
+                if len(data) != 16:
+                    raise HlsError(f'AES-128 密钥长度异常: {len(data)}')
+                self._keys[uri] = data
+            return self._keys[uri]
+
+    def _fetch_segment(self, seg: HlsSegment) -> bytes:
+        data = self._get(seg.uri, seg.byterange)
+        if seg.key is not None:
+            iv = seg.key.iv or seg.seq.to_bytes(16, 'big')
+            data = unpad_pkcs7(aes_cbc_decrypt_bytes(data, self._key_bytes(seg.key.uri), iv))
+        return data
+
+    # ---------------- 主流程 ----------------
+    def load_playlist(self, url: str) -> HlsPlaylist:
+        pl = parse_playlist(self._get(url).decode('utf-8', errors='ignore'), url)
+        if pl.variants:
+            bw, variant = max(pl.variants)
+            logger.info(f"[hls] master playlist，选择带宽最高的变体 ({bw})")
+            pl = parse_playlist(self._get(variant).decode('utf-8', errors='ignore'), variant)
+        if not pl.segments:
+            raise HlsError('播放列表中没有分片')
+        unsupported = {s.key.method for s in pl.segments if s.key and s.key.method != 'AES-128'}
+        if unsupported:
+            raise HlsError(f"不支持的加密方式: {', '.join(sorted(unsupported))}")
+        return pl
+
+    def close(self):
+        for s in self._sessions:
+            try:
+                s.close()
+            except Exception:
+                pass
+        self._sessions.clear()
+
+    def download(self, playlist_url: str, out_path: str,
+                 on_progress: Optional[Callable[[int, int, int, float], None]] = None,
+                 is_canceled: Optional[Callable[[], bool]] = None,
+                 playlist: Optional[HlsPlaylist] = None) -> str:
+        """下载到 out_path；on_progress(已写分片, 总分片, 已写字节, 速度 B/s)"""
+        try:
+            return self._download(playlist_url, out_path, on_progress, is_canceled,
+                                  playlist or self.load_playlist(playlist_url))
+        finally:
+            self.close()
+
+    def _download(self, playlist_url: str, out_path: str, on_progress, is_canceled, pl: HlsPlaylist) -> str:
+        total = len(pl.segments)
+        part_path, state_path = out_path + '.part', out_path + '.hls.json'
+        fingerprint = f"{total}:{urlparse(pl.segments[0].uri).path}:{urlparse(pl.segments[-1].uri).path}"
+
+        start, offset = 0, 0
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                st = json.load(f)
+            if st.get('fingerprint') == fingerprint and os.path.getsize(part_path) >= int(st.get('bytes', 0)):
+                start, offset = int(st['next_index']), int(st['bytes'])
+                logger.info(f"[hls] 续传: 从分片 {start}/{total} ({offset} 字节) 继续")
+        except (OSError, ValueError, KeyError):
+            pass
+
+        def save_state(next_index: int, nbytes: int):
+            tmp = state_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'fingerprint': fingerprint, 'next_index': next_index, 'bytes': nbytes,
+                           'playlist_url': playlist_url, 'ts': time.time()}, f)
+            os.replace(tmp, state_path)
+
+        mode = 'r+b' if start and os.path.exists(part_path) else 'wb'
+        window = self.workers * 2
+        written, t0, last_save = offset, time.time(), start
+        self._abort.clear()
+        self._is_canceled = is_canceled
+        pool = ThreadPoolExecutor(self.workers, thread_name_prefix='hls')
+        try:
+            with open(part_path, mode) as out:
+                out.seek(offset)
+                out.truncate()
+                if start == 0 and pl.init_uri:
+                    written += out.write(self._get(pl.init_uri, pl.init_byterange))
+                pending = {}
+                next_submit = start
+                for idx in range(start, total):
+                    while next_submit < total and next_submit - idx < window:
+                        pending[next_submit] = pool.submit(self._fetch_segment, pl.segments[next_submit])
+                        next_submit += 1
+                    fut = pending.pop(idx)
+                    while True:
+                        if is_canceled and is_canceled():
+                            for f in pending.values():
+                                f.cancel()
+                            out.flush()
+                            save_state(idx, written)
+                            raise HlsError('已取消')
+                        try:
+                            data = fut.result(timeout=0.5)
+                            break
+                        except FutureTimeout:
+                            continue
+                        except Exception:
+                            for f in pending.values():
+                                f.cancel()
+                            out.flush()
+                            save_state(idx, written)
+                            raise
+                    written += out.write(data)
+                    done = idx + 1
+                    if done - last_save >= STATE_SAVE_EVERY:
+                        out.flush()
+                        save_state(done, written)
+                        last_save = done
+                    if on_progress:
+                        elapsed = time.time() - t0
+                        on_progress(done, total, written, (written - offset) / elapsed if elapsed > 0 else 0.0)
+        except BaseException:
+            # 不等待进行中的分片请求 (每个可能重试多次)，取消/出错立即返回
+            self._abort.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown(wait=True)
+        os.replace(part_path, out_path)
+        try:
+            os.remove(state_path)
+        except OSError:
+            pass
+        return out_path
+
+
+__all__ = ['HlsDownloader', 'HlsError', 'HlsPlaylist', 'HlsSegment', 'parse_playlist', 'parse_ytdlp_cookies']
@@ -0,0 +1,416 @@
+"""
+媒体库索引 (SQLite)
+记录每个完成下载的成品：提取器 + 视频 ID、格式 ID、采样内容哈希、大小/mtime 及基本媒体信息。
+  - 新任务解析到已下载过的 (提取器, 视频 ID, 模式, 格式/画质) 且文件仍在时，直接复用已有文件
+  - 完成的下载与库中已有文件内容相同 (采样哈希命中后逐字节确认) 时改为硬链接，不占双份空间
+  - 标题/上传者/来源 URL/文件名建 FTS5 (trigram) 全文索引，配合完成时间、分辨率、编码的普通索引供 /api/library 查询
+  - 启动时增量导入下载目录中的 .meta.json 附属文件 (大小与 mtime 未变的跳过)，并清除文件已不存在的记录
+  - META_MODE=index 时元数据以紧凑 JSON 存入 meta 表 (按成品路径索引)，不再逐个写附属文件
+
+需要 SQLite >= 3.34 (trigram 分词器)。
+
+环境变量:
+  UMD_DEDUPE   0 关闭下载前复用与完成后硬链接去重 (默认开启，仍会记录索引)
+"""
+import filecmp
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEDUPE_ENABLED = (os.environ.get('UMD_DEDUPE') or '1').strip().lower() not in ('0', 'false', 'no', 'off')
+SAMPLE_BLOCK = 1024 * 1024
+
+# 按 PRAGMA user_version 逐个执行的迁移
+_MIGRATIONS = [
+    """
+    CREATE TABLE media (
+        id INTEGER PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE,
+        extractor TEXT,
+        video_id TEXT,
+        format_id TEXT,
+        mode TEXT,
+        quality TEXT,
+        content_hash TEXT,
+        filesize INTEGER,
+        mtime_ns INTEGER,
+        title TEXT,
+        uploader TEXT,
+        source_url TEXT,
+        width INTEGER,
+        height INTEGER,
+        vcodec TEXT,
+        acodec TEXT,
+        duration REAL,
+        task_id TEXT,
+        created_at REAL
+    );
+    CREATE INDEX media_video ON media(extractor, video_id, mode);
+    CREATE INDEX media_hash ON media(content_hash, filesize);
+    """,
+    """
+    ALTER TABLE media ADD COLUMN completed_at REAL;
+    ALTER TABLE media ADD COLUMN bitrate INTEGER;
+    ALTER TABLE media ADD COLUMN container TEXT;
+    CREATE INDEX media_completed ON media(completed_at);
+    CREATE INDEX media_height ON media(height);
+    CREATE VIRTUAL TABLE media_fts USING fts5(title, uploader, source_url, path,
+                                              content='media', content_rowid='id', tokenize='trigram');
+    CREATE TRIGGER media_fts_ai AFTER INSERT ON media BEGIN
+        INSERT INTO media_fts(rowid, title, uploader, source_url, path)
+        VALUES (new.id, new.title, new.uploader, new.source_url, new.path);
+    END;
+    CREATE TRIGGER media_fts_ad AFTER DELETE ON media BEGIN
+        INSERT INTO media_fts(media_fts, rowid, title, uploader, source_url, path)
+        VALUES ('delete', old.id, old.title, old.uploader, old.source_url, old.path);
+    END;
+    CREATE TRIGGER media_fts_au AFTER UPDATE ON media BEGIN
+        INSERT INTO media_fts(media_fts, rowid, title, uploader, source_url, path)
+        VALUES ('delete', old.id, old.title, old.uploader, old.source_url, old.path);
+        INSERT INTO media_fts(rowid, title, uploader, source_url, path)
+        VALUES (new.id, new.title, new.uploader, new.source_url, new.path);
+    END;
+    INSERT INTO media_fts(media_fts) VALUES ('rebuild');
+    """,
+    """
+    CREATE TABLE meta (
+        path TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated_at REAL
+    ) WITHOUT ROWID;
+    """,
+    # 早于 completed_at 列登记的记录补上完成时间，查询直接按 completed_at 排序
+    """
+    UPDATE media SET completed_at = created_at WHERE completed_at IS NULL;
+    """,
+]
+
+# 可全文检索的列 (FTS 列名) 与查询参数名的对应
+_FTS_FIELDS = {'q': None, 'title': 'title', 'uploader': 'uploader', 'url': 'source_url'}
+# meta.json 字段 -> media 列
+_META_FIELDS = {'task_id': 'task_id', 'source_url': 'source_url', 'title': 'title', 'uploader': 'uploader',
+                'requested_quality': 'quality', 'mode': 'mode', 'width': 'width', 'height': 'height',
+                'vcodec': 'vcodec', 'acodec': 'acodec', 'duration': 'duration', 'bitrate': 'bitrate',
+                'container': 'container', 'extractor': 'extractor', 'video_id': 'video_id',
+                'format_id': 'format_id', 'created_at': 'created_at', 'completed_at': 'completed_at'}
+
+
+def _fts_expr(value: str, column: Optional[str]) -> Tuple[Optional[str], List[str]]:
+    """把用户输入拆成 FTS 短语 (每词 >= 3 字符，trigram 子串匹配)；不足 3 字符的词返回给调用方改用 LIKE"""
+    phrases, short = [], []
+    for word in value.split():
+        if len(word) >= 3:
+            phrases.append('"' + word.replace('"', '""') + '"')
+        else:
+            short.append(word)
+    if not phrases:
+        return None, short
+    expr = ' AND '.join(phrases)
+    return (f'{column} : ({expr})' if column else expr), short
+
+
+def library_db_path(download_dir: str) -> str:
+    """媒体库数据库位置：数据目录 (UMD_DATA_DIR) 下的 library.db，未配置时放在下载目录的 .umd/ 中"""
+    from ..utils.common import data_path
+    return data_path('library.db') or os.path.join(download_dir, '.umd', 'library.db')
+
+
+def meta_target(meta_path: str, meta: Dict[str, Any]) -> Optional[str]:
+    """meta.json 对应的成品路径 (优先 final_file，其次按 sidecar/folder 命名推导)；都不存在时返回 None"""
+    name = os.path.basename(meta_path)
+    if name.endswith('.meta.json'):
+        sibling = meta_path[:-len('.meta.json')]
+    else:  # folder 模式：<媒体目录>/_meta/<文件名>.json
+        sibling = os.path.join(os.path.dirname(os.path.dirname(meta_path)), name[:-len('.json')])
+    for path in (meta.get('final_file'), sibling):
+        if path and os.path.isfile(path):
+            return os.path.abspath(path)
+    return None
+
+
+def iter_meta_files(roots: Iterable[str], meta_dirs: Iterable[str] = ()) -> Iterator[str]:
+    """遍历目录中的 meta.json (sidecar 与 _meta/ 下的 .json)；隐藏目录 (工作目录/数据目录) 不进入"""
+    meta_dirs = {os.path.abspath(d) for d in meta_dirs}
+    for root in [*roots, *meta_dirs]:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            in_meta_dir = os.path.basename(dirpath) == '_meta' or os.path.abspath(dirpath) in meta_dirs
+            for fn in filenames:
+                if fn.endswith('.meta.json') or (in_meta_dir and fn.endswith('.json')):
+                    yield os.path.join(dirpath, fn)
+
+
+def sampled_hash(path: str, block: int = SAMPLE_BLOCK) -> str:
+    """快速内容哈希：文件大小 + 头/中/尾各一块 (小文件整读)"""
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(size).encode())
+    with open(path, 'rb') as f:
+        if size <= block * 3:
+            h.update(f.read())
+        else:
+            for offset in (0, size // 2 - block // 2, size - block):
+                f.seek(offset)
+                h.update(f.read(block))
+    return h.hexdigest()
+
+
+def video_identity(info: Optional[Dict[str, Any]]) -> Optional[tuple]:
+    """(提取器, 视频 ID)；探测信息不含时返回 None"""
+    if not isinstance(info, dict):
+        return None
+    extractor = info.get('extractor_key') or info.get('extractor')
+    video_id = info.get('id')
+    if not extractor or not video_id:
+        return None
+    return str(extractor).lower(), str(video_id)
+
+
+class MediaLibrary:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._migrate()
+
+    def _migrate(self):
+        with self._lock:
+            version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+            for i, sql in enumerate(_MIGRATIONS[version:], start=version + 1):
+                self._conn.executescript('BEGIN;' + sql + f'PRAGMA user_version={i};COMMIT;')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------------- 写入 ----------------
+    def record(self, path: str, **fields: Any) -> Dict[str, Any]:
+        """登记 (或更新) 一个成品；自动补充大小、mtime 与采样哈希"""
+        st = os.stat(path)
+        row = {k: v for k, v in fields.items() if v is not None}
+        row.update(path=os.path.abspath(path), filesize=st.st_size, mtime_ns=st.st_mtime_ns,
+                   content_hash=row.get('content_hash') or sampled_hash(path))
+        row.setdefault('created_at', time.time())
+        row.setdefault('completed_at', row['created_at'])  # 排序列，始终有值以便走 media_completed 索引
+        cols = ', '.join(row)
+        marks = ', '.join('?' for _ in row)
+        updates = ', '.join(f'{k}=excluded.{k}' for k in row if k not in ('path', 'created_at'))
+        with self._lock:
+            self._conn.execute(f'INSERT INTO media ({cols}) VALUES ({marks}) '
+                               f'ON CONFLICT(path) DO UPDATE SET {updates}', list(row.values()))
+        return row
+
+    def forget(self, path: str, meta: bool = True):
+        """删除记录；meta=False 时保留 index 模式的元数据 (文件仍在、只是被改动过)"""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._conn.execute('DELETE FROM media WHERE path=?', (path,))
+            if meta:
+                self._conn.execute('DELETE FROM meta WHERE path=?', (path,))
+
+    # ---------------- 查询 ----------------
+    def _alive(self, row: sqlite3.Row) -> bool:
+        """库中记录的文件仍存在且未被改动；否则清除该记录"""
+        try:
+            st = os.stat(row['path'])
+        except OSError:
+            self.forget(row['path'])
+            return False
+        if st.st_size == row['filesize'] and st.st_mtime_ns == row['mtime_ns']:
+            return True
+        self.forget(row['path'], meta=False)
+        return False
+
+    def find_download(self, extractor: str, video_id: str, mode: str,
+                      format_id: Optional[str] = None, quality: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """同一视频、同一模式且同一格式 (指定了格式 ID 时) 或同一画质档位的已有成品"""
+        sql = 'SELECT * FROM media WHERE extractor=? AND video_id=? AND mode=?'
+        args: List[Any] = [extractor, video_id, mode]
+        if format_id:
+            sql += ' AND format_id=?'
+            args.append(format_id)
+        else:
+            sql += ' AND quality=?'
+            args.append(quality)
+        with self._lock:
+            rows = self._conn.execute(sql + ' ORDER BY created_at DESC', args).fetchall()
+        for row in rows:
+            if self._alive(row):
+                return dict(row)
+        return None
+
+    def find_duplicate(self, path: str, content_hash: str, filesize: int) -> Optional[str]:
+        """内容相同 (采样哈希 + 大小命中后逐字节比较) 的另一个已登记文件"""
+        path = os.path.abspath(path)
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM media WHERE content_hash=? AND filesize=? AND path<>?',
+                                      (content_hash, filesize, path)).fetchall()
+        for row in rows:
+            if self._alive(row) and filecmp.cmp(row['path'], path, shallow=False):
+                return row['path']
+        return None
+
+    def search(self, q: Optional[str] = None, title: Optional[str] = None, uploader: Optional[str] = None,
+               url: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None,
+               min_height: Optional[int] = None, max_height: Optional[int] = None,
+               vcodec: Optional[str] = None, acodec: Optional[str] = None, mode: Optional[str] = None,
+               limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        """
+        组合查询：q (全部文本列) / title / uploader / url 走全文索引，其余条件走普通索引。
+        结果按完成时间倒序；返回 {'items': [...], 'total': n}
+        """
+        where: List[str] = []
+        args: List[Any] = []
+        matches: List[str] = []
+        for name, value in (('q', q), ('title', title), ('uploader', uploader), ('url', url)):
+            if not value:
+                continue
+            column = _FTS_FIELDS[name]
+            expr, short = _fts_expr(value, column)
+            if expr:
+                matches.append(expr)
+            for word in short:
+                cols = [column] if column else ['title', 'uploader', 'source_url', 'path']
+                where.append('(' + ' OR '.join(f"m.{c} LIKE ? ESCAPE '\\'" for c in cols) + ')')
+                pattern = '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                args.extend([pattern] * len(cols))
+        if matches:
+            where.insert(0, 'm.id IN (SELECT rowid FROM media_fts WHERE media_fts MATCH ?)')
+            args.insert(0, ' AND '.join(f'({m})' for m in matches))
+        for cond, value in (('m.completed_at >= ?', since), ('m.completed_at <= ?', until),
+                            ('m.height >= ?', min_height), ('m.height <= ?', max_height),
+                            ('m.vcodec = ?', vcodec), ('m.acodec = ?', acodec), ('m.mode = ?', mode)):
+            if value is not None and value != '':
+                where.append(cond)
+                args.append(value)
+        clause = (' WHERE ' + ' AND '.join(where)) if where else ''
+        with self._lock:
+            total = self._conn.execute(f'SELECT COUNT(*) FROM media m{clause}', args).fetchone()[0]
+            rows = self._conn.execute(
+                f'SELECT m.* FROM media m{clause} ORDER BY m.completed_at DESC LIMIT ? OFFSET ?',
+                args + [max(1, min(int(limit), 500)), max(0, int(offset))]).fetchall()
+        return {'items': [dict(r) for r in rows], 'total': total}
+
+    def get(self, row_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM media WHERE id=?', (row_id,)).fetchone()
+        return dict(row) if row and self._alive(row) else None
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """最近完成且文件仍在的成品"""
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM media ORDER BY completed_at DESC LIMIT 20').fetchall()
+        for row in rows:
+            if self._alive(row):
+                return dict(row)
+        return None
+
+    # ---------------- 附属文件导入 ----------------
+    def ingest_meta(self, meta_path: str, known: Optional[Dict[str, Tuple[int, int]]] = None) -> bool:
+        """导入一个 meta.json；对应的成品不存在或已登记且未变化时返回 False"""
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if not isinstance(meta, dict):
+            return False
+        path = meta_target(meta_path, meta)
+        if path is None:
+            return False
+        return self.ingest_record(path, meta, known)
+
+    def ingest_record(self, path: str, meta: Dict[str, Any],
+                      known: Optional[Dict[str, Tuple[int, int]]] = None) -> bool:
+        st = os.stat(path)
+        if known is not None and known.get(path) == (st.st_size, st.st_mtime_ns):
+            return False
+        fields = {col: meta[key] for key, col in _META_FIELDS.items() if meta.get(key) is not None}
+        fields.setdefault('completed_at', st.st_mtime)
+        self.record(path, **fields)
+        return True
+
+    # ---------------- 元数据存储 (META_MODE=index) ----------------
+    def put_meta(self, records: List[Tuple[str, Dict[str, Any]]]):
+        """批量写入 (成品路径, 元数据)；单个事务提交"""
+        now = time.time()
+        rows = [(os.path.abspath(path), json.dumps(meta, ensure_ascii=False, separators=(',', ':')), now)
+                for path, meta in records]
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany('INSERT INTO meta (path, data, updated_at) VALUES (?, ?, ?) '
+                                       'ON CONFLICT(path) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at',
+                                       rows)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def get_meta(self, path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM meta WHERE path=?', (os.path.abspath(path),)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def _known_files(self) -> Dict[str, Tuple[int, int]]:
+        with self._lock:
+            rows = self._conn.execute('SELECT path, filesize, mtime_ns FROM media').fetchall()
+        return {r['path']: (r['filesize'], r['mtime_ns']) for r in rows}
+
+    def scan(self, roots: Iterable[str], meta_dirs: Iterable[str] = ()) -> Dict[str, int]:
+        """
+        增量扫描目录中的 meta.json 并清除文件已消失的记录。
+        meta_dirs 为 folder 模式的独立元数据目录 (其中的 .json 都视为元数据)
+        """
+        known = self._known_files()
+        result = {'ingested': 0, 'skipped': 0, 'errors': 0, 'removed': 0}
+        for meta_path in iter_meta_files(roots, meta_dirs):
+            try:
+                result['ingested' if self.ingest_meta(meta_path, known) else 'skipped'] += 1
+            except (OSError, ValueError, sqlite3.Error) as e:
+                logger.debug(f"[library] 导入 {meta_path} 失败: {e}")
+                result['errors'] += 1
+        for path in known:
+            if not os.path.exists(path):
+                self.forget(path)
+                result['removed'] += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(filesize), 0) FROM media').fetchone()
+            meta_count = self._conn.execute('SELECT COUNT(*) FROM meta').fetchone()[0]
+        return {'db_path': self.db_path, 'files': count, 'total_bytes': total, 'meta_records': meta_count,
+                'dedupe': DEDUPE_ENABLED}
+
+
+def hardlink_duplicate(existing: str, path: str) -> bool:
+    """把 path 替换为指向 existing 的硬链接 (先链接到临时名再原子替换)；跨卷/不支持时返回 False"""
+    tmp = path + '.umd-link'
+    try:
+        if os.path.samefile(existing, path):
+            return True
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        os.link(existing, tmp)
+        os.replace(tmp, path)
+        return True
+    except OSError as e:
+        logger.debug(f"[library] 硬链接失败 {path}: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+
+__all__ = ['MediaLibrary', 'library_db_path', 'meta_target', 'iter_meta_files', 'sampled_hash', 'video_identity',
+           'hardlink_duplicate', 'DEDUPE_ENABLED']
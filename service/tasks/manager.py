@@ -9,13 +9,28 @@ import uuid
 import os
 import logging
 import traceback
+import shutil
+import hashlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 from typing import Dict, List, Any, Optional, Callable
 
 from .models import Task
+from .events import EventBus
+from .diskspace import DISK_ADMISSION, DiskReservations, estimate_download_bytes, supports_fast_prealloc
+from .library import MediaLibrary, library_db_path
+from .metastore import MetaIndexWriter
 from ..utils.errors import classify_error
 
 logger = logging.getLogger(__name__)
 
+# 后处理 (组件合并/音频补救/探测/重命名/写 meta) 线程数，默认 CPU 核数；0 表示仍在下载线程内执行
+try:
+    POSTPROCESS_WORKERS = int(os.environ.get('UMD_POSTPROCESS_WORKERS', '') or (os.cpu_count() or 2))
+except ValueError:
+    POSTPROCESS_WORKERS = os.cpu_count() or 2
+
 
 class TaskManager:
     """任务管理器：管理下载任务队列和工作线程"""
@@ -34,12 +49,58 @@ class TaskManager:
         self.procs: Dict[str, Any] = {}  # task_id -> subprocess.Popen
         self._stop = False
 
-        # 延迟导入下载器和依赖检测
-        from ..utils.dependencies import detect_aria2c
-        self.aria2c_path: Optional[str] = detect_aria2c()
+        # 状态事件总线：SSE 订阅方从这里取增量，不再轮询任务表
+        self.events = EventBus()
+        self._log_cursor: Dict[str, int] = {}  # task_id -> 已发布的日志行数
+
+        # 幂等键：防止客户端重试/重连重复创建同一下载
+        self._idempotency: Dict[str, tuple[str, float]] = {}  # key -> (task_id, created_at)
+        self.idempotency_ttl = 24 * 3600
+
+        # 外部工具 (ffmpeg/ffprobe/aria2c/yt-dlp/插件目录) 启动时并行解析一次，之后复用缓存结果
+        from ..utils.tools import get_tool_registry
+        self.tools = get_tool_registry()
+        self.aria2c_path: Optional[str] = self.tools.path('aria2c')
+        # 常驻 aria2c (UMD_ARIA2_RPC=1 时按需启动)
+        self._aria2_rpc = None
+        self._aria2_rpc_lock = threading.Lock()
+        self._aria2_rpc_retry_at = 0.0
+        # 任务临时工作目录根 (UMD_TEMP_DIR 可指向 tmpfs/NVMe 等快速卷；默认与下载目录同卷，成品移动为原子 rename)
+        self.temp_root = os.environ.get('UMD_TEMP_DIR') or os.path.join(download_dir, '.umd-work')
+        self._sweep_work_dirs()
+        # 磁盘空间预留 (下载开始前准入)；分片与合并的峰值占用发生在工作目录所在卷
+        self.disk = DiskReservations(self.temp_root)
+        # 媒体库索引 (已下载成品的视频标识/格式/内容哈希)：下载前复用、完成后硬链接去重
+        self.library: Optional[MediaLibrary] = None
+        self.meta_writer: Optional[MetaIndexWriter] = None  # META_MODE=index 的批量写入线程
+        try:
+            self.library = MediaLibrary(library_db_path(download_dir))
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"[library] 媒体库索引不可用: {e}")
+        if self.library is not None:
+            self.meta_writer = MetaIndexWriter(self.library)
+            threading.Thread(target=self._scan_library, name='library-scan', daemon=True).start()
+        # 后处理阶段：下载线程交接已完成的下载后立即取下一个任务，网络与 CPU/磁盘工作在任务间重叠
+        self.postprocess_pool: Optional[ThreadPoolExecutor] = (
+            ThreadPoolExecutor(POSTPROCESS_WORKERS, thread_name_prefix='postprocess') if POSTPROCESS_WORKERS > 0 else None)
+        self.postprocess_pending = 0
+        self._postprocess_lock = threading.Lock()
 
         self._start_workers()
 
+    def scan_library(self) -> Dict[str, int]:
+        """增量导入下载目录 (及 folder 模式的独立元数据目录) 中的 meta.json"""
+        meta_dir = os.environ.get('LUMINA_META_DIR')
+        return self.library.scan([self.download_dir], [meta_dir] if meta_dir and os.path.isdir(meta_dir) else [])
+
+    def _scan_library(self):
+        try:
+            result = self.scan_library()
+            if result['ingested'] or result['removed']:
+                logger.info(f"[library] 导入 {result['ingested']} 条，清除 {result['removed']} 条失效记录")
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"[library] 扫描失败: {e}")
+
     def _start_workers(self):
         """启动工作线程"""
         for i in range(self.max_workers):
@@ -71,14 +132,64 @@ class TaskManager:
             try:
                 execute_download(self, task)
             except Exception as e:
-                code, msg = classify_error(str(e))
-                self._update_task(task, status='error', error_code=code, error_message=msg)
-                logger.error(f"Task {task.id} 失败: {msg}\n{traceback.format_exc()}")
+                self._fail_task(task, e)
             finally:
+                self.flush_log(task)
                 self.queue.task_done()
 
-    def add_task(self, **kwargs) -> Task:
-        """添加新任务到队列"""
+    def _fail_task(self, task: Task, e: Exception):
+        if task.canceled:
+            # 取消会立即终止子进程，随之而来的失败不应覆盖 canceled 状态
+            logger.info(f"Task {task.id} 已取消: {e}")
+            return
+        code, msg = classify_error(str(e))
+        self._update_task(task, status='error', error_code=code, error_message=msg)
+        logger.error(f"Task {task.id} 失败: {msg}\n{traceback.format_exc()}")
+
+    def submit_postprocess(self, task: Task, job: Callable[[], None], resources: ExitStack) -> bool:
+        """把下载完成后的收尾交给后处理线程池；线程池接受后才从 resources 取走清理回调 (工作目录清理、
+        磁盘预留释放)，在收尾结束后关闭。未启用后处理池或已停止时返回 False，resources 原样留给调用方，
+        由调用方在下载线程内执行收尾并照常退出 with。"""
+        if self.postprocess_pool is None or self._stop:
+            return False
+        with self._postprocess_lock:
+            self.postprocess_pending += 1
+        self._update_task(task, stage='postprocess')
+        handed = resources.pop_all()
+        try:
+            self.postprocess_pool.submit(self._run_postprocess, task, job, handed)
+        except RuntimeError:
+            # 线程池已关闭：把清理回调还给调用方
+            resources.push(handed)
+            with self._postprocess_lock:
+                self.postprocess_pending -= 1
+            return False
+        return True
+
+    def _run_postprocess(self, task: Task, job: Callable[[], None], resources: ExitStack):
+        try:
+            with resources:
+                if task.canceled:
+                    return
+                job()
+        except Exception as e:
+            self._fail_task(task, e)
+        finally:
+            self.flush_log(task)
+            with self._postprocess_lock:
+                self.postprocess_pending -= 1
+
+    def add_task(self, idempotency_key: Optional[str] = None, **kwargs) -> Task:
+        """添加新任务到队列；相同 idempotency_key 在有效期内返回已创建的任务"""
+        if idempotency_key:
+            with self.tasks_lock:
+                self._prune_idempotency_locked()
+                hit = self._idempotency.get(idempotency_key)
+                existing = self.tasks.get(hit[0]) if hit else None
+            if existing is not None:
+                logger.info(f"[TASK_ADD] 幂等键命中，复用任务 {existing.id}")
+                return existing
+
         task_id = str(uuid.uuid4())
         task = Task(id=task_id, **kwargs)
 
@@ -88,10 +199,23 @@ class TaskManager:
         logger.info(f"[TASK_ADD] 任务 {task_id} 创建 - Mode: {mode}, Quality: '{quality}', Subtitles_only: {subtitles_only}")
 
         with self.tasks_lock:
+            if idempotency_key:
+                # 并发的同键请求：以先写入者为准
+                hit = self._idempotency.get(idempotency_key)
+                if hit and hit[0] in self.tasks:
+                    return self.tasks[hit[0]]
+                self._idempotency[idempotency_key] = (task_id, time.time())
             self.tasks[task_id] = task
+            self._log_cursor[task_id] = 0
+        self.events.publish(task_id, {'type': 'status', **task.to_status()})
         self.queue.put(task_id)
         return task
 
+    def _prune_idempotency_locked(self):
+        cutoff = time.time() - self.idempotency_ttl
+        for key in [k for k, (_, ts) in self._idempotency.items() if ts < cutoff]:
+            self._idempotency.pop(key, None)
+
     def get_task(self, task_id: str) -> Optional[Task]:
         """获取指定任务"""
         with self.tasks_lock:
@@ -112,22 +236,135 @@ class TaskManager:
             ]
             for task_id in finished_task_ids:
                 del self.tasks[task_id]
+                self._log_cursor.pop(task_id, None)
                 removed_count += 1
+        for task_id in finished_task_ids:
+            self.events.publish(task_id, {'type': 'removed'})
         logger.info(f"清除了 {removed_count} 个已完成/错误的任务")
         return removed_count
 
     def _update_task(self, task: Task, **fields):
-        """更新任务字段"""
+        """更新任务字段，并把状态变化与新增日志发布到事件总线"""
         with self.tasks_lock:
+            before = task.to_status()
             for k, v in fields.items():
                 setattr(task, k, v)
             task.updated_at = time.time()
+            status = task.to_status()
+            cursor = self._log_cursor.get(task.id, 0)
+            new_lines = task.log[cursor:]
+            self._log_cursor[task.id] = cursor + len(new_lines)
+        # 状态未变且无新日志时不发布，避免重复序列化
+        if status == before and not new_lines:
+            return
+        payload: Dict[str, Any] = {'type': 'status', **status}
+        if new_lines:
+            payload['log'] = new_lines
+        self.events.publish(task.id, payload)
+
+    def flush_log(self, task: Task):
+        """发布最后一次状态更新之后追加的日志 (收尾/清理阶段直接 task.log.append 的行)；已移除的任务不再发布"""
+        with self.tasks_lock:
+            cursor = self._log_cursor.get(task.id)
+            if cursor is None or cursor >= len(task.log):
+                return
+        self._update_task(task)
+
+    def prepare_work_dir(self, task: Task) -> str:
+        """为任务分配独立的临时工作目录"""
+        path = os.path.join(self.temp_root, task.id)
+        os.makedirs(path, exist_ok=True)
+        task.temp_dir = path
+        return path
+
+    def cleanup_work_dir(self, task: Task):
+        """删除任务工作目录 (成品已移入下载目录，剩余的是分片/组件/中间文件)"""
+        if task.temp_dir and os.path.abspath(task.temp_dir) != os.path.abspath(self.download_dir):
+            shutil.rmtree(task.temp_dir, ignore_errors=True)
+        task.temp_dir = None
+
+    def resume_dir(self, key: str) -> str:
+        """按稳定键 (视频标识 + 格式) 分配的续传目录：不随任务工作目录删除，同一流的后续任务从这里续传；
+        成功后由调用方删除，遗留的由 _sweep_work_dirs 按时间清理"""
+        path = os.path.join(self.temp_root, 'resume-' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _sweep_work_dirs(self, max_age: float = 24 * 3600):
+        """清理异常退出遗留的工作目录"""
+        try:
+            entries = os.listdir(self.temp_root)
+        except OSError:
+            return
+        cutoff = time.time() - max_age
+        for name in entries:
+            path = os.path.join(self.temp_root, name)
+            try:
+                if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+    @contextmanager
+    def disk_reservation(self, task: Task, info: Optional[Dict[str, Any]]):
+        """按探测信息预留下载所需磁盘空间，空间不足时等待；退出时释放"""
+        if not DISK_ADMISSION:
+            yield
+            return
+        need = estimate_download_bytes(info, mode=task.mode, quality=task.quality,
+                                       video_format=task.video_format, audio_format=task.audio_format)
+
+        def on_wait(msg: str):
+            task.log.append(f'[disk] {msg}')
+            self._update_task(task, stage='waiting_disk')
+
+        self.disk.admit(task, need, lambda: task.canceled, on_wait)
+        if need:
+            task.log.append(f'[disk] 预留磁盘空间 {need / 1024 ** 2:.0f} MB')
+        self._update_task(task, disk_reserved=need)
+        try:
+            yield
+        finally:
+            self.disk.release(task.id)
+            self._update_task(task, disk_reserved=None)
+
+    def get_aria2_rpc(self):
+        """返回常驻 aria2c RPC 守护进程；未开启、未检测到 aria2c 或启动失败时返回 None"""
+        from .aria2_rpc import Aria2RpcDaemon, aria2_rpc_enabled
+        if not self.aria2c_path or not aria2_rpc_enabled():
+            return None
+        with self._aria2_rpc_lock:
+            if self._aria2_rpc is not None and self._aria2_rpc.alive():
+                return self._aria2_rpc
+            if time.time() < self._aria2_rpc_retry_at:
+                return None
+            # 文件系统支持时预分配输出文件 (falloc 为即时分配，减少碎片)
+            daemon = Aria2RpcDaemon(self.aria2c_path,
+                                    'falloc' if supports_fast_prealloc(self.download_dir) else 'none')
+            try:
+                daemon.start()
+            except Exception as e:
+                # 启动失败后 5 分钟内不再重试，期间回退到每任务 aria2c
+                self._aria2_rpc_retry_at = time.time() + 300
+                logger.warning(f"[aria2-rpc] 启动失败，回退到独立 aria2c 进程: {e}")
+                self._aria2_rpc = None
+                return None
+            self._aria2_rpc = daemon
+            return daemon
 
     def stop(self):
         """停止所有工作线程"""
         self._stop = True
         for w in self.workers:
             w.join(timeout=2)
+        if self.postprocess_pool is not None:
+            self.postprocess_pool.shutdown(wait=True)
+        if self._aria2_rpc is not None:
+            self._aria2_rpc.shutdown()
+        if self.meta_writer is not None:
+            self.meta_writer.close()
+        if self.library is not None:
+            self.library.close()
 
 
 # 模块级单例
@@ -169,10 +406,8 @@ def cancel_task(task_id: str) -> bool:
 
     # 标记取消
     if t.status not in ('finished', 'error', 'canceled'):
-        t.canceled = True
-        t.status = 'canceled'
-        t.stage = None
         t.log.append('[canceled] 标记取消')
+        _task_manager._update_task(t, canceled=True, status='canceled', stage=None)
 
     # 清理进程表
     try:
@@ -0,0 +1,155 @@
+"""
+META_MODE=index：元数据集中写入媒体库数据库的 meta 表 (紧凑 JSON，按成品路径索引)
+下载收尾只把记录放进队列，后台线程攒批后在一个事务内写入，不再为每个成品同步写一个 JSON 文件。
+
+环境变量:
+  UMD_META_FLUSH_SEC   攒批的最长等待 (秒)，默认 2
+  UMD_META_BATCH       单批最多记录数，默认 100
+
+迁移已有附属文件 (sidecar / _meta 目录) 到 meta 表：
+  python migrate_meta.py <下载目录> [--meta-dir DIR] [--delete]
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .library import MediaLibrary, iter_meta_files, library_db_path, meta_target
+
+logger = logging.getLogger(__name__)
+
+try:
+    META_FLUSH_SEC = float(os.environ.get('UMD_META_FLUSH_SEC', '') or 2)
+except ValueError:
+    META_FLUSH_SEC = 2.0
+try:
+    META_BATCH = max(1, int(os.environ.get('UMD_META_BATCH', '') or 100))
+except ValueError:
+    META_BATCH = 100
+
+
+class MetaIndexWriter:
+    """后台攒批写入 meta 表；flush() 等待已提交的记录落库，close() 写完剩余记录后退出"""
+
+    def __init__(self, library: MediaLibrary, batch_size: int = META_BATCH, flush_interval: float = META_FLUSH_SEC):
+        self.library = library
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='meta-index', daemon=True)
+        self._thread.start()
+
+    def submit(self, path: str, meta: Dict[str, Any]):
+        self._queue.put((path, meta))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 10):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _write(self, batch: List[Tuple[str, Dict[str, Any]]]):
+        if not batch:
+            return
+        try:
+            self.library.put_meta(batch)
+        except Exception as e:
+            logger.warning(f"[meta] 写入 {len(batch)} 条元数据失败: {e}")
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            batch: List[Tuple[str, Dict[str, Any]]] = []
+            waiters: List[threading.Event] = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for w in waiters:
+                w.set()
+
+
+def migrate_sidecars(library: MediaLibrary, roots: Iterable[str], meta_dirs: Iterable[str] = (),
+                     delete: bool = False, batch_size: int = 500) -> Dict[str, int]:
+    """把已有 meta.json 写入 meta 表并登记到媒体库；delete=True 时写入成功后删除原文件"""
+    result = {'migrated': 0, 'orphaned': 0, 'errors': 0, 'deleted': 0}
+    batch: List[Tuple[str, Dict[str, Any]]] = []
+    sources: List[str] = []
+
+    def commit():
+        library.put_meta(batch)
+        result['migrated'] += len(batch)
+        if delete:
+            for src in sources:
+                try:
+                    os.remove(src)
+                    result['deleted'] += 1
+                except OSError:
+                    pass
+        batch.clear()
+        sources.clear()
+
+    for meta_path in iter_meta_files(roots, meta_dirs):
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            target = meta_target(meta_path, meta) if isinstance(meta, dict) else None
+            if target is None:
+                result['orphaned'] += 1
+                continue
+            meta['meta_mode'] = 'index'
+            library.ingest_record(target, meta)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            logger.debug(f"[meta] 迁移 {meta_path} 失败: {e}")
+            result['errors'] += 1
+            continue
+        batch.append((target, meta))
+        sources.append(meta_path)
+        if len(batch) >= batch_size:
+            commit()
+    if batch:
+        commit()
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='迁移 meta.json 附属文件到媒体库 meta 表 (META_MODE=index)')
+    parser.add_argument('download_dir', help='下载目录')
+    parser.add_argument('--meta-dir', action='append', default=[], help='folder 模式的独立元数据目录 (可多次指定)')
+    parser.add_argument('--db', help='媒体库数据库路径 (默认与服务相同)')
+    parser.add_argument('--delete', action='store_true', help='迁移成功后删除原附属文件')
+    args = parser.parse_args(argv)
+
+    library = MediaLibrary(args.db or library_db_path(args.download_dir))
+    try:
+        result = migrate_sidecars(library, [args.download_dir], args.meta_dir, delete=args.delete)
+    finally:
+        library.close()
+    print(f"[meta] 迁移 {result['migrated']} 条，删除附属文件 {result['deleted']} 个，"
+          f"找不到成品 {result['orphaned']} 个，失败 {result['errors']} 个 -> {library.db_path}")
+    return 1 if result['errors'] else 0
+
+
+__all__ = ['MetaIndexWriter', 'migrate_sidecars', 'META_BATCH', 'META_FLUSH_SEC']
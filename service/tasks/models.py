@@ -19,6 +19,8 @@ class Task:
     # 文件路径
     file_path: Optional[str] = None # Renamed from final_path to match tasks.py usage
     temp_dir: Optional[str] = None
+    output_files: List[str] = field(default_factory=list)  # 一次生成多个成品时的全部路径 (字幕批量等)
+    disk_reserved: Optional[int] = None  # 准入时预留的磁盘空间 (字节)，下载结束后释放
     
     # 错误/日志信息
     error_code: Optional[str] = None
@@ -38,11 +40,15 @@ class Task:
     attempts: int = 0 # Added
     geo_bypass: bool = False # Added
     canceled: bool = False # Added
+    force_download: bool = False  # 跳过媒体库复用，强制重新下载
+    stall_restarts: int = 0  # 吞吐崩塌后换策略重启的次数
+    stall_history: List[Dict[str, Any]] = field(default_factory=list)  # 每次重启的原因/策略/吞吐
     
     # 字幕
     subtitles_only: bool = False
     subtitles: List[str] = field(default_factory=list)
     auto_subtitles: bool = False # Added
+    batch_urls: List[str] = field(default_factory=list)  # 字幕批量模式：一个任务处理多个视频/频道
     
     # 资源元数据 (Video Info)
     title: Optional[str] = None
@@ -70,6 +76,19 @@ class Task:
     start_ts: float = field(default_factory=time.time)
     first_progress_ts: Optional[float] = None 
 
+    def to_status(self) -> Dict[str, Any]:
+        """SSE 推送用的精简状态 (不含日志)"""
+        return {
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'speed': self.speed,
+            'stall_restarts': self.stall_restarts,
+            'title': self.title,
+            'file_path': self.file_path,
+            'error_message': self.error_message,
+        }
+
     def to_dict(self) -> Dict[str, Any]:
         d = asdict(self)
         # 截断日志避免过大
@@ -0,0 +1,149 @@
+"""
+ProcessMux: 子进程输出多路复用
+所有下载子进程 (yt-dlp / 音频补抓等) 的 stdout 由同一个后台线程中的 asyncio 事件循环读取，
+按行分发到各自的队列。工作线程只在队列上做带超时的等待，因此取消与卡死检测
+不必等到子进程输出下一行才生效。
+
+选择 asyncio 而非 selectors：Windows 下 selectors 不支持管道，而 asyncio 的
+Proactor 事件循环可以。
+"""
+import asyncio
+import codecs
+import logging
+import queue
+import re
+import subprocess
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_EOF = object()
+_LINE_SPLIT_RE = re.compile(r'\r\n|\r|\n')
+
+
+class PipedProcess:
+    """由 ProcessMux 托管的子进程句柄，提供与 subprocess.Popen 兼容的 poll/kill/wait"""
+
+    def __init__(self, args: List[str]):
+        self.args = args
+        self.pid: Optional[int] = None
+        self.returncode: Optional[int] = None
+        self.last_output_ts = time.time()
+        self._lines: 'queue.Queue' = queue.Queue()
+        self._exited = threading.Event()
+        self._proc: Optional[asyncio.subprocess.Process] = None
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def kill(self):
+        proc = self._proc
+        if proc is None or self._exited.is_set():
+            return
+        try:
+            proc.kill()
+        except (ProcessLookupError, OSError):
+            pass
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        if not self._exited.wait(timeout):
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def iter_lines(self, tick: float = 0.5) -> Iterator[Optional[str]]:
+        """逐行产出输出；在 tick 秒内无新输出时产出 None，调用方借此检查取消/卡死"""
+        while True:
+            try:
+                item = self._lines.get(timeout=tick)
+            except queue.Empty:
+                yield None
+                continue
+            if item is _EOF:
+                return
+            yield item
+
+
+class ProcessMux:
+    """单线程事件循环，负责启动子进程并读取其全部输出"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                ready = threading.Event()
+
+                def _run():
+                    loop = asyncio.new_event_loop()
+                    asyncio.set_event_loop(loop)
+                    self._loop = loop
+                    ready.set()
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=_run, name='proc-io-mux', daemon=True)
+                self._thread.start()
+                ready.wait()
+            return self._loop  # type: ignore[return-value]
+
+    def spawn(self, args: List[str], env: Optional[Dict[str, str]] = None, creationflags: int = 0) -> PipedProcess:
+        """启动子进程 (stderr 合并到 stdout)；启动失败时抛出与 Popen 相同的异常"""
+        loop = self._ensure_loop()
+        handle = PipedProcess(args)
+        fut = asyncio.run_coroutine_threadsafe(self._start(handle, env, creationflags), loop)
+        fut.result()
+        return handle
+
+    async def _start(self, handle: PipedProcess, env, creationflags: int):
+        proc = await asyncio.create_subprocess_exec(
+            *handle.args, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT, env=env, creationflags=creationflags)
+        handle._proc = proc
+        handle.pid = proc.pid
+        asyncio.ensure_future(self._pump(handle, proc))
+
+    @staticmethod
+    async def _pump(handle: PipedProcess, proc: asyncio.subprocess.Process):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        pending = ''
+        try:
+            while proc.stdout is not None:
+                chunk = await proc.stdout.read(65536)
+                if not chunk:
+                    break
+                handle.last_output_ts = time.time()
+                pending += decoder.decode(chunk)
+                parts = _LINE_SPLIT_RE.split(pending)
+                pending = parts.pop()
+                for line in parts:
+                    handle._lines.put(line)
+            pending += decoder.decode(b'', final=True)
+            if pending:
+                handle._lines.put(pending)
+        except Exception as e:
+            logger.warning(f"[proc-io] 读取子进程输出失败 pid={handle.pid}: {e}")
+        finally:
+            try:
+                handle.returncode = await proc.wait()
+            finally:
+                handle._exited.set()
+                handle._lines.put(_EOF)
+
+
+_mux: Optional[ProcessMux] = None
+_mux_lock = threading.Lock()
+
+
+def get_process_mux() -> ProcessMux:
+    global _mux
+    with _mux_lock:
+        if _mux is None:
+            _mux = ProcessMux()
+        return _mux
+
+
+__all__ = ['PipedProcess', 'ProcessMux', 'get_process_mux']
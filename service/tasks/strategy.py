@@ -0,0 +1,366 @@
+"""
+下载回退策略引擎
+把 "失败 -> 换参数重试" 的回退链描述为规则表：每条规则由
+  applies  前置条件 (基于站点上下文与当前参数状态)
+  symptom  输出检测器 (基于 yt-dlp 最近输出)
+  transform 参数变换 (返回新的 DownloadState)
+  cost     代价 (约等于完整下载次数，计入 UMD_FALLBACK_BUDGET 预算)
+组成。规则表见 downloader._MEDIA_FALLBACK_RULES。
+
+按站点 (host) 记录并持久化 (DATA_DIR/strategy_memory.json):
+  - 每条规则运行后症状是否消失；多次无效的规则在该站点直接跳过
+  - 最终成功的策略 (规则路径 + 客户端/cookies/aria2c/并发/分块档案 + 速度)；
+    同站点的新任务直接从最佳候选出发，不再逐级试错
+  - 全部统计按半衰期衰减 (UMD_STRATEGY_HALF_LIFE_DAYS，默认 7 天)
+"""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from ..utils.common import data_path, read_json_file, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_BUDGET = float(os.environ.get('UMD_FALLBACK_BUDGET', '16') or 16)
+FUTILE_AFTER = int(os.environ.get('UMD_FALLBACK_FUTILE_AFTER', '3') or 3)
+
+
+@dataclass
+class DownloadState:
+    """一次 yt-dlp 下载运行的参数状态 (由 downloader 转换为命令行)"""
+    format_selector: str = 'best'
+    conc: int = 4
+    chunk: str = '4M'
+    use_aria: bool = False
+    # 合并模式下由 ffmpeg 边下载边封装 (yt-dlp --downloader http:ffmpeg)
+    stream_merge: bool = False
+    extra_args: List[str] = field(default_factory=list)
+    force_no_proxy: bool = False
+    youtube_auth_with_cookies: bool = False
+    force_browser_cookies: bool = False
+    youtube_tv_client: bool = False
+    timeout: int = 15
+    retries: int = 20
+    fragment_retries: int = 50
+    # YouTube 最小参数模式 (不带格式/并发等参数，交给 yt-dlp 默认选择)
+    minimal: bool = False
+    minimal_browser_cookie: bool = False
+    explicit_format: Optional[str] = None
+
+    def evolve(self, **changes) -> 'DownloadState':
+        return replace(self, **changes)
+
+
+@dataclass
+class FallbackContext:
+    """规则判断所需的任务上下文 (不随重试变化)"""
+    host: str
+    is_youtube: bool
+    mode: str
+    skip_probe: bool
+    aria2c_available: bool
+    direct_selector: Optional[str]
+    adaptive_selector: Optional[str]
+    initial: DownloadState
+    hooks: Dict[str, Callable[[], Any]] = field(default_factory=dict)
+    # 由其它控制器决定的字段 (如并发/分块由 tuning 模块调优)，起步时不被记忆档案覆盖
+    tuned_fields: Tuple[str, ...] = ()
+
+
+@dataclass
+class FallbackRule:
+    name: str
+    label: str
+    applies: Callable[[FallbackContext, DownloadState], bool]
+    symptom: Callable[[List[str]], bool]
+    transform: Callable[[FallbackContext, DownloadState], DownloadState]
+    cost: float = 1.0
+    message: Optional[str] = None  # 触发时写入任务日志
+    learnable: bool = True  # 是否可作为站点首选路径直接套用 (有副作用或改变格式选择的规则不可)
+
+
+def host_key(url: str) -> str:
+    host = (urlparse(url or '').hostname or '').lower()
+    for prefix in ('www.', 'm.', 'music.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    return 'youtube.com' if host == 'youtu.be' else host
+
+
+# 记忆中按站点套用的参数字段 (客户端/cookies 来源/代理/aria2c/并发/分块)
+PROFILE_FIELDS = ('youtube_auth_with_cookies', 'force_browser_cookies', 'youtube_tv_client',
+                  'force_no_proxy', 'use_aria', 'stream_merge', 'conc', 'chunk')
+
+
+def profile_of(state: DownloadState) -> Dict[str, Any]:
+    return {k: getattr(state, k) for k in PROFILE_FIELDS}
+
+
+def describe_profile(profile: Dict[str, Any]) -> str:
+    if profile.get('youtube_tv_client') and profile.get('youtube_auth_with_cookies'):
+        client = 'tv'
+    elif profile.get('youtube_auth_with_cookies'):
+        client = 'web'
+    else:
+        client = 'default'
+    cookies = 'browser' if profile.get('force_browser_cookies') else ('file' if profile.get('youtube_auth_with_cookies') else 'auto')
+    return (f"client={client}, cookies={cookies}, aria2c={'on' if profile.get('use_aria') else 'off'}, "
+            f"stream-merge={'on' if profile.get('stream_merge') else 'off'}, "
+            f"proxy={'off' if profile.get('force_no_proxy') else 'on'}, 并发={profile.get('conc')}, 块={profile.get('chunk')}")
+
+
+class StrategyMemory:
+    """按站点的策略记忆 (持久化到 JSON，随时间衰减)
+
+    每个站点保存若干候选策略 (成功路径 + 参数档案 + 成功/失败权重 + 平均速度)
+    以及各回退规则的有效性统计。权重按 UMD_STRATEGY_HALF_LIFE_DAYS 半衰期衰减，
+    过旧的知识自动淡出，站点行为变化后会重新试错。
+    """
+
+    MAX_CANDIDATES = 5
+    MAX_HOSTS = 500
+
+    def __init__(self, path: Optional[str] = None, half_life_days: Optional[float] = None):
+        self.path = path
+        if half_life_days is None:
+            half_life_days = float(os.environ.get('UMD_STRATEGY_HALF_LIFE_DAYS', '7') or 7)
+        self.half_life = max(half_life_days, 0.01) * 86400
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    # ---------------- 持久化 ----------------
+    def _load(self):
+        data = read_json_file(self.path, {})
+        hosts = data.get('hosts') if isinstance(data, dict) else None
+        if isinstance(hosts, dict):
+            self._hosts = hosts
+
+    def _save_locked(self):
+        write_json_atomic(self.path, {'version': 1, 'hosts': self._hosts})
+
+    # ---------------- 衰减 ----------------
+    def _decay(self, value: float, ts: float, now: float) -> float:
+        return value * 0.5 ** (max(now - ts, 0) / self.half_life)
+
+    def _decayed_entry(self, entry: Dict[str, Any], now: float, keys: Tuple[str, ...]) -> Dict[str, float]:
+        return {k: self._decay(float(entry.get(k, 0)), entry.get('ts', now), now) for k in keys}
+
+    def _touch(self, entry: Dict[str, Any], now: float, keys: Tuple[str, ...]):
+        """把权重衰减到当前时刻后再累加，保证 ts 之前的历史按半衰期折算"""
+        for k, v in self._decayed_entry(entry, now, keys).items():
+            entry[k] = v
+        entry['ts'] = now
+
+    def _host_locked(self, host: str) -> Dict[str, Any]:
+        entry = self._hosts.get(host)
+        if entry is None:
+            if len(self._hosts) >= self.MAX_HOSTS:
+                oldest = min(self._hosts, key=lambda h: self._hosts[h].get('ts', 0))
+                self._hosts.pop(oldest, None)
+            entry = self._hosts[host] = {'candidates': [], 'rules': {}, 'ts': time.time()}
+        return entry
+
+    # ---------------- 规则有效性 ----------------
+    def record_rule(self, host: str, rule: str, effective: bool):
+        now = time.time()
+        with self._lock:
+            stats = self._host_locked(host)['rules'].setdefault(rule, {'effective': 0.0, 'ineffective': 0.0, 'ts': now})
+            self._touch(stats, now, ('effective', 'ineffective'))
+            stats['effective' if effective else 'ineffective'] += 1
+
+    def is_futile(self, host: str, rule: str) -> bool:
+        now = time.time()
+        with self._lock:
+            stats = (self._hosts.get(host) or {}).get('rules', {}).get(rule)
+            if not stats:
+                return False
+            d = self._decayed_entry(stats, now, ('effective', 'ineffective'))
+        # 衰减会让刚记录的整数权重略小于整数，留半次余量
+        return d['effective'] < 0.5 and d['ineffective'] >= FUTILE_AFTER - 0.5
+
+    # ---------------- 候选策略 ----------------
+    def best_candidate(self, host: str) -> Optional[Dict[str, Any]]:
+        """衰减后净成功权重最高的候选 (并列时取更快者)；没有可信候选时返回 None"""
+        now = time.time()
+        with self._lock:
+            best, best_key = None, None
+            for cand in (self._hosts.get(host) or {}).get('candidates', []):
+                d = self._decayed_entry(cand, now, ('success', 'failure'))
+                score = d['success'] - d['failure']
+                if score < 0.5:
+                    continue
+                key = (score, cand.get('speed_bps') or 0)
+                if best_key is None or key > best_key:
+                    best, best_key = cand, key
+            return dict(best) if best else None
+
+    def record_outcome(self, host: str, path: List[str], profile: Optional[Dict[str, Any]], success: bool,
+                       speed_bps: Optional[float] = None, started_from: Optional[Dict[str, Any]] = None):
+        """记录一次下载结果
+
+        success 时累加最终路径/档案对应候选的成功权重并更新速度 (EWMA)；
+        若本次从记忆候选起步但它没有一次成功 (需要继续回退或最终失败)，给该候选记一次失败。
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._host_locked(host)
+            entry['ts'] = now
+            cands: List[Dict[str, Any]] = entry['candidates']
+
+            def _find(p, prof):
+                for c in cands:
+                    if c.get('path') == p and c.get('profile') == prof:
+                        return c
+                return None
+
+            if started_from is not None and (not success or started_from.get('path') != path
+                                             or started_from.get('profile') != profile):
+                prev = _find(started_from.get('path'), started_from.get('profile'))
+                if prev is not None:
+                    self._touch(prev, now, ('success', 'failure'))
+                    prev['failure'] += 1
+
+            if success and profile is not None:
+                cand = _find(path, profile)
+                if cand is None:
+                    cand = {'path': list(path), 'profile': dict(profile), 'success': 0.0, 'failure': 0.0,
+                            'speed_bps': None, 'ts': now}
+                    cands.append(cand)
+                self._touch(cand, now, ('success', 'failure'))
+                cand['success'] += 1
+                if speed_bps:
+                    old = cand.get('speed_bps')
+                    cand['speed_bps'] = speed_bps if not old else 0.7 * old + 0.3 * speed_bps
+
+            # 淘汰已衰减殆尽或多余的候选
+            alive = [c for c in cands if sum(self._decayed_entry(c, now, ('success', 'failure')).values()) >= 0.05]
+            alive.sort(key=lambda c: self._decayed_entry(c, now, ('success',))['success'], reverse=True)
+            entry['candidates'] = alive[:self.MAX_CANDIDATES]
+            self._save_locked()
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            out: Dict[str, Any] = {}
+            for host, entry in self._hosts.items():
+                out[host] = {
+                    'candidates': [{
+                        'path': c.get('path'), 'profile': c.get('profile'),
+                        **{k: round(v, 3) for k, v in self._decayed_entry(c, now, ('success', 'failure')).items()},
+                        'speed_kbps': round((c.get('speed_bps') or 0) / 1024, 1), 'ts': c.get('ts'),
+                    } for c in entry.get('candidates', [])],
+                    'rules': {r: {k: round(v, 3) for k, v in self._decayed_entry(st, now, ('effective', 'ineffective')).items()}
+                              for r, st in entry.get('rules', {}).items()},
+                }
+            return out
+
+
+class FallbackLadder:
+    """按规则表执行回退链"""
+
+    def __init__(self, rules: List[FallbackRule], memory: 'StrategyMemory', log: Callable[[str], None]):
+        self.rules = rules
+        self.memory = memory
+        self.log = log
+        self._by_name = {r.name: r for r in rules}
+
+    def starting_state(self, ctx: FallbackContext) -> Tuple[DownloadState, List[str], Optional[Dict[str, Any]]]:
+        """套用站点记忆中的最佳候选 (成功路径 + 参数档案)，得到首次运行的参数状态"""
+        cand = self.memory.best_candidate(ctx.host)
+        if not cand:
+            return ctx.initial, [], None
+        state, applied = ctx.initial, []
+        for name in cand.get('path') or []:
+            rule = self._by_name.get(name)
+            if rule is None or not rule.learnable or not rule.applies(ctx, state):
+                continue
+            state = rule.transform(ctx, state)
+            applied.append(name)
+        profile = self._learned_profile(ctx, cand.get('profile'))
+        if profile.get('use_aria') and not ctx.aria2c_available:
+            profile['use_aria'] = False
+        if profile:
+            state = state.evolve(**profile)
+        speed = cand.get('speed_bps')
+        self.log(f"[strategy] 按 {ctx.host} 的历史最佳策略起步: {' -> '.join(applied) or '默认路径'}; "
+                 f"{describe_profile(profile_of(state))}" + (f"; 上次 {speed / 1024:.0f} KB/s" if speed else ''))
+        return state, applied, cand
+
+    @staticmethod
+    def _learned_profile(ctx: FallbackContext, profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """档案中由记忆负责的字段 (去掉 tuned_fields，它们每次运行都会被调优器改写)"""
+        return {k: v for k, v in (profile or {}).items() if k in PROFILE_FIELDS and k not in ctx.tuned_fields}
+
+    def run(self, ctx: FallbackContext, execute: Callable[[DownloadState, str], Tuple[int, List[str]]],
+            first_label: str, on_first_failure: Optional[Callable[[int, List[str]], None]] = None,
+            measure: Optional[Callable[[], Optional[int]]] = None
+            ) -> Tuple[int, List[str], DownloadState]:
+        """执行回退链；measure 返回最后一次运行下载的字节数，用于记录站点速度"""
+        state, path, started_from = self.starting_state(ctx)
+        t0 = time.time()
+        rc, recent = execute(state, first_label)
+        if rc != 0 and on_first_failure:
+            on_first_failure(rc, recent)
+
+        spent = 0.0
+        for rule in self.rules:
+            if rc == 0 or rc == 130:
+                break
+            if not rule.applies(ctx, state) or not rule.symptom(recent):
+                continue
+            if self.memory.is_futile(ctx.host, rule.name):
+                self.log(f'[strategy] 跳过 {rule.name}: 在 {ctx.host} 上多次无效')
+                continue
+            if spent + rule.cost > FALLBACK_BUDGET:
+                self.log(f'[strategy] 回退预算已用尽 ({spent:.1f}/{FALLBACK_BUDGET:.1f})，停止重试')
+                break
+            if rule.message:
+                self.log(rule.message)
+            try:
+                next_state = rule.transform(ctx, state)
+            except Exception as e:
+                self.log(f'[strategy] {rule.name} 构建参数异常: {e}')
+                continue
+            spent += rule.cost
+            state = next_state
+            path.append(rule.name)
+            t0 = time.time()
+            rc, recent = execute(state, rule.label)
+            if rc == 130:
+                break
+            self.memory.record_rule(ctx.host, rule.name, rc == 0 or not rule.symptom(recent))
+
+        if rc != 130:
+            speed = None
+            if rc == 0 and measure:
+                nbytes = measure()
+                elapsed = time.time() - t0
+                speed = nbytes / elapsed if nbytes and elapsed > 0 else None
+            if started_from is not None:
+                started_from = {**started_from, 'profile': self._learned_profile(ctx, started_from.get('profile'))}
+            self.memory.record_outcome(ctx.host, [p for p in path if self._by_name[p].learnable],
+                                       self._learned_profile(ctx, profile_of(state)), rc == 0,
+                                       speed_bps=speed, started_from=started_from)
+        return rc, recent, state
+
+
+_memory: Optional[StrategyMemory] = None
+_memory_lock = threading.Lock()
+
+
+def get_strategy_memory() -> StrategyMemory:
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            _memory = StrategyMemory(data_path('strategy_memory.json'))
+        return _memory
+
+
+__all__ = ['DownloadState', 'FallbackContext', 'FallbackRule', 'FallbackLadder', 'StrategyMemory',
+           'get_strategy_memory', 'host_key', 'profile_of', 'describe_profile', 'PROFILE_FIELDS',
+           'FALLBACK_BUDGET', 'FUTILE_AFTER']
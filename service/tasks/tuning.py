@@ -0,0 +1,162 @@
+"""
+分片并发 / 分块大小自适应
+按站点 (host) 记录每次下载的实测吞吐与错误，给出下一次的 --concurrent-fragments / --http-chunk-size：
+
+  - 吞吐相对历史最佳提升 (>5%)：继续加并发 (加性增长，每次约 +50%)
+  - 吞吐明显回落 (<90% 最佳)：退回最佳并发并保持
+  - 出现 403/429 限流或 SSL EOF：并发减半 (乘性回退)，并把出错的并发记为上限；
+    EOF 额外把分块翻倍以减少连接数。上限在 UMD_TUNE_CEILING_HOURS 后失效，重新试探。
+
+结果持久化到 DATA_DIR/tuning.json，后续任务直接从接近最优的点开始。
+  UMD_TUNE_MAX_CONC       并发上限，默认 32
+  UMD_TUNE_MIN_BYTES      参与调优的最小下载量 (MB)，默认 8；过小的下载测速噪声太大
+  UMD_TUNE_TTL_DAYS       超过该天数未更新的记录不再使用，默认 14
+  UMD_TUNE_CEILING_HOURS  出错并发上限的有效期，默认 24
+"""
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..utils.common import data_path, read_json_file, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, '') or default)
+    except ValueError:
+        return default
+
+
+TUNE_MAX_CONC = int(_env_float('UMD_TUNE_MAX_CONC', 32))
+TUNE_MIN_BYTES = _env_float('UMD_TUNE_MIN_BYTES', 8) * 1024 * 1024
+TUNE_TTL_SEC = _env_float('UMD_TUNE_TTL_DAYS', 14) * 86400
+TUNE_CEILING_SEC = _env_float('UMD_TUNE_CEILING_HOURS', 24) * 3600
+MAX_CHUNK_MB = 16
+# 成功完成 (rc=0) 的运行中，同类错误行至少出现这么多次才视为站点压力
+TUNE_RECOVERED_ERRORS = max(1, int(_env_float('UMD_TUNE_RECOVERED_ERRORS', 3)))
+
+_THROTTLE_MARKERS = ('http error 429', 'too many requests', 'http error 403', '403 forbidden')
+_EOF_MARKERS = ('eof occurred in violation of protocol', 'ssleof', 'connection reset', '10054')
+
+
+def classify_run_errors(lines: List[str], rc: Optional[int] = None) -> Optional[str]:
+    """把一次运行的输出归类为 'throttle' (403/429)、'eof' 或 None。
+    失败的运行 (rc != 0) 出现一次即归类；成功的运行说明 yt-dlp 内部重试已恢复，
+    偶发一两次不算，同类错误行达到 TUNE_RECOVERED_ERRORS 才归类"""
+    lowered = [line.lower() for line in lines]
+    threshold = 1 if rc != 0 else TUNE_RECOVERED_ERRORS
+    for kind, markers in (('throttle', _THROTTLE_MARKERS), ('eof', _EOF_MARKERS)):
+        if sum(1 for line in lowered if any(m in line for m in markers)) >= threshold:
+            return kind
+    return None
+
+
+def _chunk_mb(chunk: str) -> int:
+    m = re.match(r'^(\d+)\s*([KMG]?)', (chunk or '').upper())
+    if not m:
+        return 4
+    n, unit = int(m.group(1)), m.group(2)
+    if unit == 'G':
+        return n * 1024
+    if unit == 'K':
+        return max(1, n // 1024)
+    return max(1, n)
+
+
+class ConcurrencyTuner:
+    """按站点的并发/分块反馈控制器"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        data = read_json_file(path, {})
+        self._hosts: Dict[str, Dict[str, Any]] = data.get('hosts', {}) if isinstance(data, dict) else {}
+
+    def suggest(self, host: str, default_conc: int, default_chunk: str) -> Tuple[int, str, Optional[str]]:
+        """返回 (并发, 分块, 说明)；无可用历史时返回默认值与 None"""
+        now = time.time()
+        with self._lock:
+            e = self._hosts.get(host)
+            if not e or now - e.get('ts', 0) > TUNE_TTL_SEC:
+                return default_conc, default_chunk, None
+            conc, chunk = max(1, int(e['conc'])), e.get('chunk') or default_chunk
+            best = e.get('best_bps') or 0
+        note = f"[tune] {host} 历史调优: 并发={conc}, 块={chunk}" + (f" (最佳 {best / 1024:.0f} KB/s)" if best else '')
+        return conc, chunk, note
+
+    def observe(self, host: str, conc: int, chunk: str, nbytes: int, elapsed: float, error: Optional[str]):
+        """记录一次运行的结果并计算下一次的并发/分块"""
+        if not host or conc <= 0:
+            return
+        bps = nbytes / elapsed if nbytes >= TUNE_MIN_BYTES and elapsed > 0 else None
+        if bps is None and error is None:
+            return
+        now = time.time()
+        with self._lock:
+            e = self._hosts.setdefault(host, {'conc': conc, 'chunk': chunk, 'best_conc': conc, 'best_bps': 0.0,
+                                              'ceiling': None, 'ceiling_ts': 0, 'samples': {}, 'ts': now})
+            if e.get('ceiling') and now - e.get('ceiling_ts', 0) > TUNE_CEILING_SEC:
+                e['ceiling'] = None
+            ceiling = e.get('ceiling')
+            limit = max(1, min(TUNE_MAX_CONC, ceiling - 1)) if ceiling else TUNE_MAX_CONC
+
+            if error in ('throttle', 'eof'):
+                e['ceiling'] = conc if not ceiling else min(ceiling, conc)
+                e['ceiling_ts'] = now
+                e['conc'] = max(1, conc // 2)
+                if error == 'eof':
+                    e['chunk'] = f"{min(MAX_CHUNK_MB, _chunk_mb(chunk) * 2)}M"
+                if e.get('best_conc', 0) >= conc:
+                    e['best_conc'] = e['conc']
+                decision = f"{error} -> 并发 {conc}->{e['conc']}, 块 {e['chunk']}"
+            elif bps is not None:
+                samples = e.setdefault('samples', {})
+                prev = samples.get(str(conc))
+                samples[str(conc)] = bps if not prev else 0.6 * prev + 0.4 * bps
+                best = e.get('best_bps') or 0.0
+                if bps > best * 1.05:
+                    e['best_conc'], e['best_bps'] = conc, bps
+                    e['conc'] = min(limit, conc + max(1, conc // 2))
+                    decision = f"提升 -> 试探并发 {e['conc']}"
+                elif bps < best * 0.9:
+                    e['conc'] = min(limit, int(e.get('best_conc') or conc))
+                    # 最佳值缓慢衰减，网络条件变化后允许重新爬坡
+                    e['best_bps'] = best * 0.95
+                    decision = f"回落 -> 退回并发 {e['conc']}"
+                else:
+                    e['conc'] = min(limit, conc)
+                    decision = f"持平 -> 保持并发 {e['conc']}"
+                e['chunk'] = chunk
+            else:
+                return
+            e['ts'] = now
+            self._save_locked()
+        logger.info(f"[tune] {host}: 并发={conc} 块={chunk} "
+                    f"{(bps or 0) / 1024:.0f} KB/s, {decision}")
+
+    def _save_locked(self):
+        write_json_atomic(self.path, {'version': 1, 'hosts': self._hosts})
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {h: dict(e) for h, e in self._hosts.items()}
+
+
+_tuner: Optional[ConcurrencyTuner] = None
+_tuner_lock = threading.Lock()
+
+
+def get_concurrency_tuner() -> ConcurrencyTuner:
+    global _tuner
+    with _tuner_lock:
+        if _tuner is None:
+            _tuner = ConcurrencyTuner(data_path('tuning.json'))
+        return _tuner
+
+
+__all__ = ['ConcurrencyTuner', 'get_concurrency_tuner', 'classify_run_errors']
@@ -0,0 +1,155 @@
+"""
+下载吞吐看门狗
+按 yt-dlp / aria2c / ffmpeg 的进度行估算已下载字节数，在滑动窗口内统计平均吞吐；
+持续低于阈值 (或进度行停止推进但连接未断) 时判定为吞吐崩塌，由下载器终止子进程并换策略续传。
+
+环境变量:
+  UMD_STALL_WINDOW_SEC    统计窗口 (秒)，默认 45
+  UMD_STALL_MIN_KBPS      窗口平均吞吐下限 (KB/s)，默认 50；0 关闭看门狗
+  UMD_STALL_GRACE_SEC     首个进度行之后的预热时间 (秒)，默认 20
+  UMD_STALL_MAX_RESTARTS  单次下载尝试内的最大换策略重启次数，默认 3
+重启策略 (切换 aria2c / 调整并发与分块 / 停用代理) 见 downloader._stall_strategies。
+"""
+import os
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, '') or default)
+    except ValueError:
+        return default
+
+
+STALL_WINDOW_SEC = _env_float('UMD_STALL_WINDOW_SEC', 45)
+STALL_MIN_BPS = _env_float('UMD_STALL_MIN_KBPS', 50) * 1024
+STALL_GRACE_SEC = _env_float('UMD_STALL_GRACE_SEC', 20)
+STALL_MAX_RESTARTS = int(_env_float('UMD_STALL_MAX_RESTARTS', 3))
+
+_UNITS = {'': 1, 'B': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+# [download]  45.2% of ~  12.34MiB at    1.23MiB/s ETA 00:10 (frag 5/20)
+_YTDLP_PROGRESS_RE = re.compile(
+    r'\[download\]\s+(\d+(?:\.\d+)?)%\s+of\s+~?\s*([\d.]+)\s*([KMGT]?)i?B'
+    r'(?:.*?\bat\s+([\d.]+)\s*([KMGT]?)i?B/s)?')
+# [#2089b0 400KiB/33MiB(1%) CN:16 DL:115KiB ETA:4m52s]
+_ARIA2_PROGRESS_RE = re.compile(
+    r'\[#\w+\s+([\d.]+)\s*([KMGT]?)i?B/([\d.]+)\s*([KMGT]?)i?B\(\d+%\).*?DL:([\d.]+)\s*([KMGT]?)i?B')
+
+# ffmpeg (边下边合并): size=   10240KiB time=00:01:02.03 bitrate=1352.1kbits/s speed=2.1x
+_FFMPEG_PROGRESS_RE = re.compile(r'^(?:frame=.*?)?size=\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B\s+time=', re.I)
+
+
+def _to_bytes(num: str, unit: str) -> int:
+    try:
+        return int(float(num) * _UNITS.get((unit or '').upper(), 1))
+    except ValueError:
+        return 0
+
+
+def parse_progress(line: str) -> Optional[Tuple[int, Optional[int], Optional[float]]]:
+    """解析进度行，返回 (已下载字节, 总字节, 瞬时速度 B/s)；非进度行返回 None"""
+    m = _ARIA2_PROGRESS_RE.search(line)
+    if m:
+        done = _to_bytes(m.group(1), m.group(2))
+        total = _to_bytes(m.group(3), m.group(4)) or None
+        return done, total, float(_to_bytes(m.group(5), m.group(6)))
+    m = _YTDLP_PROGRESS_RE.search(line)
+    if m:
+        total = _to_bytes(m.group(2), m.group(3)) or None
+        done = int(float(m.group(1)) / 100.0 * total) if total else 0
+        speed = float(_to_bytes(m.group(4), m.group(5))) if m.group(4) else None
+        return done, total, speed
+    m = _FFMPEG_PROGRESS_RE.search(line)
+    if m:
+        return _to_bytes(m.group(1), m.group(2)), None, None
+    return None
+
+
+class ThroughputWatchdog:
+    """滑动窗口吞吐统计
+
+    只累计正向增量：合并下载时视频/音频先后各从 0% 开始，进度回落视为新文件。
+    """
+
+    def __init__(self, window: float = STALL_WINDOW_SEC, min_bps: float = STALL_MIN_BPS,
+                 grace: float = STALL_GRACE_SEC):
+        self.window = window
+        self.min_bps = min_bps
+        self.grace = grace
+        self._samples: Deque[Tuple[float, int]] = deque()  # (ts, 新增字节)
+        self._last_done = 0
+        self._armed_at: Optional[float] = None
+        self._finished = False
+        self.tripped: Optional[str] = None  # 最近一次判定崩塌的原因
+        self.bytes_total = 0  # 本次运行累计下载字节 (各文件增量之和)
+        self._last_sample_ts: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.min_bps > 0 and self.window > 0
+
+    def feed(self, line: str, now: Optional[float] = None) -> Optional[Tuple[int, Optional[int], Optional[float]]]:
+        parsed = parse_progress(line)
+        if parsed is None:
+            return None
+        now = now or time.time()
+        done, total, _ = parsed
+        if self._armed_at is None:
+            self._armed_at = now
+        if done >= self._last_done:
+            delta = done - self._last_done
+        else:
+            # 大幅回落视为开始下载下一个文件；小幅回落来自 HLS 总大小估算 (~) 的修正
+            delta = done if done < self._last_done // 2 else 0
+        self._last_done = done
+        if delta > 0:
+            self._samples.append((now, delta))
+            self.bytes_total += delta
+            self._last_sample_ts = now
+        # 单个文件达到 100% 后进入合并/后处理，暂停判定直到出现新的进度
+        self._finished = bool(total) and done >= total
+        return parsed
+
+    @property
+    def active_seconds(self) -> float:
+        """从首个进度行到最后一次有字节增长的时长 (不含解析与合并阶段)"""
+        if self._armed_at is None or self._last_sample_ts is None:
+            return 0.0
+        return max(self._last_sample_ts - self._armed_at, 0.0)
+
+    def throughput(self, now: Optional[float] = None) -> float:
+        """窗口内平均吞吐 (B/s)"""
+        now = now or time.time()
+        cutoff = now - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return sum(n for _, n in self._samples) / self.window
+
+    def check(self, now: Optional[float] = None) -> Optional[str]:
+        """返回崩塌原因 (需重启)，正常时返回 None"""
+        if not self.enabled or self._armed_at is None or self._finished:
+            return None
+        now = now or time.time()
+        if now - self._armed_at < self.grace + self.window:
+            return None
+        bps = self.throughput(now)
+        if bps >= self.min_bps:
+            return None
+        if not self._samples:
+            self.tripped = f'{int(self.window)} 秒内进度无推进'
+        else:
+            self.tripped = f'{int(self.window)} 秒平均吞吐 {bps / 1024:.1f} KB/s 低于 {self.min_bps / 1024:.0f} KB/s'
+        return self.tripped
+
+
+def stall_event(reason: str, strategy: str, bps: float, restart: int) -> Dict[str, Any]:
+    return {'ts': time.time(), 'reason': reason, 'strategy': strategy,
+            'throughput_kbps': round(bps / 1024, 1), 'restart': restart}
+
+
+__all__ = ['ThroughputWatchdog', 'parse_progress', 'stall_event',
+           'STALL_WINDOW_SEC', 'STALL_MIN_BPS', 'STALL_GRACE_SEC', 'STALL_MAX_RESTARTS']
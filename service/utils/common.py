@@ -99,3 +99,45 @@ def retry_on_failure(max_retries: int = 3, backoff_factor: float = 2.0, exceptio
             raise RuntimeError(f"{func.__name__} 执行失败且未捕获具体异常")
         return wrapper
     return decorator
+
+def data_path(*parts: str) -> Optional[str]:
+    """运行状态数据文件路径 (UMD_DATA_DIR > config.DATA_DIR)；均未配置时返回 None"""
+    import os
+    data_dir = os.environ.get('UMD_DATA_DIR')
+    if not data_dir:
+        try:
+            import config
+            data_dir = getattr(config, 'DATA_DIR', None)
+        except ImportError:
+            data_dir = None
+    return os.path.join(data_dir, *parts) if data_dir else None
+
+def read_json_file(path: Optional[str], default: Any = None) -> Any:
+    """读取 JSON 文件；不存在或损坏时返回 default"""
+    import json
+    import os
+    if not path or not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"读取 {path} 失败，忽略: {e}")
+        return default
+
+def write_json_atomic(path: Optional[str], data: Any) -> bool:
+    """先写临时文件再 os.replace，避免进程中断留下半截 JSON"""
+    import json
+    import os
+    if not path:
+        return False
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+        return True
+    except Exception as e:
+        logger.warning(f"保存 {path} 失败: {e}")
+        return False
@@ -15,14 +15,8 @@ logger = logging.getLogger(__name__)
 # 定义一个全局的、只在Windows上生效的创建标志，用于隐藏子进程窗口
 CREATE_NO_WINDOW = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
 
-_ffmpeg_path_cache = None
-
-def get_ffmpeg_path():
-    """返回 ffmpeg 可执行文件路径。"""
-    global _ffmpeg_path_cache
-    if _ffmpeg_path_cache not in (None, False):
-        return _ffmpeg_path_cache
-
+def ffmpeg_candidates() -> list:
+    """ffmpeg 可执行文件候选 (按优先级)"""
     candidates = []
     # 1) 配置中解析的打包路径
     candidates.append(config.FFMPEG_BUNDLED_PATH)
@@ -39,25 +33,12 @@ def get_ffmpeg_path():
         candidates.append(os.path.join(mp, 'ffmpeg', 'bin', 'ffmpeg.exe'))
     # 4) PATH 中的 ffmpeg
     candidates.append(config.FFMPEG_SYSTEM_PATH)
+    return candidates
 
-    checked = []
-    for cand in candidates:
-        if not cand or cand in checked:
-            continue
-        checked.append(cand)
-        if not os.path.exists(cand):
-            continue
-        try:
-            r = subprocess.run([cand, '-version'], capture_output=True, creationflags=CREATE_NO_WINDOW, timeout=4)
-            if r.returncode == 0:
-                _ffmpeg_path_cache = cand
-                logger.info(f"[FFMPEG] 选用: {cand}")
-                return cand
-        except Exception:
-            continue
-    logger.warning(f"[FFMPEG] 未找到可用 ffmpeg (已检查 {len(candidates)} 个候选)")
-    _ffmpeg_path_cache = False
-    return None
+def get_ffmpeg_path():
+    """返回 ffmpeg 可执行文件路径 (由工具注册表解析一次并缓存；不可用时返回 None，不会每次重新扫描)。"""
+    from .tools import get_tool_registry
+    return get_tool_registry().path('ffmpeg')
 
 def detect_aria2c() -> str | None:
     """自动检测 aria2c 可执行文件路径"""
@@ -120,7 +101,9 @@ def check_ytdlp_update():
         if 'yt-dlp is up to date' in result.stdout:
             return {'status': 'up_to_date', 'current_version': current_version}
         elif 'Updated yt-dlp to' in result.stdout:
-            # 已经更新了，获取新版本
+            # 已经更新了，刷新注册表并获取新版本
+            from .tools import get_tool_registry
+            get_tool_registry().refresh(['yt-dlp'])
             new_version = get_ytdlp_version()
             return {'status': 'updated', 'old_version': current_version, 'new_version': new_version}
         else:
@@ -139,6 +122,8 @@ def update_ytdlp():
 
         if result.returncode == 0:
             if 'Updated yt-dlp to' in result.stdout:
+                from .tools import get_tool_registry
+                get_tool_registry().refresh(['yt-dlp'])
                 new_version = get_ytdlp_version()
                 logger.info(f"yt-dlp 更新成功，新版本: {new_version}")
                 return {'success': True, 'message': '更新成功', 'new_version': new_version}
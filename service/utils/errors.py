@@ -14,6 +14,8 @@ _ERROR_MAP = [
     ("IncompleteRead", ("network", "网络不稳定/连接被重置")),
     ("timed out", ("timeout", "网络超时")),
     ("Unable to extract", ("extract_fail", "解析失败 (可能版本过旧)")),
+    ("磁盘空间不足", ("disk_full", "磁盘空间不足")),
+    ("No space left on device", ("disk_full", "磁盘空间不足")),
 ]
 
 def classify_error(msg: str):
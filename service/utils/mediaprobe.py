@@ -0,0 +1,162 @@
+"""
+ffprobe 单次 JSON 探测
+每个文件只执行一次 `ffprobe -show_streams -show_format -of json`，结果按文件身份
+(设备+inode 或路径、大小、修改时间) 缓存；组件分类、元数据填充与 meta 文件写入共用同一份结果。
+同卷 rename (工作目录 -> 下载目录) 不改变 inode，移动后仍命中缓存。
+常见情况下字段可直接由 yt-dlp 探测信息 + 选中的 format_id 推导 (format_fields)，无需再跑 ffprobe。
+"""
+import json
+import logging
+import os
+import subprocess
+import threading
+from typing import Any, Dict, Optional
+
+from .cache import LRUCache
+from .dependencies import CREATE_NO_WINDOW
+from .tools import get_tool_registry, tool_in_dir
+
+logger = logging.getLogger(__name__)
+
+_probe_cache = LRUCache(max_size=256, ttl=6 * 3600)
+_probe_lock = threading.Lock()
+
+
+def ffprobe_binary(ffmpeg_path: Optional[str]) -> str:
+    """按 ffmpeg 位置推导 ffprobe (同目录)；找不到时用注册表解析的 ffprobe，再交给 PATH"""
+    if ffmpeg_path:
+        base = ffmpeg_path if os.path.isdir(ffmpeg_path) else os.path.dirname(ffmpeg_path)
+        cand = tool_in_dir(base, 'ffprobe') if base else None
+        if cand:
+            return cand
+    return get_tool_registry().path('ffprobe') or 'ffprobe'
+
+
+def _cache_key(path: str) -> Optional[str]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    ident = f"{st.st_dev}:{st.st_ino}" if st.st_ino else os.path.abspath(path)
+    return f"{ident}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def probe_media(path: str, ffmpeg_path: Optional[str] = None, timeout: float = 15) -> Optional[Dict[str, Any]]:
+    """返回 ffprobe 的 JSON 结果 ({'streams': [...], 'format': {...}})；失败返回 None"""
+    key = _cache_key(path)
+    if key is None:
+        return None
+    with _probe_lock:
+        hit = _probe_cache.get(key)
+    if hit is not None:
+        return hit
+    cmd = [ffprobe_binary(ffmpeg_path), '-v', 'error', '-show_streams', '-show_format', '-of', 'json', path]
+    try:
+        p = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore',
+                           timeout=timeout, creationflags=CREATE_NO_WINDOW)
+        if p.returncode != 0:
+            return None
+        data = json.loads(p.stdout or '{}')
+    except (OSError, ValueError, subprocess.SubprocessError) as e:
+        logger.debug(f"ffprobe 失败 {path}: {e}")
+        return None
+    data.setdefault('streams', [])
+    data.setdefault('format', {})
+    with _probe_lock:
+        _probe_cache.set(key, data)
+    return data
+
+
+def _first_stream(probe: Dict[str, Any], codec_type: str) -> Optional[Dict[str, Any]]:
+    for st in probe.get('streams') or []:
+        # 封面图 (attached_pic) 不算视频轨
+        if st.get('codec_type') == codec_type and not (st.get('disposition') or {}).get('attached_pic'):
+            return st
+    return None
+
+
+def classify_probe(probe: Optional[Dict[str, Any]]) -> str:
+    """video | audio | unknown"""
+    if not probe:
+        return 'unknown'
+    if _first_stream(probe, 'video'):
+        return 'video'
+    if _first_stream(probe, 'audio'):
+        return 'audio'
+    return 'unknown'
+
+
+def media_fields(probe: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """提取 Task / meta 使用的字段：width/height/vcodec/acodec/duration/bitrate/container"""
+    if not probe:
+        return {}
+    fields: Dict[str, Any] = {}
+    v = _first_stream(probe, 'video')
+    if v:
+        if v.get('width'):
+            fields['width'] = int(v['width'])
+        if v.get('height'):
+            fields['height'] = int(v['height'])
+        if v.get('codec_name'):
+            fields['vcodec'] = v['codec_name']
+    a = _first_stream(probe, 'audio')
+    if a and a.get('codec_name'):
+        fields['acodec'] = a['codec_name']
+    fmt = probe.get('format') or {}
+    try:
+        if fmt.get('duration'):
+            fields['duration'] = float(fmt['duration'])
+        if fmt.get('bit_rate'):
+            fields['bitrate'] = int(fmt['bit_rate'])
+    except (TypeError, ValueError):
+        pass
+    if fmt.get('format_name'):
+        fields['container'] = fmt['format_name']
+    return fields
+
+
+_CODEC_ALIASES = (('avc', 'h264'), ('h264', 'h264'), ('hev', 'hevc'), ('hvc', 'hevc'), ('h265', 'hevc'),
+                  ('vp09', 'vp9'), ('vp9', 'vp9'), ('vp8', 'vp8'), ('av01', 'av1'), ('av1', 'av1'),
+                  ('mp4a', 'aac'), ('aac', 'aac'), ('opus', 'opus'), ('vorbis', 'vorbis'), ('ec-3', 'eac3'),
+                  ('eac3', 'eac3'), ('ac-3', 'ac3'), ('ac3', 'ac3'), ('mp3', 'mp3'), ('flac', 'flac'))
+
+
+def normalize_codec(codec: Optional[str]) -> Optional[str]:
+    """yt-dlp 的 codec 串 (avc1.640028 / mp4a.40.2) 归一为 ffprobe 的 codec_name；none/未知返回 None"""
+    if not codec or codec == 'none':
+        return None
+    c = str(codec).lower()
+    for prefix, name in _CODEC_ALIASES:
+        if c.startswith(prefix):
+            return name
+    return c.split('.')[0]
+
+
+def format_fields(info: Optional[Dict[str, Any]], format_id: Optional[str] = None) -> Dict[str, Any]:
+    """按 yt-dlp 探测信息与选中的 format_id (如 '137+140') 推导 width/height/vcodec/acodec/duration/bitrate"""
+    if not isinstance(info, dict):
+        return {}
+    by_id = {str(f.get('format_id')): f for f in info.get('formats') or [] if isinstance(f, dict)}
+    fid = str(format_id or info.get('format_id') or '')
+    chosen = ([by_id[i] for i in fid.split('+') if i in by_id]
+              or [f for f in info.get('requested_formats') or [] if isinstance(f, dict)] or [info])
+    fields: Dict[str, Any] = {}
+    for f in chosen:
+        vcodec, acodec = normalize_codec(f.get('vcodec')), normalize_codec(f.get('acodec'))
+        if vcodec and 'vcodec' not in fields:
+            fields['vcodec'] = vcodec
+            if f.get('width'):
+                fields['width'] = int(f['width'])
+            if f.get('height'):
+                fields['height'] = int(f['height'])
+        if acodec and 'acodec' not in fields:
+            fields['acodec'] = acodec
+    tbr = sum(f.get('tbr') or 0 for f in chosen)
+    if tbr:
+        fields['bitrate'] = int(tbr * 1000)
+    if info.get('duration'):
+        fields['duration'] = float(info['duration'])
+    return fields
+
+
+__all__ = ['probe_media', 'classify_probe', 'media_fields', 'ffprobe_binary', 'normalize_codec', 'format_fields']
@@ -1,5 +1,10 @@
+import os
 import re
-from typing import List
+import shutil
+import tempfile
+import zlib
+from dataclasses import asdict, dataclass
+from typing import Iterator, List, Optional, TextIO
 
 # ---------------- Subtitle Utilities: merge multi-line cue to single line ----------------
 _cjk_ranges = (
@@ -9,13 +14,17 @@ _cjk_ranges = (
     (0xAC00, 0xD7AF),  # Hangul Syllables
 )
 
+# 预先计算的码位查表 (到最大的区间上限为止，约 55KB)，按字符判断只需一次索引
+_CJK_TABLE = bytearray(max(end for _, end in _cjk_ranges) + 1)
+for _start, _end in _cjk_ranges:
+    _CJK_TABLE[_start:_end + 1] = b'\x01' * (_end - _start + 1)
+
+
 def _is_cjk_char(ch: str) -> bool:
     if not ch: return False
     code = ord(ch)
-    for (start, end) in _cjk_ranges:
-        if start <= code <= end:
-            return True
-    return False
+    return code < len(_CJK_TABLE) and _CJK_TABLE[code] == 1
+
 
 def _merge_lines_to_single(lines: List[str]) -> str:
     """
@@ -26,11 +35,11 @@ def _merge_lines_to_single(lines: List[str]) -> str:
     """
     if not lines:
         return ""
-    
+
     cleaned = [ln.strip() for ln in lines if ln.strip()]
     if not cleaned:
         return ""
-        
+
     result = cleaned[0]
     for i in range(1, len(cleaned)):
         prev = result[-1]
@@ -41,35 +50,189 @@ def _merge_lines_to_single(lines: List[str]) -> str:
             result += " " + cleaned[i]
     return result
 
-def normalize_srt_inplace(path: str):
+
+# ---------------- Streaming SRT / WebVTT normalizer ----------------
+# 时间轴行：无嵌套量词，逐行匹配为线性时间
+_TIMING_RE = re.compile(r'^\s*((?:\d+:)?\d{1,2}:\d{2}[,.]\d{1,3})\s*-->\s*((?:\d+:)?\d{1,2}:\d{2}[,.]\d{1,3})(.*)$')
+_VTT_META_BLOCKS = ('NOTE', 'STYLE', 'REGION')
+
+
+@dataclass
+class SubtitleReport:
+    """一次规范化的改动统计"""
+    path: str
+    format: str = 'srt'
+    cues: int = 0                 # 输出的字幕条数
+    merged: int = 0               # 多行文本合并为单行的条数
+    dropped_empty: int = 0        # 丢弃的空文本条目
+    continuations: int = 0        # 被空行截断、并回上一条的文本块
+    malformed: int = 0            # 无法识别、原样保留的块
+    renumbered: int = 0           # 重新编号的条目 (SRT)
+    timing_fixed: int = 0         # 时间戳格式修正 (补小时位/毫秒位、SRT 小数点改逗号)
+    bom_removed: bool = False
+    crlf_fixed: int = 0           # 转换为 LF 的 CRLF/CR 行尾
+    changed: bool = False
+
+    def summary(self) -> str:
+        if not self.changed:
+            return f'{self.cues} 条，无需改动'
+        parts = [f'{self.cues} 条']
+        for label, n in (('合并多行', self.merged), ('丢弃空条目', self.dropped_empty),
+                         ('并回截断文本', self.continuations), ('保留异常块', self.malformed),
+                         ('重新编号', self.renumbered), ('修正时间戳', self.timing_fixed),
+                         ('转换行尾', self.crlf_fixed)):
+            if n:
+                parts.append(f'{label} {n}')
+        if self.bom_removed:
+            parts.append('去除 BOM')
+        return '，'.join(parts)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def _fix_timestamp(ts: str, sep: str) -> str:
+    """补齐为 HH:MM:SS{sep}mmm"""
+    clock, frac = re.split(r'[,.]', ts, maxsplit=1)
+    parts = clock.split(':')
+    if len(parts) == 2:
+        parts.insert(0, '0')
+    h, m, s = parts
+    return f"{int(h):02d}:{int(m):02d}:{s}{sep}{frac.ljust(3, '0')}"
+
+
+def _iter_blocks(f: TextIO, report: SubtitleReport, crc: List[int]) -> Iterator[List[str]]:
+    """按空行切块，逐行读取；顺带统计行尾与输入校验和"""
+    block: List[str] = []
+    for raw in f:
+        crc[0] = zlib.crc32(raw.encode('utf-8', 'surrogateescape'), crc[0])
+        line = raw.rstrip('\r\n')
+        if raw.endswith('\r\n') or raw.endswith('\r'):
+            report.crlf_fixed += 1
+        if line.strip():
+            block.append(line)
+        elif block:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+class _Writer:
+    def __init__(self, f: TextIO):
+        self.f = f
+        self.crc = 0
+        self.first = True
+
+    def block(self, lines: List[str]):
+        text = ('' if self.first else '\n') + '\n'.join(lines) + '\n'
+        self.first = False
+        self.crc = zlib.crc32(text.encode('utf-8', 'surrogateescape'), self.crc)
+        self.f.write(text)
+
+
+def _normalize_stream(src: TextIO, out: _Writer, report: SubtitleReport, crc: List[int]):
+    is_vtt = report.format == 'vtt'
+    sep = '.' if is_vtt else ','
+    pending: Optional[List[str]] = None  # [标识, 时间轴, 文本行...]，等下一块确认不是续行后再输出
+
+    def flush():
+        nonlocal pending
+        if pending is None:
+            return
+        ident, timing, text = pending[0], pending[1], pending[2:]
+        pending = None
+        merged = _merge_lines_to_single(text)
+        if not merged:
+            report.dropped_empty += 1
+            return
+        if len([t for t in text if t.strip()]) > 1:
+            report.merged += 1
+        report.cues += 1
+        if is_vtt:
+            out.block(([ident] if ident else []) + [timing, merged])
+            return
+        if ident != str(report.cues):
+            report.renumbered += 1
+        out.block([str(report.cues), timing, merged])
+
+    for idx, block in enumerate(_iter_blocks(src, report, crc)):
+        head = block[0].strip()
+        if is_vtt and idx == 0 and head.startswith('WEBVTT'):
+            out.block(block)
+            continue
+        if is_vtt and head.split(' ', 1)[0] in _VTT_META_BLOCKS:
+            flush()
+            out.block(block)
+            continue
+
+        # 时间轴在第一行 (无编号) 或第二行 (编号/标识在前)
+        m = _TIMING_RE.match(block[0])
+        ident, body = '', block[1:]
+        if m is None and len(block) > 1:
+            m = _TIMING_RE.match(block[1])
+            ident, body = head, block[2:]
+        if m is None:
+            if pending is not None:
+                # 文本中间的空行把一条字幕截成了两块
+                pending.extend(block)
+                report.continuations += 1
+            else:
+                out.block(block)
+                report.malformed += 1
+            continue
+
+        flush()
+        start, end, settings = m.group(1), m.group(2), m.group(3)
+        fixed_start, fixed_end = _fix_timestamp(start, sep), _fix_timestamp(end, sep)
+        if (fixed_start, fixed_end) != (start, end):
+            report.timing_fixed += 1
+        timing = f"{fixed_start} --> {fixed_end}" + (settings.rstrip() if is_vtt else '')
+        pending = [ident, timing, *body]
+    flush()
+
+
+def normalize_subtitle_file(path: str) -> SubtitleReport:
     """
-    Re-process the .srt file:
-    1. Merge multi-line text in one cue block into single line (smart CJK merge).
-    2. Overwrite the file.
+    Stream-normalize an .srt / .vtt file:
+    1. Merge multi-line text in one cue into a single line (smart CJK merge); drop empty cues.
+    2. Strip BOM, convert CRLF to LF, renumber SRT cues, pad timestamps.
+    3. Write to a temp file in the same directory and atomically replace the original (only if changed).
+    Errors propagate to the caller.
     """
+    report = SubtitleReport(path=path)
+    with open(path, 'rb') as fb:
+        head = fb.read(16)
+    report.bom_removed = head.startswith(b'\xef\xbb\xbf')
+    body = head[3:] if report.bom_removed else head
+    if path.lower().endswith('.vtt') or body.startswith(b'WEBVTT'):
+        report.format = 'vtt'
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix='.sub-', suffix='.tmp', dir=directory)
+    crc = [0]
     try:
-        with open(path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-        # Regex to find SRT blocks: 
-        # Group 1: Index
-        # Group 2: Timestamp
-        # Group 3: Content (multi-line)
-        pattern = re.compile(r'(\d+)\n(\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d{2},\d{3})\n((?:.|[\r\n])*?)(?=\n\d+\n|\Z)', re.MULTILINE)
-        
-        new_blocks = []
-        for match in pattern.finditer(content):
-            idx = match.group(1)
-            ts = match.group(2)
-            raw_text = match.group(3)
-            lines = raw_text.split('\n')
-            merged = _merge_lines_to_single(lines)
-            if merged:
-                new_blocks.append(f"{idx}\n{ts}\n{merged}\n")
-        
-        if new_blocks:
-            with open(path, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(new_blocks))
-                
-    except Exception:
-        pass
+        with open(path, 'r', encoding='utf-8-sig', errors='surrogateescape', newline='') as src, \
+                os.fdopen(fd, 'w', encoding='utf-8', errors='surrogateescape', newline='\n') as dst:
+            writer = _Writer(dst)
+            _normalize_stream(src, writer, report, crc)
+        report.changed = report.bom_removed or writer.crc != crc[0] or \
+            os.path.getsize(tmp) != os.path.getsize(path) - (3 if report.bom_removed else 0)
+        if report.changed and not writer.first:
+            shutil.copymode(path, tmp)  # mkstemp 创建的文件权限为 0600
+            os.replace(tmp, path)
+        else:
+            report.changed = report.changed and not writer.first
+            os.remove(tmp)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return report
+
+
+def normalize_srt_inplace(path: str) -> SubtitleReport:
+    """兼容旧入口：等同 normalize_subtitle_file"""
+    return normalize_subtitle_file(path)
@@ -0,0 +1,332 @@
+"""
+封面缩略图缓存
+已知封面 URL (探测结果 / 前端 info_cache 中的 thumbnail) 时直接用连接池 HTTP 客户端下载，不再为封面单独拉起 yt-dlp。
+缓存按内容寻址：<root>/<sha256 前 32 位>.<ext>，同一张图无论来自哪个 URL 只存一份；
+URL -> 内容文件的映射记录在 <root>/refs/<sha1(url)>，下载任务与 Web UI (/api/thumbnails/...) 共用。
+非 jpg 格式只在调用方要求 jpg 且有 ffmpeg 时才转换。
+服务端抓取只访问公网地址：每一跳 (含重定向) 都解析主机并拒绝回环/内网/链路本地等地址 (经代理时同样在本地解析检查)，
+直连时读取响应体前再核对实际连接的对端地址，防止 DNS 重新绑定；
+带 Cookie/Authorization 取得的封面按凭据指纹单独登记，不会经 /api/thumbnail 提供给未带凭据的请求；
+缓存超过上限时按最近使用时间淘汰。
+
+环境变量:
+  UMD_THUMB_CACHE_DIR      缓存目录 (默认 <数据目录>/thumbnails，未配置数据目录时用系统临时目录)
+  UMD_THUMB_CACHE_MAX_MB   缓存上限 (MB)，默认 256
+"""
+import hashlib
+import ipaddress
+import logging
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .common import data_path
+from .dependencies import CREATE_NO_WINDOW
+
+logger = logging.getLogger(__name__)
+
+MAX_THUMBNAIL_BYTES = 20 * 1024 * 1024
+MAX_REDIRECTS = 5
+_CREDENTIAL_HEADERS = ('cookie', 'authorization')
+try:
+    MAX_CACHE_BYTES = int(float(os.environ.get('UMD_THUMB_CACHE_MAX_MB', '') or 256) * 1024 * 1024)
+except ValueError:
+    MAX_CACHE_BYTES = 256 * 1024 * 1024
+_USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+               'Chrome/120.0.0.0 Safari/537.36')
+
+
+def sniff_image_ext(data: bytes) -> Optional[str]:
+    """按文件头判断图片格式；不是图片时返回 None"""
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if data[4:12] in (b'ftypavif', b'ftypavis'):
+        return 'avif'
+    return None
+
+
+def check_public_url(url: str, resolve: bool = True):
+    """只允许 http/https 且主机为公网地址；resolve=False 时只检查字面 IP"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError('只支持 http/https 封面地址')
+    host = parsed.hostname
+    try:
+        addrs = {ipaddress.ip_address(host)}
+    except ValueError:
+        if not resolve:
+            return
+        try:
+            infos = socket.getaddrinfo(host, parsed.port or (443 if parsed.scheme == 'https' else 80),
+                                       proto=socket.IPPROTO_TCP)
+        except socket.gaierror as e:
+            raise ValueError(f'无法解析主机 {host}: {e}')
+        addrs = {ipaddress.ip_address(info[4][0].split('%', 1)[0]) for info in infos}
+    for addr in addrs:
+        if not addr.is_global:
+            raise ValueError(f'拒绝访问非公网地址: {host} ({addr})')
+
+
+def _check_peer(resp):
+    """读取响应体之前确认实际连接的对端仍是公网地址 (防止检查与连接之间 DNS 重新绑定到内网)"""
+    conn = getattr(resp.raw, 'connection', None) or getattr(resp.raw, '_connection', None)
+    sock = getattr(conn, 'sock', None)
+    try:
+        peer = ipaddress.ip_address(sock.getpeername()[0].split('%', 1)[0])
+    except (AttributeError, OSError, ValueError):
+        raise ValueError('无法确认封面连接的对端地址')
+    if not peer.is_global:
+        raise ValueError(f'拒绝访问非公网地址: {urlparse(resp.url).hostname} ({peer})')
+
+
+def _credential_key(headers: Optional[Dict[str, str]]) -> str:
+    """请求凭据 (Cookie/Authorization) 的指纹；无凭据时为空串"""
+    creds = sorted(f'{k.lower()}:{v}' for k, v in (headers or {}).items() if k.lower() in _CREDENTIAL_HEADERS)
+    return hashlib.sha256('\n'.join(creds).encode('utf-8')).hexdigest()[:32] if creds else ''
+
+
+class ThumbnailCache:
+    def __init__(self, root: str, pool_size: int = 8, max_bytes: int = MAX_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._refs = os.path.join(root, 'refs')
+        os.makedirs(self._refs, exist_ok=True)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=1)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._session.headers['User-Agent'] = _USER_AGENT
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._size_lock = threading.Lock()
+        self._size = sum(size for _, _, size in self._entries())
+        # 探测结果中出现过的封面 URL：/api/thumbnail 只代取这些 (或已缓存的) 地址
+        self._known: 'OrderedDict[str, None]' = OrderedDict()
+        self._known_lock = threading.Lock()
+
+    # ---------------- 内容寻址存储 ----------------
+    def path_for(self, name: str) -> Optional[str]:
+        """缓存文件名 -> 路径 (只接受本缓存生成的文件名)"""
+        stem, _, ext = name.partition('.')
+        if len(stem) != 32 or not all(c in '0123456789abcdef' for c in stem) or not ext.isalnum():
+            return None
+        path = os.path.join(self.root, name)
+        return path if os.path.isfile(path) else None
+
+    def _store(self, data: bytes, ext: str) -> str:
+        name = f"{hashlib.sha256(data).hexdigest()[:32]}.{ext}"
+        path = os.path.join(self.root, name)
+        if not os.path.exists(path):
+            fd, tmp = tempfile.mkstemp(prefix='.thumb-', dir=self.root)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp, 0o644)  # mkstemp 默认 0600
+            os.replace(tmp, path)
+            with self._size_lock:
+                self._size += len(data)
+                over = self._size > self.max_bytes
+            if over:
+                self._evict(keep=path)
+        return path
+
+    def _entries(self):
+        """(路径, mtime, 大小)；mtime 在命中时刷新，作为最近使用时间"""
+        try:
+            it = os.scandir(self.root)
+        except OSError:
+            return []
+        out = []
+        with it:
+            for e in it:
+                if e.is_file() and self.path_for(e.name):
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    out.append((e.path, st.st_mtime, st.st_size))
+        return out
+
+    def _evict(self, keep: Optional[str] = None):
+        """按最近使用时间淘汰到上限的 80%，并清理指向已删除文件的 URL 映射"""
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        target = int(self.max_bytes * 0.8)
+        removed = 0
+        for path, _, size in entries:
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self._size_lock:
+            self._size = total
+        if removed:
+            try:
+                refs = os.listdir(self._refs)
+            except OSError:
+                refs = []
+            for ref in refs:
+                ref_path = os.path.join(self._refs, ref)
+                try:
+                    with open(ref_path, 'r', encoding='utf-8') as f:
+                        alive = self.path_for(f.read().strip())
+                    if not alive:
+                        os.remove(ref_path)
+                except OSError:
+                    pass
+            logger.info(f"[thumbnail] 缓存超过上限，淘汰 {removed} 个文件")
+
+    # ---------------- 允许代取的 URL ----------------
+    def remember(self, url: str):
+        with self._known_lock:
+            self._known[url] = None
+            self._known.move_to_end(url)
+            while len(self._known) > 4096:
+                self._known.popitem(last=False)
+
+    def is_known(self, url: str) -> bool:
+        with self._known_lock:
+            if url in self._known:
+                return True
+        return self.lookup(url) is not None
+
+    def _ref_path(self, url: str, want: str, cred: str = '') -> str:
+        key = f'{want}|{cred}|{url}' if cred else f'{want}|{url}'
+        return os.path.join(self._refs, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def lookup(self, url: str, want: str = 'any', cred: str = '') -> Optional[str]:
+        """cred 为请求凭据指纹 (_credential_key)：带凭据取得的封面只对同一凭据命中"""
+        try:
+            with open(self._ref_path(url, want, cred), 'r', encoding='utf-8') as f:
+                path = self.path_for(f.read().strip())
+        except OSError:
+            return None
+        if path:
+            try:
+                os.utime(path)  # 记录最近使用，供淘汰
+            except OSError:
+                pass
+        return path
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    # ---------------- 下载 / 转换 ----------------
+    def _fetch(self, url: str, headers: Optional[Dict[str, str]], proxy: Optional[str], timeout: float) -> bytes:
+        proxies = {'http': proxy, 'https': proxy} if proxy else None
+        # 不让 requests 自动跟随重定向：每一跳都重新检查目标地址
+        for _ in range(MAX_REDIRECTS + 1):
+            check_public_url(url)
+            with self._session.get(url, headers=headers or {}, proxies=proxies, timeout=timeout, stream=True,
+                                   allow_redirects=False) as resp:
+                if not proxy:
+                    _check_peer(resp)
+                if resp.is_redirect:
+                    next_url = urljoin(url, resp.headers.get('Location', ''))
+                    # 与 requests 自身的重定向处理一致：换主机后不再携带凭据
+                    if headers and urlparse(next_url).hostname != urlparse(url).hostname:
+                        headers = {k: v for k, v in headers.items() if k.lower() not in _CREDENTIAL_HEADERS}
+                    url = next_url
+                    continue
+                resp.raise_for_status()
+                chunks, size = [], 0
+                for chunk in resp.iter_content(64 * 1024):
+                    size += len(chunk)
+                    if size > MAX_THUMBNAIL_BYTES:
+                        raise ValueError('封面文件过大')
+                    chunks.append(chunk)
+            return b''.join(chunks)
+        raise ValueError('封面地址重定向次数过多')
+
+    @staticmethod
+    def _to_jpg(src: str, ffmpeg_bin: str) -> Optional[bytes]:
+        fd, out = tempfile.mkstemp(suffix='.jpg', dir=os.path.dirname(src))
+        os.close(fd)
+        try:
+            p = subprocess.run([ffmpeg_bin, '-y', '-loglevel', 'error', '-i', src, '-frames:v', '1', '-q:v', '2', out],
+                               capture_output=True, timeout=30, creationflags=CREATE_NO_WINDOW)
+            if p.returncode != 0:
+                return None
+            with open(out, 'rb') as f:
+                return f.read()
+        except (OSError, subprocess.SubprocessError):
+            return None
+        finally:
+            try:
+                os.remove(out)
+            except OSError:
+                pass
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None, proxy: Optional[str] = None,
+            want_jpg: bool = False, ffmpeg_bin: Optional[str] = None, timeout: float = 20) -> Tuple[str, bool]:
+        """返回 (缓存文件路径, 是否命中缓存)；下载失败或内容不是图片时抛出异常"""
+        want = 'jpg' if want_jpg else 'any'
+        cred = _credential_key(headers)
+        hit = self.lookup(url, want, cred)
+        if hit:
+            return hit, True
+        with self._lock_for(f'{want}|{cred}|{url}'):
+            hit = self.lookup(url, want, cred)
+            if hit:
+                return hit, True
+            original = self.lookup(url, 'any', cred)
+            if original is None:
+                data = self._fetch(url, headers, proxy, timeout)
+                ext = sniff_image_ext(data)
+                if ext is None:
+                    raise ValueError('返回内容不是图片')
+                original = self._store(data, ext)
+                self._write_ref(url, 'any', original, cred)
+            path = original
+            if want_jpg and not original.endswith('.jpg') and ffmpeg_bin:
+                converted = self._to_jpg(original, ffmpeg_bin)
+                if converted:
+                    path = self._store(converted, 'jpg')
+            if want_jpg and path.endswith('.jpg'):
+                self._write_ref(url, 'jpg', path, cred)
+            return path, False
+
+    def _write_ref(self, url: str, want: str, path: str, cred: str = ''):
+        ref = self._ref_path(url, want, cred)
+        tmp = ref + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(os.path.basename(path))
+        os.replace(tmp, ref)
+
+
+_cache: Optional[ThumbnailCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache() -> ThumbnailCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                root = (os.environ.get('UMD_THUMB_CACHE_DIR') or data_path('thumbnails')
+                        or os.path.join(tempfile.gettempdir(), 'umd-thumbnails'))
+                _cache = ThumbnailCache(root)
+    return _cache
+
+
+__all__ = ['ThumbnailCache', 'get_thumbnail_cache', 'sniff_image_ext', 'check_public_url']
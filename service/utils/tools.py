@@ -0,0 +1,292 @@
+"""
+外部工具注册表
+启动时并行解析一次 ffmpeg / ffprobe / aria2c / yt-dlp 及 yt-dlp 插件目录 (路径、版本、能力)，
+之后直接返回缓存结果：找不到的工具同样缓存为"不可用"，不会在每次调用时重新扫描候选并执行 -version。
+只在显式 refresh() 或检测到可执行文件变化 (大小/mtime 变化、文件消失) 时重新解析。
+
+环境变量:
+  UMD_TOOLS_CHECK_SEC   文件变化检查的最小间隔 (秒)，默认 30；0 关闭自动检查
+"""
+import functools
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import dependencies as deps
+from .dependencies import CREATE_NO_WINDOW
+
+logger = logging.getLogger(__name__)
+
+try:
+    TOOLS_CHECK_SEC = float(os.environ.get('UMD_TOOLS_CHECK_SEC', '') or 30)
+except ValueError:
+    TOOLS_CHECK_SEC = 30.0
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_EXE_SUFFIXES = ('.exe', '') if os.name == 'nt' else ('', '.exe')
+
+
+@dataclass
+class ToolInfo:
+    name: str
+    path: Optional[str] = None
+    version: Optional[str] = None
+    capabilities: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+    resolved_at: float = 0.0
+    signature: Optional[Tuple[int, int]] = None  # (size, mtime_ns)，用于检测文件变化
+
+    @property
+    def available(self) -> bool:
+        return bool(self.path)
+
+    def to_dict(self) -> Dict[str, object]:
+        d = asdict(self)
+        d.pop('signature', None)
+        d['available'] = self.available
+        return d
+
+
+def _signature(path: Optional[str]) -> Optional[Tuple[int, int]]:
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _run(cmd: List[str], timeout: float = 6) -> Optional[subprocess.CompletedProcess]:
+    try:
+        return subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore',
+                              timeout=timeout, creationflags=CREATE_NO_WINDOW)
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _first_line(text: str) -> Optional[str]:
+    for line in (text or '').splitlines():
+        if line.strip():
+            return line.strip()
+    return None
+
+
+@functools.lru_cache(maxsize=64)
+def tool_in_dir(directory: str, name: str) -> Optional[str]:
+    """目录中名为 name 的可执行文件 (Windows 优先 .exe)；不存在返回 None。
+    结果 (包括 None) 被缓存，ToolRegistry.refresh() 时清空"""
+    for suffix in _EXE_SUFFIXES:
+        cand = os.path.join(directory, name + suffix)
+        if os.path.isfile(cand):
+            return cand
+    return None
+
+
+# ---------------- 各工具的解析器：返回填好的 ToolInfo ----------------
+def _resolve_ffmpeg() -> ToolInfo:
+    info = ToolInfo('ffmpeg')
+    checked = []
+    for cand in deps.ffmpeg_candidates():
+        if not cand or cand in checked:
+            continue
+        checked.append(cand)
+        if not os.path.exists(cand):
+            continue
+        r = _run([cand, '-hide_banner', '-version'], timeout=4)
+        if r is None or r.returncode != 0:
+            continue
+        info.path = cand
+        m = re.match(r'ffmpeg version (\S+)', _first_line(r.stdout) or '')
+        info.version = m.group(1) if m else _first_line(r.stdout)
+        # 边下边合并 (http:ffmpeg) 需要 https/tls 协议，原生 HLS 回退需要 hls
+        p = _run([cand, '-hide_banner', '-protocols'], timeout=4)
+        protocols = set((p.stdout if p else '').split())
+        info.capabilities = [c for c in ('https', 'tls', 'hls', 'crypto') if c in protocols]
+        logger.info(f"[TOOLS] ffmpeg: {cand} ({info.version})")
+        return info
+    info.error = f'未找到可用 ffmpeg (已检查 {len(checked)} 个候选)'
+    logger.warning(f"[TOOLS] {info.error}")
+    return info
+
+
+def _resolve_ffprobe() -> ToolInfo:
+    info = ToolInfo('ffprobe')
+    dirs = []
+    for cand in deps.ffmpeg_candidates():
+        if cand and os.path.dirname(cand) not in dirs:
+            dirs.append(os.path.dirname(cand))
+    paths = [tool_in_dir(d, 'ffprobe') for d in dirs if d and os.path.isdir(d)]
+    paths.append(shutil.which('ffprobe'))
+    for cand in paths:
+        if not cand:
+            continue
+        r = _run([cand, '-hide_banner', '-version'], timeout=4)
+        if r is None or r.returncode != 0:
+            continue
+        info.path = cand
+        m = re.match(r'ffprobe version (\S+)', _first_line(r.stdout) or '')
+        info.version = m.group(1) if m else _first_line(r.stdout)
+        return info
+    info.error = '未找到可用 ffprobe'
+    return info
+
+
+def _resolve_aria2c() -> ToolInfo:
+    info = ToolInfo('aria2c')
+    path = deps.detect_aria2c()
+    if not path:
+        info.error = '未找到 aria2c'
+        return info
+    info.path = path
+    r = _run([path, '--version'])
+    if r is not None and r.returncode == 0:
+        m = re.match(r'aria2 version (\S+)', _first_line(r.stdout) or '')
+        info.version = m.group(1) if m else _first_line(r.stdout)
+        feat = re.search(r'Enabled Features:\s*(.+)', r.stdout)
+        if feat:
+            info.capabilities = [f.strip().lower() for f in feat.group(1).split(',') if f.strip()]
+    return info
+
+
+def _resolve_ytdlp() -> ToolInfo:
+    info = ToolInfo('yt-dlp')
+    path = str(getattr(deps.config, 'YTDLP_PATH', '') or '')
+    if not path:
+        info.error = '未配置 yt-dlp 路径'
+        return info
+    info.path = path
+    r = _run([path, '--version'], timeout=10)
+    if r is None or r.returncode != 0:
+        info.error = '无法获取 yt-dlp 版本'
+        return info
+    info.version = _first_line(r.stdout)
+    return info
+
+
+def _resolve_plugin_dir() -> ToolInfo:
+    info = ToolInfo('plugin_dir')
+    candidates = [
+        os.path.join(_REPO_ROOT, 'yt-dlp-plugins'),
+        os.path.join(_REPO_ROOT, 'yt-dlp-plugins', 'yt-dlp-plugin-yellow-master'),
+    ]
+    for cand in candidates:
+        if not os.path.isdir(cand):
+            continue
+        if os.path.isdir(os.path.join(cand, 'yt_dlp_plugins')):
+            info.path = cand
+            return info
+        try:
+            for entry in os.listdir(cand):
+                if os.path.isdir(os.path.join(cand, entry, 'yt_dlp_plugins')):
+                    info.path = cand
+                    return info
+        except OSError:
+            continue
+    return info
+
+
+_RESOLVERS: Dict[str, Callable[[], ToolInfo]] = {
+    'ffmpeg': _resolve_ffmpeg,
+    'ffprobe': _resolve_ffprobe,
+    'aria2c': _resolve_aria2c,
+    'yt-dlp': _resolve_ytdlp,
+    'plugin_dir': _resolve_plugin_dir,
+}
+
+
+class ToolRegistry:
+    """解析一次、按需刷新的外部工具表"""
+
+    def __init__(self, resolvers: Optional[Dict[str, Callable[[], ToolInfo]]] = None,
+                 check_interval: float = TOOLS_CHECK_SEC):
+        self._resolvers = dict(resolvers or _RESOLVERS)
+        self.check_interval = check_interval
+        self._tools: Dict[str, ToolInfo] = {}
+        self._lock = threading.RLock()
+        self._checked_at = 0.0
+
+    @property
+    def names(self) -> List[str]:
+        """可解析的工具名"""
+        return list(self._resolvers)
+
+    def _resolve_one(self, name: str) -> ToolInfo:
+        try:
+            info = self._resolvers[name]()
+        except Exception as e:
+            info = ToolInfo(name, error=str(e))
+        info.resolved_at = time.time()
+        info.signature = _signature(info.path) if name != 'plugin_dir' else None
+        return info
+
+    def refresh(self, names: Optional[Iterable[str]] = None) -> Dict[str, ToolInfo]:
+        """(重新) 解析指定工具，默认全部；各工具并行校验"""
+        names = [n for n in (names or self._resolvers) if n in self._resolvers]
+        # 目录查找结果 (含"未找到") 也要作废，否则新装进已检查目录的工具在刷新后仍不可见
+        tool_in_dir.cache_clear()
+        with self._lock:
+            if len(names) == 1:
+                results = [self._resolve_one(names[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=len(names) or 1, thread_name_prefix='tools') as pool:
+                    results = list(pool.map(self._resolve_one, names))
+            for info in results:
+                self._tools[info.name] = info
+            self._checked_at = time.time()
+            return dict(self._tools)
+
+    def _check_changes(self):
+        if self.check_interval <= 0 or time.time() - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if time.time() - self._checked_at < self.check_interval:
+                return
+            self._checked_at = time.time()
+            changed = [n for n, t in self._tools.items() if t.path and t.signature is not None
+                       and _signature(t.path) != t.signature]
+        if changed:
+            logger.info(f"[TOOLS] 检测到可执行文件变化，重新解析: {', '.join(changed)}")
+            self.refresh(changed)
+
+    def get(self, name: str) -> ToolInfo:
+        if name not in self._tools:
+            with self._lock:
+                if not self._tools:
+                    self.refresh()
+                elif name not in self._tools:
+                    self.refresh([name])
+        else:
+            self._check_changes()
+        return self._tools.get(name) or ToolInfo(name, error='未知工具')
+
+    def path(self, name: str) -> Optional[str]:
+        return self.get(name).path
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        if not self._tools:
+            self.refresh()
+        return {name: info.to_dict() for name, info in self._tools.items()}
+
+
+_registry: Optional[ToolRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_tool_registry() -> ToolRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ToolRegistry()
+    return _registry
+
+
+__all__ = ['ToolInfo', 'ToolRegistry', 'get_tool_registry', 'tool_in_dir']
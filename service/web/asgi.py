@@ -0,0 +1,241 @@
+"""
+可选 ASGI 服务模式 (UMD_SERVER=asgi)
+
+长连接与耗时探测在事件循环内处理，不再每个连接占用一个线程：
+  - POST /api/info                 探测通过 asyncio 子进程等待
+  - GET  /api/events               多路复用 SSE (异步生成器)
+  - GET  /api/tasks/<id>/events    单任务 SSE
+  - GET  /api/stream_task          兼容入口 (仅观察)
+其余路由原样交给 Flask (asgiref.wsgi.WsgiToAsgi)，行为与线程模式一致。
+异步路由绕过 Flask，安装了 flask_cors 时由这里补上与 CORS(app) 默认配置相同的响应头
+(回显请求 Origin + Vary: Origin)；OPTIONS 预检仍由 Flask 处理。
+下载本身仍由 TaskManager 的工作线程执行，与连接数无关。
+
+依赖 (可选): uvicorn, asgiref
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import parse_qs
+
+from ..tasks.manager import get_task_manager
+from ..utils.common import validate_url
+from .sse import event_stream, task_log_stream, drive_async, sse_message, parse_event_id
+
+logger = logging.getLogger(__name__)
+
+try:
+    import flask_cors  # noqa: F401  (app.py 中有它时才启用 CORS(app))
+    _CORS_ENABLED = True
+except ImportError:
+    _CORS_ENABLED = False
+
+# 同时进行的异步探测上限 (每个探测是一个 yt-dlp 子进程)
+ASYNC_PROBE_LIMIT = int(os.environ.get('UMD_ASYNC_PROBE_LIMIT', '32') or 32)
+
+_TASK_EVENTS_RE = re.compile(r'^/api/tasks/([^/]+)/events$')
+_SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+
+class AsgiApp:
+    """把异步路由挂在 Flask 应用之前的 ASGI 入口"""
+
+    def __init__(self, flask_app, on_startup: Optional[Callable[[], Any]] = None):
+        try:
+            from asgiref.wsgi import WsgiToAsgi
+        except ImportError as e:
+            raise RuntimeError('ASGI 模式需要安装 asgiref: pip install asgiref uvicorn') from e
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.on_startup = on_startup
+        self._probe_sem: Optional[asyncio.Semaphore] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            await self.wsgi(scope, receive, send)
+            return
+
+        path, method = scope.get('path', ''), scope.get('method', 'GET')
+        if path == '/api/info' and method == 'POST':
+            await self._api_info(scope, receive, self._cors_send(scope, send))
+        elif path == '/api/events' and method == 'GET':
+            await self._events(scope, receive, self._cors_send(scope, send))
+        elif path == '/api/stream_task' and method == 'GET':
+            await self._stream_task(scope, receive, self._cors_send(scope, send))
+        elif method == 'GET' and _TASK_EVENTS_RE.match(path):
+            await self._task_events(scope, receive, self._cors_send(scope, send), _TASK_EVENTS_RE.match(path).group(1))
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    if self.on_startup:
+                        self.on_startup()
+                    await send({'type': 'lifespan.startup.complete'})
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # ---------------- helpers ----------------
+    def _cors_send(self, scope, send):
+        """给异步路由的响应补上 CORS 头 (与 Flask 路由经 CORS(app) 得到的一致)"""
+        origin = self._header(scope, b'origin')
+        if not _CORS_ENABLED or not origin:
+            return send
+
+        async def send_with_cors(message):
+            if message['type'] == 'http.response.start':
+                message = {**message, 'headers': [*message.get('headers', []),
+                                                  (b'access-control-allow-origin', origin.encode('latin-1')),
+                                                  (b'vary', b'Origin')]}
+            await send(message)
+        return send_with_cors
+
+    def _json_body(self, status: int, obj: Any):
+        # 与 flask.jsonify 使用同一 JSON provider，保证输出一致
+        body = (self.flask_app.json.dumps(obj) + '\n').encode('utf-8')
+        return status, [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())], body
+
+    async def _respond(self, send, status: int, headers, body: bytes):
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    @staticmethod
+    async def _read_json(scope, receive) -> Dict[str, Any]:
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return {}
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        headers = dict(scope.get('headers') or [])
+        if b'json' not in headers.get(b'content-type', b''):
+            return {}
+        try:
+            data = json.loads(b''.join(chunks) or b'null')
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    @staticmethod
+    def _query(scope) -> Dict[str, str]:
+        qs = parse_qs((scope.get('query_string') or b'').decode('latin-1'))
+        return {k: v[0] for k, v in qs.items() if v}
+
+    @staticmethod
+    def _header(scope, name: bytes) -> Optional[str]:
+        for k, v in scope.get('headers') or []:
+            if k.lower() == name:
+                return v.decode('latin-1')
+        return None
+
+    async def _stream(self, receive, send, core, tm):
+        disconnected = asyncio.Event()
+
+        async def _watch():
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    disconnected.set()
+                    return
+
+        watcher = asyncio.ensure_future(_watch())
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': _SSE_HEADERS})
+            if tm is None:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+                return
+            async for chunk in drive_async(tm, core, disconnected):
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            watcher.cancel()
+
+    # ---------------- routes ----------------
+    async def _api_info(self, scope, receive, send):
+        data = await self._read_json(scope, receive)
+        tm = get_task_manager()
+        if not tm:
+            await self._respond(send, *self._json_body(500, {'error': 'Task manager not initialized'}))
+            return
+        url = data.get('url')
+        if not url or not validate_url(url):
+            await self._respond(send, *self._json_body(400, {'error': 'Invalid URL'}))
+            return
+
+        from ..tasks.downloader import _probe_info_async
+        from ..tasks.models import Task
+
+        if self._probe_sem is None:
+            self._probe_sem = asyncio.Semaphore(ASYNC_PROBE_LIMIT)
+        temp_task = Task(id='temp-probe', url=url)
+        try:
+            async with self._probe_sem:
+                info = await _probe_info_async(tm, temp_task)
+            await self._respond(send, *self._json_body(200, info))
+        except Exception as e:
+            logger.error(f"Probe failed: {e}")
+            await self._respond(send, *self._json_body(500, {'error': str(e)}))
+
+    async def _events(self, scope, receive, send):
+        tm = get_task_manager()
+        if not tm:
+            await self._respond(send, 500, [(b'content-type', b'text/html; charset=utf-8')], b'Task manager not initialized')
+            return
+        query = self._query(scope)
+        task_ids = [i.strip() for i in (query.get('tasks') or '').split(',') if i.strip()] or None
+        last_id = parse_event_id(self._header(scope, b'last-event-id') or query.get('last_event_id'))
+        await self._stream(receive, send, event_stream(tm, task_ids, last_id), tm)
+
+    async def _task_events(self, scope, receive, send, task_id: str):
+        tm = get_task_manager()
+        if not tm:
+            await self._respond(send, 500, [(b'content-type', b'text/html; charset=utf-8')], b'Task manager not initialized')
+            return
+        if not tm.get_task(task_id):
+            await self._respond(send, *self._json_body(404, {'error': 'Task not found'}))
+            return
+        query = self._query(scope)
+        cursor = parse_event_id(self._header(scope, b'last-event-id') or query.get('last_event_id')) \
+            or parse_event_id(query.get('cursor'))
+        await self._stream(receive, send, task_log_stream(tm, task_id, cursor), tm)
+
+    async def _stream_task(self, scope, receive, send):
+        tm = get_task_manager()
+        if not tm:
+            await self._respond(send, 500, [(b'content-type', b'text/html; charset=utf-8')], b'Task manager not initialized')
+            return
+        task_id = self._query(scope).get('task_id')
+        if task_id and tm.get_task(task_id):
+            await self._task_events(scope, receive, send, task_id)
+            return
+        msg = 'Task not found' if task_id else '请先 POST /api/tasks 创建任务，再订阅 /api/tasks/<id>/events'
+        await self._respond(send, 200, _SSE_HEADERS, sse_message({'error': msg}).encode('utf-8'))
+
+
+def serve_asgi(flask_app, host: str, port: int, on_startup: Optional[Callable[[], Any]] = None):
+    """用 uvicorn 运行 ASGI 模式 (单进程，TaskManager 保持单例)"""
+    import uvicorn
+    uvicorn.run(AsgiApp(flask_app, on_startup=on_startup), host=host, port=port, workers=1,
+                log_level='info', timeout_keep_alive=30)
+
+
+__all__ = ['AsgiApp', 'serve_asgi', 'ASYNC_PROBE_LIMIT']
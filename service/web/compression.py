@@ -0,0 +1,36 @@
+"""
+JSON 响应 gzip 压缩 (标准库实现，无额外依赖)
+仅处理非流式的 application/json 响应；SSE 等流式响应保持原样以免缓冲。
+"""
+import gzip
+import os
+
+from flask import request
+
+GZIP_MIN_BYTES = int(os.environ.get('UMD_GZIP_MIN_BYTES', '1024') or 1024)
+GZIP_LEVEL = 6
+
+
+def _compress_json_response(response):
+    if response.mimetype != 'application/json' or response.direct_passthrough or response.is_streamed:
+        return response
+    if response.status_code < 200 or response.status_code >= 300 or 'Content-Encoding' in response.headers:
+        return response
+    if 'gzip' not in (request.headers.get('Accept-Encoding') or '').lower():
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Length'] = str(len(response.get_data()))
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_compression(app):
+    app.after_request(_compress_json_response)
+    return app
+
+
+__all__ = ['init_compression']
@@ -5,11 +5,72 @@ import traceback
 from flask import Blueprint, request, jsonify, Response
 from ..tasks.manager import get_task_manager
 from ..utils.common import validate_url, _safe_get_json
+from .sse import event_stream, task_log_stream, drive_sync, sse_message, parse_event_id
 
 logger = logging.getLogger(__name__)
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+
+def _last_event_id() -> int:
+    """浏览器自动重连时带 Last-Event-ID 头；首次连接也允许用 ?last_event_id= 指定"""
+    return parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+
+
+_TRUTHY = ('1', 'true', 'yes', 'on')
+
+
+def _flag(params, *names: str) -> bool:
+    for name in names:
+        v = params.get(name)
+        if v is None:
+            continue
+        if isinstance(v, bool):
+            return v
+        return str(v).strip().lower() in _TRUTHY
+    return False
+
+
+def _task_kwargs_from_params(params) -> dict:
+    """把 JSON body 或查询参数统一转换为 Task 构造参数（兼容前端的旧字段名）"""
+    kwargs = {
+        'url': params.get('url'),
+        'mode': params.get('mode') or 'merged',
+        'quality': params.get('quality') or 'best',
+        'skip_probe': _flag(params, 'skip_probe'),
+        'write_thumbnail': _flag(params, 'write_thumbnail', 'thumbnail'),
+        'geo_bypass': _flag(params, 'geo_bypass'),
+        'subtitles_only': _flag(params, 'subtitles_only'),
+        'auto_subtitles': _flag(params, 'auto_subtitles'),
+        'force_download': _flag(params, 'force_download', 'force'),
+    }
+
+    subs = params.get('sub_langs') or params.get('subtitles') or []
+    if isinstance(subs, str):
+        subs = subs.split(',')
+    kwargs['subtitles'] = [str(s).strip() for s in subs if str(s).strip()]
+
+    for name in ('video_format', 'audio_format'):
+        if params.get(name):
+            kwargs[name] = str(params.get(name))
+
+    info_cache = params.get('info_cache')
+    if isinstance(info_cache, str) and info_cache:
+        try:
+            import urllib.parse
+            info_cache = json.loads(urllib.parse.unquote(info_cache))
+        except Exception:
+            info_cache = None
+    if isinstance(info_cache, dict):
+        kwargs['info_cache'] = info_cache
+
+    meta_mode = params.get('meta_mode', params.get('meta'))
+    if meta_mode is not None:
+        meta_mode = str(meta_mode)
+        kwargs['meta_mode'] = 'off' if meta_mode == '0' else meta_mode
+    return kwargs
+
+
 @api_bp.route('/tasks', methods=['GET'])
 def list_tasks():
     tm = get_task_manager()
@@ -19,6 +80,11 @@ def list_tasks():
 
 @api_bp.route('/tasks', methods=['POST'])
 def add_task():
+    """创建下载任务（唯一的创建入口）
+
+    支持 Idempotency-Key 头或 body.idempotency_key：同一键重复提交返回同一任务，
+    避免网络重试导致重复下载。创建后通过 /api/tasks/<id>/events 观察进度。
+    """
     tm = get_task_manager()
     if not tm:
         return jsonify({'error': 'Task manager not initialized'}), 500
@@ -28,7 +94,39 @@ def add_task():
     if not url or not validate_url(url):
         return jsonify({'error': 'Invalid URL'}), 400
 
-    task = tm.add_task(**data)
+    key = (request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '').strip() or None
+    task = tm.add_task(idempotency_key=key, **_task_kwargs_from_params(data))
+    return jsonify(task.to_dict())
+
+@api_bp.route('/subtitles/batch', methods=['POST'])
+def add_subtitle_batch():
+    """字幕批量任务：多个 URL (视频/播放列表/频道) × 多个语言合并为一个任务
+
+    body: {urls: [...], sub_langs: 'en,zh-Hans' | [...], auto_subtitles, geo_bypass}
+    产物全部记录在任务的 output_files 中。
+    """
+    tm = get_task_manager()
+    if not tm:
+        return jsonify({'error': 'Task manager not initialized'}), 500
+
+    data = _safe_get_json(request)
+    urls = data.get('urls') or []
+    if isinstance(urls, str):
+        urls = urls.split()
+    elif not isinstance(urls, list):
+        return jsonify({'error': 'urls must be a string or a list'}), 400
+    urls = list(dict.fromkeys(str(u).strip() for u in urls if str(u).strip()))
+    invalid = [u for u in urls if not validate_url(u)]
+    if not urls or invalid:
+        return jsonify({'error': 'Invalid URL', 'invalid': invalid}), 400
+
+    kwargs = _task_kwargs_from_params({**data, 'url': urls[0]})
+    if not kwargs['subtitles'] and not kwargs['auto_subtitles']:
+        return jsonify({'error': 'sub_langs or auto_subtitles required'}), 400
+    kwargs.update(subtitles_only=True, skip_probe=True, batch_urls=urls,
+                  info_cache={'title': f'字幕批量 ({len(urls)} 个 URL)'})
+    key = (request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '').strip() or None
+    task = tm.add_task(idempotency_key=key, **kwargs)
     return jsonify(task.to_dict())
 
 @api_bp.route('/tasks/<task_id>/cancel', methods=['POST'])
@@ -70,110 +168,58 @@ def api_info():
         logger.error(f"Probe failed: {e}")
         return jsonify({'error': str(e)}), 500
 
+@api_bp.route('/tasks/<task_id>/events')
+def task_events(task_id):
+    """SSE 只读观察指定任务（不会创建任务），支持 Last-Event-ID / ?cursor= 日志游标续传"""
+    tm = get_task_manager()
+    if not tm:
+        return "Task manager not initialized", 500
+    if not tm.get_task(task_id):
+        return jsonify({'error': 'Task not found'}), 404
+    cursor = _last_event_id()
+    if not cursor:
+        try:
+            cursor = max(0, int(request.args.get('cursor', '0')))
+        except ValueError:
+            cursor = 0
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(drive_sync(tm, task_log_stream(tm, task_id, cursor)), mimetype="text/event-stream", headers=headers)
+
+
 @api_bp.route('/stream_task')
 def stream_task():
-    """SSE 增量推送任务状态与日志 - 同时支持通过 URL 参数创建任务"""
+    """兼容旧入口：仅按 task_id 观察任务
+
+    GET 不再创建任务 —— EventSource 断线重连会重放 GET，曾导致重复下载。
+    请先 POST /api/tasks 创建，再订阅 /api/tasks/<id>/events。
+    """
     tm = get_task_manager()
     if not tm:
         return "Task manager not initialized", 500
 
-    # 从 URL 参数解析任务配置
-    url = request.args.get('url')
-    if not url or not validate_url(url):
-        def error_stream():
-            yield f"data: {json.dumps({'error': 'Invalid URL'})}\n\n"
-        return Response(error_stream(), mimetype="text/event-stream")
-
-    # 解析任务参数
-    mode = request.args.get('mode', 'merged')
-    quality = request.args.get('quality', 'best')
-    meta_mode = request.args.get('meta', None)
-    skip_probe = request.args.get('skip_probe', '0') == '1'
-    write_thumbnail = request.args.get('write_thumbnail', '0') == '1'
-    video_format = request.args.get('video_format')
-    audio_format = request.args.get('audio_format')
-    geo_bypass = request.args.get('geo_bypass', '0') == '1'
-
-    # 解析 info_cache
-    info_cache = None
-    info_cache_raw = request.args.get('info_cache')
-    if info_cache_raw:
-        try:
-            import urllib.parse
-            info_cache = json.loads(urllib.parse.unquote(info_cache_raw))
-        except Exception:
-            pass
-
-    # 解析字幕参数
-    subtitles_only = request.args.get('subtitles_only', '0') == '1'
-    subtitles = []
-    sub_langs = request.args.get('sub_langs')
-    if sub_langs:
-        subtitles = [s.strip() for s in sub_langs.split(',') if s.strip()]
-    auto_subtitles = request.args.get('auto_subtitles', '0') == '1'
-
-    # 构建任务参数
-    task_kwargs = {
-        'url': url,
-        'mode': mode,
-        'quality': quality,
-        'skip_probe': skip_probe,
-        'write_thumbnail': write_thumbnail,
-        'geo_bypass': geo_bypass,
-        'subtitles_only': subtitles_only,
-        'subtitles': subtitles,
-        'auto_subtitles': auto_subtitles,
-    }
-    if video_format:
-        task_kwargs['video_format'] = video_format
-    if audio_format:
-        task_kwargs['audio_format'] = audio_format
-    if info_cache:
-        task_kwargs['info_cache'] = info_cache
-    if meta_mode is not None:
-        task_kwargs['meta_mode'] = 'off' if meta_mode == '0' else meta_mode
-
-    # 创建任务
-    task = tm.add_task(**task_kwargs)
-    task_id = task.id
-    logger.info(f"[SSE] 创建任务 {task_id} for {url}")
-
-    def event_stream():
-        import time
-        last_log_idx = 0
-        yield f"data: {json.dumps({'task_id': task_id, 'type': 'init'})}\n\n"
-
-        while True:
-            t = tm.get_task(task_id)
-            if not t:
-                yield f"data: {json.dumps({'error': 'Task not found'})}\n\n"
-                break
-
-            # 发送新日志
-            if len(t.log) > last_log_idx:
-                for line in t.log[last_log_idx:]:
-                    yield f"data: {json.dumps({'type': 'log', 'line': line})}\n\n"
-                last_log_idx = len(t.log)
-
-            # 发送状态更新
-            status_data = {
-                'type': 'status',
-                'status': t.status,
-                'stage': t.stage,
-                'progress': t.progress,
-                'title': t.title,
-                'file_path': t.file_path,
-                'error_message': t.error_message,
-            }
-            yield f"data: {json.dumps(status_data)}\n\n"
-
-            # 终止条件
-            if t.status in ('finished', 'error', 'canceled'):
-                break
-
-            time.sleep(0.5)
-
-    return Response(event_stream(), mimetype="text/event-stream")
+    task_id = request.args.get('task_id')
+    if task_id and tm.get_task(task_id):
+        return task_events(task_id)
+
+    def error_stream():
+        msg = 'Task not found' if task_id else '请先 POST /api/tasks 创建任务，再订阅 /api/tasks/<id>/events'
+        yield sse_message({'error': msg})
+    return Response(error_stream(), mimetype="text/event-stream")
+
+
+@api_bp.route('/events')
+def events():
+    """多路复用 SSE：一个连接推送全部任务（或 ?tasks=a,b 指定子集）的状态与日志增量
+
+    支持 Last-Event-ID 断线续传；连接数与下载任务数无关。
+    """
+    tm = get_task_manager()
+    if not tm:
+        return "Task manager not initialized", 500
+    raw_ids = request.args.get('tasks') or ''
+    task_ids = [i.strip() for i in raw_ids.split(',') if i.strip()] or None
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(drive_sync(tm, event_stream(tm, task_ids, _last_event_id())), mimetype="text/event-stream", headers=headers)
 
 @api_bp.route('/diag/ytdlp_version')
 def ytdlp_version():
@@ -181,6 +227,177 @@ def ytdlp_version():
     version = get_ytdlp_version()
     return jsonify({'version': version})
 
+@api_bp.route('/diag/strategies')
+def strategy_memory():
+    """按站点记忆的下载策略 (候选路径/参数档案/衰减后的成功失败权重/速度) 与并发调优状态"""
+    from ..tasks.strategy import get_strategy_memory
+    from ..tasks.tuning import get_concurrency_tuner
+    return jsonify({'strategies': get_strategy_memory().snapshot(), 'tuning': get_concurrency_tuner().snapshot()})
+
+@api_bp.route('/diag/aria2')
+def aria2_status():
+    """常驻 aria2c (RPC 模式) 的全局状态；只读，不会为查看状态而启动守护进程"""
+    from ..tasks.aria2_rpc import aria2_rpc_enabled
+    tm = get_task_manager()
+    if not tm or not aria2_rpc_enabled():
+        return jsonify({'enabled': False})
+    rpc = tm._aria2_rpc
+    if rpc is None or not rpc.alive():
+        return jsonify({'enabled': True, 'running': False, 'aria2c_path': tm.aria2c_path})
+    try:
+        return jsonify({'enabled': True, 'running': True, 'pid': rpc.proc.pid, 'stat': rpc.global_stat()})
+    except Exception as e:
+        return jsonify({'enabled': True, 'running': False, 'error': str(e)})
+
+@api_bp.route('/diag/disk')
+def disk_status():
+    """下载目录剩余空间与各任务的磁盘预留"""
+    tm = get_task_manager()
+    if not tm:
+        return jsonify({'error': 'Task manager not initialized'}), 500
+    return jsonify(tm.disk.snapshot())
+
+@api_bp.route('/diag/tools')
+def tools_status():
+    """已解析的外部工具 (路径/版本/能力)；?refresh=1 时重新解析"""
+    from ..utils.tools import get_tool_registry
+    registry = get_tool_registry()
+    if _flag(request.args, 'refresh'):
+        registry.refresh()
+    return jsonify(registry.snapshot())
+
+@api_bp.route('/diag/tools/refresh', methods=['POST'])
+def tools_refresh():
+    """显式重新解析外部工具 (安装/替换 ffmpeg、aria2c 后调用)"""
+    from ..utils.tools import get_tool_registry
+    params = _safe_get_json(request) or {}
+    names = params.get('tools') or None
+    registry = get_tool_registry()
+    if isinstance(names, str):
+        names = [n.strip() for n in names.split(',') if n.strip()]
+    if names is not None:
+        unknown = [n for n in names if n not in registry.names] if isinstance(names, list) else [names]
+        if unknown or not names:
+            return jsonify({'error': 'Unknown tools', 'unknown': unknown, 'known': registry.names}), 400
+    tm = get_task_manager()
+    registry.refresh(names)
+    if tm and (not names or 'aria2c' in names):
+        tm.aria2c_path = registry.path('aria2c')
+    return jsonify(registry.snapshot())
+
+@api_bp.route('/thumbnails/<name>')
+def cached_thumbnail(name):
+    """内容寻址缓存中的封面 (文件名即内容哈希，可长期缓存)"""
+    from flask import send_file
+    from ..utils.thumbcache import get_thumbnail_cache
+    path = get_thumbnail_cache().path_for(name)
+    if not path:
+        return jsonify({'error': 'Not found'}), 404
+    resp = send_file(path, max_age=365 * 24 * 3600)
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
+
+@api_bp.route('/thumbnail')
+def thumbnail_by_url():
+    """按封面 URL 取图：经缓存下载后重定向到 /api/thumbnails/<内容哈希>。
+    只代取探测结果中出现过或已缓存的封面地址，不作为通用的服务端抓取入口"""
+    from flask import redirect
+    from ..utils.thumbcache import get_thumbnail_cache
+    url = request.args.get('url') or ''
+    cache = get_thumbnail_cache()
+    if not validate_url(url):
+        return jsonify({'error': 'Invalid URL'}), 400
+    if not cache.is_known(url):
+        return jsonify({'error': 'Unknown thumbnail URL'}), 403
+    try:
+        path, _ = cache.get(url, proxy=os.environ.get('LUMINA_PROXY') or os.environ.get('UMD_PROXY') or None)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 502
+    return redirect(f"/api/thumbnails/{os.path.basename(path)}")
+
+@api_bp.route('/diag/library')
+def library_status():
+    """媒体库索引概况 (文件数/总大小/去重开关)"""
+    tm = get_task_manager()
+    if not tm:
+        return jsonify({'error': 'Task manager not initialized'}), 500
+    if tm.library is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **tm.library.stats()})
+
+def _query_time(value):
+    """时间参数：Unix 秒或 YYYY-MM-DD[THH:MM[:SS]] (本地时间)"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    from datetime import datetime
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f'无效时间: {value}')
+
+@api_bp.route('/library')
+def library_search():
+    """查询媒体库：q/title/uploader/url 全文检索；since/until 完成时间；min_height/max_height；vcodec/acodec/mode；limit/offset"""
+    tm = get_task_manager()
+    if not tm:
+        return jsonify({'error': 'Task manager not initialized'}), 500
+    if tm.library is None:
+        return jsonify({'error': '媒体库索引不可用'}), 503
+    args = request.args
+    try:
+        until = _query_time(args.get('until'))
+        if until is not None and len(args.get('until', '')) == 10:  # 仅日期时包含当天
+            until += 86400 - 0.001
+        kwargs = {
+            'q': args.get('q'), 'title': args.get('title'), 'uploader': args.get('uploader'), 'url': args.get('url'),
+            'since': _query_time(args.get('since')), 'until': until,
+            'min_height': int(args['min_height']) if args.get('min_height') else None,
+            'max_height': int(args['max_height']) if args.get('max_height') else None,
+            'vcodec': args.get('vcodec'), 'acodec': args.get('acodec'), 'mode': args.get('mode'),
+            'limit': int(args.get('limit') or 50), 'offset': int(args.get('offset') or 0),
+        }
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    import time as _time
+    started = _time.perf_counter()
+    result = tm.library.search(**kwargs)
+    result['elapsed_ms'] = round((_time.perf_counter() - started) * 1000, 2)
+    return jsonify(result)
+
+@api_bp.route('/library/<int:row_id>')
+def library_item(row_id):
+    """单条媒体库记录及其元数据 (index 模式的 meta 表，其次 sidecar 文件)"""
+    tm = get_task_manager()
+    if not tm:
+        return jsonify({'error': 'Task manager not initialized'}), 500
+    if tm.library is None:
+        return jsonify({'error': '媒体库索引不可用'}), 503
+    row = tm.library.get(row_id)
+    if not row:
+        return jsonify({'error': 'not found'}), 404
+    meta = tm.library.get_meta(row['path'])
+    if meta is None and os.path.exists(row['path'] + '.meta.json'):
+        try:
+            with open(row['path'] + '.meta.json', 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+    return jsonify({**row, 'meta': meta})
+
+@api_bp.route('/library/scan', methods=['POST'])
+def library_scan():
+    """增量导入下载目录中的 meta.json 并清理已删除文件的记录"""
+    tm = get_task_manager()
+    if not tm:
+        return jsonify({'error': 'Task manager not initialized'}), 500
+    if tm.library is None:
+        return jsonify({'error': '媒体库索引不可用'}), 503
+    return jsonify(tm.scan_library())
+
 @api_bp.route('/open_download_dir', methods=['POST'])
 def open_download_dir():
     import subprocess
@@ -200,27 +417,46 @@ def last_finished_file():
     tm = get_task_manager()
     if not tm: return jsonify({'found': False, 'error': 'not initialized'})
     
-    # Search backwards through tasks by updated_at
-    sorted_tasks = sorted(tm.tasks.values(), key=lambda t: t.updated_at, reverse=True)
-    for task in sorted_tasks:
-        if task.status == 'finished' and task.file_path and os.path.exists(task.file_path):
-            return jsonify({'found': True, 'file': task.file_path})
-            
+    # 内存中最近完成的任务 (单次遍历取最大值)；其文件已不在或重启后无任务时查媒体库
+    with tm.tasks_lock:
+        task = max((t for t in tm.tasks.values() if t.status == 'finished' and t.file_path),
+                   key=lambda t: t.updated_at, default=None)
+    if task and os.path.exists(task.file_path):
+        return jsonify({'found': True, 'file': task.file_path})
+    row = tm.library.latest() if tm.library is not None else None
+    if row:
+        return jsonify({'found': True, 'file': row['path'], 'id': row['id']})
     return jsonify({'found': False})
 
 @api_bp.route('/reveal_file', methods=['POST'])
 def reveal_file():
     data = _safe_get_json(request)
     name = data.get('name')
-    if not name: return jsonify({'success': False, 'error': 'no name'})
+    row_id = data.get('id')
+    if not name and row_id is None: return jsonify({'success': False, 'error': 'no name'})
     
     import subprocess
     from ..tasks.manager import get_task_manager
     tm = get_task_manager()
     if not tm: return jsonify({'success': False, 'error': 'not initialized'})
     
-    target_path = os.path.join(tm.download_dir, name)
-    if os.path.exists(target_path):
+    if row_id is not None:
+        # 媒体库记录 (/api/library 返回的 id)
+        try:
+            row = tm.library.get(int(row_id)) if tm.library is not None else None
+        except (TypeError, ValueError):
+            row = None
+        target_path = row['path'] if row else None
+    else:
+        target_path = os.path.realpath(os.path.join(tm.download_dir, name))
+        base = os.path.realpath(tm.download_dir)
+        try:
+            inside = os.path.commonpath([target_path, base]) == base
+        except ValueError:  # Windows 下位于不同盘符
+            inside = False
+        if not inside:
+            return jsonify({'success': False, 'error': 'invalid name'})
+    if target_path and '"' not in target_path and os.path.exists(target_path):
         import shlex
         try:
             subprocess.run(f'explorer /select,"{target_path}"', shell=True)
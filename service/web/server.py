@@ -0,0 +1,81 @@
+"""
+服务启动入口：按 UMD_SERVER 选择运行方式 (app.py / run.py 共用)
+
+  auto (默认)  已安装 waitress 时使用 waitress，否则回退 Werkzeug 开发服务器
+  waitress     多线程生产级 WSGI 服务器
+  asgi         uvicorn + 异步探测/SSE (见 service/web/asgi.py)
+  dev          Werkzeug 开发服务器 (threaded=True)
+
+所有模式都是单进程：TaskManager 为进程级单例 (service/tasks/manager.py 中的
+_task_manager)，多进程 worker 会产生多个互不相知的任务队列，因此这里只扩展
+请求处理线程，不提供 workers 参数。
+
+调优环境变量 (waitress):
+  UMD_THREADS           请求处理线程数 (SSE 长连接各占一个线程)，默认 32
+  UMD_BACKLOG           listen 队列长度，默认 1024
+  UMD_CONNECTION_LIMIT  最大同时连接数，默认 1000
+  UMD_KEEPALIVE_SEC     空闲 keep-alive 连接的关闭超时 (秒)，默认 120
+"""
+import logging
+import os
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, '') or default)
+    except ValueError:
+        return default
+
+
+def server_mode() -> str:
+    mode = (os.environ.get('UMD_SERVER') or 'auto').strip().lower()
+    return mode if mode in ('auto', 'waitress', 'asgi', 'dev') else 'auto'
+
+
+def _serve_dev(app, host: str, port: int):
+    app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
+
+
+def _serve_waitress(app, host: str, port: int):
+    from waitress import serve
+    threads = _env_int('UMD_THREADS', 32)
+    backlog = _env_int('UMD_BACKLOG', 1024)
+    connection_limit = _env_int('UMD_CONNECTION_LIMIT', 1000)
+    keepalive = _env_int('UMD_KEEPALIVE_SEC', 120)
+    logger.info(f"waitress 模式: threads={threads}, backlog={backlog}, connection_limit={connection_limit}, keepalive={keepalive}s")
+    serve(app, host=host, port=port, threads=threads, backlog=backlog,
+          connection_limit=connection_limit, channel_timeout=keepalive,
+          ident='UniversalMediaDownloader')
+
+
+def serve_app(app, host: str, port: int, on_startup: Optional[Callable[[], Any]] = None):
+    """按配置的模式启动服务 (阻塞)"""
+    mode = server_mode()
+    if on_startup:
+        on_startup()
+
+    if mode == 'asgi':
+        try:
+            from .asgi import serve_asgi
+            logger.info("ASGI 模式: 探测与 SSE 在事件循环内处理")
+            serve_asgi(app, host=host, port=port, on_startup=on_startup)
+            return
+        except ImportError as e:
+            logger.warning(f"ASGI 模式不可用 ({e})，回退到 WSGI；可执行 pip install uvicorn asgiref")
+            mode = 'auto'
+
+    if mode in ('auto', 'waitress'):
+        try:
+            _serve_waitress(app, host, port)
+            return
+        except ImportError:
+            level = logging.WARNING if mode == 'waitress' else logging.INFO
+            logger.log(level, "未安装 waitress，使用 Werkzeug 开发服务器；生产环境请 pip install waitress")
+
+    _serve_dev(app, host, port)
+
+
+__all__ = ['serve_app', 'server_mode']
@@ -0,0 +1,139 @@
+"""
+SSE 流生成逻辑 (sans-IO)
+核心生成器 yield 文本块或 BusWait 请求；同步驱动 (Flask 线程) 与异步驱动 (ASGI 事件循环)
+各自完成等待，保证两种服务模式输出完全一致。
+"""
+import asyncio
+import json
+from typing import Any, AsyncIterator, Iterator, NamedTuple, Optional
+
+SSE_HEARTBEAT_SEC = 15.0
+TERMINAL_STATUSES = ('finished', 'error', 'canceled')
+
+
+class BusWait(NamedTuple):
+    """核心生成器发出的等待请求，驱动方 send 回 (events, truncated, cursor)"""
+    cursor: int
+    task_ids: Optional[list]
+
+
+def sse_message(payload: dict, event_id: Optional[int] = None) -> str:
+    head = f"id: {event_id}\n" if event_id else ''
+    return f"{head}data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def parse_event_id(raw: Optional[str]) -> int:
+    try:
+        return max(0, int(raw or '0'))
+    except ValueError:
+        return 0
+
+
+def _task_snapshot(t) -> dict:
+    d = {'type': 'snapshot', 'task_id': t.id, **t.to_status()}
+    d['log'] = t.log[-200:]
+    return d
+
+
+def event_stream(tm, task_ids: Optional[list], last_id: int):
+    """多路复用流：可订阅全部任务或指定子集
+
+    - 首次连接或游标已滚出缓冲区时先推送任务快照
+    - 空闲时按 SSE_HEARTBEAT_SEC 发送注释心跳，便于代理保活与断线探测
+    """
+    yield "retry: 3000\n\n"
+    cursor = last_id
+    need_snapshot = last_id == 0
+    while True:
+        if need_snapshot:
+            cursor = tm.events.last_id
+            with tm.tasks_lock:
+                targets = [tm.tasks[i] for i in task_ids if i in tm.tasks] if task_ids else list(tm.tasks.values())
+                snapshots = [_task_snapshot(t) for t in targets]
+            for snap in snapshots:
+                yield sse_message(snap, cursor)
+            need_snapshot = False
+        events, truncated, cursor = yield BusWait(cursor, task_ids)
+        if truncated:
+            need_snapshot = True
+            continue
+        if not events:
+            yield ": ping\n\n"
+            continue
+        for ev in events:
+            yield sse_message(ev, ev['event_id'])
+
+
+def task_log_stream(tm, task_id: str, cursor: int):
+    """只读观察单个任务：按日志游标续传
+
+    每条日志的 SSE id 为其序号 (从 1 开始)，浏览器重连时携带 Last-Event-ID
+    即从下一行继续；状态消息总是当前快照，重复发送无副作用。
+    """
+    yield "retry: 3000\n\n"
+    yield sse_message({'task_id': task_id, 'type': 'init', 'cursor': cursor})
+    bus_cursor = tm.events.last_id
+    while True:
+        t = tm.get_task(task_id)
+        if not t:
+            yield sse_message({'error': 'Task not found'})
+            return
+        lines = t.log[cursor:]
+        for line in lines:
+            cursor += 1
+            yield sse_message({'type': 'log', 'line': line}, cursor)
+        yield sse_message({'type': 'status', **t.to_status()}, cursor)
+        if t.status in TERMINAL_STATUSES:
+            yield sse_message({'event': 'end'}, cursor)
+            return
+        events, _, bus_cursor = yield BusWait(bus_cursor, [task_id])
+        if not events:
+            yield ": ping\n\n"
+
+
+def drive_sync(tm, core) -> Iterator[str]:
+    """在当前线程内阻塞等待事件总线 (Flask / WSGI)"""
+    reply: Any = None
+    while True:
+        try:
+            item = core.send(reply)
+        except StopIteration:
+            return
+        reply = None
+        if isinstance(item, BusWait):
+            reply = tm.events.wait_for(item.cursor, item.task_ids, timeout=SSE_HEARTBEAT_SEC)
+        else:
+            yield item
+
+
+async def drive_async(tm, core, disconnected: Optional[asyncio.Event] = None) -> AsyncIterator[str]:
+    """在事件循环内等待事件总线 (ASGI)；客户端断开时立即结束"""
+    reply: Any = None
+    while True:
+        if disconnected is not None and disconnected.is_set():
+            core.close()
+            return
+        try:
+            item = core.send(reply)
+        except StopIteration:
+            return
+        reply = None
+        if not isinstance(item, BusWait):
+            yield item
+            continue
+        waiter = asyncio.ensure_future(tm.events.wait_for_async(item.cursor, item.task_ids, timeout=SSE_HEARTBEAT_SEC))
+        if disconnected is None:
+            reply = await waiter
+            continue
+        gone = asyncio.ensure_future(disconnected.wait())
+        await asyncio.wait({waiter, gone}, return_when=asyncio.FIRST_COMPLETED)
+        gone.cancel()
+        if not waiter.done():
+            waiter.cancel()
+            core.close()
+            return
+        reply = waiter.result()
+
+
+__all__ = ['SSE_HEARTBEAT_SEC', 'TERMINAL_STATUSES', 'BusWait', 'sse_message', 'parse_event_id',
+           'event_stream', 'task_log_stream', 'drive_sync', 'drive_async']
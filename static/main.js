@@ -545,6 +545,34 @@ function mapQualityForBackend(raw) {
     return val; // best / fast / best4k / best8k / height<=X 等
 }
 
+function newIdempotencyKey() {
+    if (window.crypto && typeof window.crypto.randomUUID === 'function') return window.crypto.randomUUID();
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+
+// 通过 POST 创建任务；网络失败时用同一个幂等键重试，后端保证不会重复创建
+async function createTask(body, attempts = 3) {
+    const key = newIdempotencyKey();
+    let lastErr = null;
+    for (let i = 0; i < attempts; i++) {
+        try {
+            const resp = await fetch('/api/tasks', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json', 'Idempotency-Key': key },
+                body: JSON.stringify(body)
+            });
+            const data = await resp.json();
+            if (!resp.ok || data.error) throw new Error(data.error || `HTTP ${resp.status}`);
+            return data;
+        } catch (e) {
+            lastErr = e;
+            if (!(e instanceof TypeError)) break;  // 仅网络错误重试
+            await new Promise(r => setTimeout(r, 500 * (i + 1)));
+        }
+    }
+    throw lastErr;
+}
+
 function closeCurrentEventSource() {
     if (currentEventSource) {
         try { currentEventSource.close(); } catch (e) { }
@@ -566,6 +594,7 @@ function updateStageStatus(stage, status) {
         case 'queued': label = '队列中'; break;
         case 'downloading': label = '下载中'; break;
         case 'merging': label = '合并处理中'; break;
+        case 'postprocess': label = '等待后处理'; break;
         case 'finished': label = '完成'; break;
         case 'error': label = '出错'; break;
         default: break;
@@ -573,7 +602,7 @@ function updateStageStatus(stage, status) {
     statusText.textContent = label;
 }
 
-function downloadMedia() {
+async function downloadMedia() {
     const videoUrl = document.getElementById('videoUrl').value.trim();
     if (!videoUrl) {
         const errorMessage = document.getElementById('error-message');
@@ -616,34 +645,27 @@ function downloadMedia() {
     progressUrl.textContent = videoUrl;
     addLog(`创建任务: mode=${mode} quality=${quality}`);
 
-    const params = new URLSearchParams();
-    params.set('url', videoUrl);
-    params.set('mode', mode);
-    params.set('quality', quality);
-    if (subtitles) params.set('subtitles', subtitles);
+    const body = { url: videoUrl, mode: mode, quality: quality };
+    if (subtitles) body.subtitles = subtitles;
     const metaToggle = document.getElementById('metaToggle');
     if (metaToggle) {
-        params.set('meta', metaToggle.checked ? '1' : '0');
+        body.meta = metaToggle.checked ? '1' : '0';
     }
     const fastStart = document.getElementById('fastStartToggle');
     // 条件：勾选快速启动 + 已经有 currentVideoInfo（即前面获取过 /api/info）
     if (fastStart && fastStart.checked) {
         if (currentVideoInfo && currentVideoInfo.title) {
-            try {
-                const minimalInfo = {
-                    title: currentVideoInfo.title,
-                    id: currentVideoInfo.id || currentVideoInfo.video_id || undefined,
-                    duration: currentVideoInfo.duration || undefined,
-                    max_height: currentVideoInfo.max_height || undefined
-                };
-                // 清理 undefined 字段
-                Object.keys(minimalInfo).forEach(k => minimalInfo[k] === undefined && delete minimalInfo[k]);
-                params.set('skip_probe', '1');
-                params.set('info_cache', encodeURIComponent(JSON.stringify(minimalInfo)));
-                addLog('启用快速启动 fast-path: ' + JSON.stringify(minimalInfo));
-            } catch (e) {
-                addLog('快速启动 JSON 序列化失败: ' + e, 'error');
-            }
+            const minimalInfo = {
+                title: currentVideoInfo.title,
+                id: currentVideoInfo.id || currentVideoInfo.video_id || undefined,
+                duration: currentVideoInfo.duration || undefined,
+                max_height: currentVideoInfo.max_height || undefined
+            };
+            // 清理 undefined 字段
+            Object.keys(minimalInfo).forEach(k => minimalInfo[k] === undefined && delete minimalInfo[k]);
+            body.skip_probe = true;
+            body.info_cache = minimalInfo;
+            addLog('启用快速启动 fast-path: ' + JSON.stringify(minimalInfo));
         } else {
             addLog('未获取视频信息，无法启用快速启动（将执行正常探测）', 'warning');
         }
@@ -651,21 +673,31 @@ function downloadMedia() {
     // 封面图下载
     const thumbnailToggle = document.getElementById('thumbnailToggle');
     if (thumbnailToggle && thumbnailToggle.checked) {
-        params.set('thumbnail', '1');
+        body.write_thumbnail = true;
         addLog('启用封面图下载');
     }
     if (vfmt && afmt && qualityRaw !== 'best') {
-        params.set('video_format', vfmt);
-        params.set('audio_format', afmt);
+        body.video_format = vfmt;
+        body.audio_format = afmt;
         addLog(`使用直选格式: v=${vfmt} a=${afmt}`);
     }
-    if (mode === 'audio_only' || mode === 'video_only') {
-        // no special flag
-    }
 
-    const sseUrl = `/api/stream_task?${params.toString()}`;
     downloadStartTime = Date.now();
-    currentEventSource = new EventSource(sseUrl);
+    let task;
+    try {
+        task = await createTask(body);
+    } catch (e) {
+        addLog('创建任务失败: ' + e.message, 'error');
+        errorMessage.textContent = '创建任务失败: ' + e.message;
+        errorMessage.style.display = 'block';
+        updateStageStatus('error');
+        downloadButton.disabled = false;
+        downloadButton.textContent = '📥 下载媒体';
+        return;
+    }
+    currentTaskId = task.id;
+    addLog(`任务ID: ${currentTaskId}`);
+    currentEventSource = new EventSource(`/api/tasks/${encodeURIComponent(task.id)}/events`);
 
     currentEventSource.onmessage = (ev) => {
         if (!ev.data) return;
@@ -682,10 +714,6 @@ function downloadMedia() {
             closeCurrentEventSource();
             return;
         }
-        if (data.task_id && !currentTaskId) {
-            currentTaskId = data.task_id;
-            addLog(`任务ID: ${currentTaskId}`);
-        }
         if (data.type === 'log') {
             addLog(data.line);
         } else if (data.type === 'status') {
@@ -732,6 +760,11 @@ function downloadMedia() {
     };
 
     currentEventSource.onerror = () => {
+        // 连接中断时浏览器会携带 Last-Event-ID 自动重连，从日志游标处继续，不会重复创建任务
+        if (currentEventSource && currentEventSource.readyState === EventSource.CONNECTING) {
+            addLog('SSE 连接中断，正在重连...', 'warning');
+            return;
+        }
         addLog('SSE 连接出错或中断', 'error');
         const errorMessage = document.getElementById('error-message');
         errorMessage.textContent = '与服务器的连接中断，请检查后端服务是否仍在运行。';
@@ -762,7 +795,7 @@ async function cancelDownload() {
     document.getElementById('remainingTime').textContent = '--:--';
 }
 
-function downloadSubtitles() {
+async function downloadSubtitles() {
     const videoUrl = document.getElementById('videoUrl').value.trim();
     const subtitles = document.getElementById('subtitles').value;
     const btn = document.querySelector('.subtitle-btn');
@@ -783,12 +816,21 @@ function downloadSubtitles() {
     resetProgressUI();
     document.getElementById('progress').style.display = 'block';
     btn.disabled = true; btn.textContent = '字幕任务中...';
-    const params = new URLSearchParams();
-    params.set('url', videoUrl); params.set('mode', 'merged'); params.set('subtitles', subtitles); params.set('subtitles_only', 'true'); params.set('quality', 'best');
-    const sseUrl = `/api/stream_task?${params.toString()}`;
     downloadStartTime = Date.now();
-    currentEventSource = new EventSource(sseUrl);
     addLog('创建字幕任务: ' + subtitles);
+    let task;
+    try {
+        task = await createTask({ url: videoUrl, mode: 'merged', subtitles: subtitles, subtitles_only: true, quality: 'best' });
+    } catch (e) {
+        addLog('字幕任务创建失败: ' + e.message, 'error');
+        errorMessage.textContent = '字幕任务创建失败: ' + e.message;
+        errorMessage.style.display = 'block';
+        btn.disabled = false;
+        btn.textContent = '字幕下载';
+        return;
+    }
+    currentTaskId = task.id;
+    currentEventSource = new EventSource(`/api/tasks/${encodeURIComponent(task.id)}/events`);
     currentEventSource.onmessage = (ev) => {
         if (!ev.data) return; let data; try { data = JSON.parse(ev.data); } catch (e) { return; }
         if (data.error) {
@@ -814,6 +856,10 @@ function downloadSubtitles() {
         }
     };
     currentEventSource.onerror = () => {
+        if (currentEventSource && currentEventSource.readyState === EventSource.CONNECTING) {
+            addLog('字幕 SSE 连接中断，正在重连...', 'warning');
+            return;
+        }
         addLog('字幕 SSE 连接出错', 'error');
         errorMessage.textContent = '与服务器的连接中断，请检查后端服务是否仍在运行。';
         errorMessage.style.display = 'block';